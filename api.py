@@ -1,15 +1,52 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Query
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.formparsers import MultiPartParser
+from contextlib import asynccontextmanager
 from uuid import uuid4
+import asyncio
+import json
+import os
 import shutil
+import time
+import zipfile
+from datetime import date, timedelta
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import Dict, Any, List, Optional
-from core.document_pipeline import DocumentPipelineManager
-from core.action_generator import ACTION_GENERATORS, actions_for_other
+from typing import Dict, Any, AsyncIterator, List, Literal, Optional, Tuple
+from core.document_pipeline import DocumentPipelineManager, parse_classification_windows
+from core.document_loader import count_pages
+from core.metrics import REGISTRY, UPLOADS, timed
+from core.document_store import DocumentStore
+from core.job_queue import JobQueue, QueueFullError
+from core.result_cache import ResultCache
+from core.invoice_templates import InvoiceTemplateStore
+from core.llm_transport import LLMTransport
+from core.uploads import Upload, UploadTooLargeError, read_upload
+from core.action_generator import generate_actions
 
 ###### Load shared components and initialize FastAPI app ######
-app = FastAPI()
-documents_db = {}
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global warm_up_task
+    job_queue.start()
+    # WARMUP=1: import the LLM libraries, build the pipeline's clients and start the loader
+    # processes once the app is up, instead of when the first documents arrive
+    if os.getenv("WARMUP", "0") == "1":
+        warm_up_task = asyncio.create_task(asyncio.to_thread(pipeline.warm_up))
+    yield
+    if warm_up_task is not None:
+        await asyncio.gather(warm_up_task, return_exceptions=True)
+    await job_queue.stop()
+    await pipeline.aclose()
+    document_store.close()
+    if pipeline.near_duplicates is not None:
+        pipeline.near_duplicates.close()
+    if pipeline.invoice_templates is not None:
+        pipeline.invoice_templates.close()
+
+app = FastAPI(lifespan=lifespan)
+# Shared by all uvicorn workers through the SQLite file (DOCUMENT_STORE sets its path)
+document_store = DocumentStore(os.getenv("DOCUMENT_STORE", "data/documents.sqlite"))
 
 # Load shared components
 LABELS_WITH_DESCRIPTIONS = {
@@ -18,7 +55,49 @@ LABELS_WITH_DESCRIPTIONS = {
     "Earnings": "A financial or business report summarizing revenue, profits, expenses, and other key metrics.",
     "Other": "Any other type of document that does not fit the above categories."
 }
-pipeline = DocumentPipelineManager()
+# Optional components import their dependencies (numpy, langchain) only when enabled
+local_classifier, near_duplicates = None, None
+if os.getenv("LOCAL_CLASSIFIER_PATH"):
+    # Trained with `python -m core.local_classifier`; GPT is only called below the threshold
+    from core.local_classifier import LocalNgramClassifier
+    local_classifier = LocalNgramClassifier.load(os.environ["LOCAL_CLASSIFIER_PATH"])
+if os.getenv("NEAR_DUPLICATES", "0") == "1":
+    # Reuse classifications of templated documents (index at NEAR_DUPLICATE_INDEX)
+    from core.near_duplicates import NearDuplicateIndex
+    near_duplicates = NearDuplicateIndex(os.getenv("NEAR_DUPLICATE_INDEX", "data/near_duplicates.sqlite"))
+
+# Set RESULT_CACHE=0 to disable the result cache (e.g. for benchmarking)
+pipeline = DocumentPipelineManager(
+    cache=ResultCache() if os.getenv("RESULT_CACHE", "1") != "0" else None,
+    loader_workers=int(os.getenv("LOADER_WORKERS", "2")),
+    pdf_backend=os.getenv("PDF_BACKEND", "pdfplumber"),
+    parallel_min_pages=int(os.environ["PARALLEL_MIN_PAGES"]) if os.getenv("PARALLEL_MIN_PAGES") else None,
+    local_classifier=local_classifier,
+    local_confidence_threshold=float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", "0.8")),
+    # FUSED_ANALYSIS=1: classify and extract metadata with a single LLM call per document
+    fused=os.getenv("FUSED_ANALYSIS", "0") == "1",
+    # EXTRACTION_CHUNK_TOKENS=N: map-reduce extraction over the whole document in N-token chunks
+    extraction_chunk_tokens=int(os.environ["EXTRACTION_CHUNK_TOKENS"]) if os.getenv("EXTRACTION_CHUNK_TOKENS") else None,
+    near_duplicates=near_duplicates,
+    # INVOICE_TEMPLATES=1: extract recurring invoice layouts without the LLM (store at INVOICE_TEMPLATE_STORE)
+    invoice_templates=InvoiceTemplateStore(os.getenv("INVOICE_TEMPLATE_STORE", "data/invoice_templates.sqlite"))
+    if os.getenv("INVOICE_TEMPLATES", "0") == "1" else None,
+    # CLASSIFICATION_WINDOWS="1:400,3:1200,10:4000": classify from the first window and widen it
+    # only while the label margin is below CLASSIFICATION_MIN_MARGIN
+    classification_windows=parse_classification_windows(os.environ["CLASSIFICATION_WINDOWS"])
+    if os.getenv("CLASSIFICATION_WINDOWS") else None,
+    classification_min_margin=float(os.getenv("CLASSIFICATION_MIN_MARGIN", "0.5")),
+    # STRUCTURED_EXTRACTION=0: JSON format instructions in the prompt instead of schema-constrained answers
+    structured_extraction=os.getenv("STRUCTURED_EXTRACTION", "1") != "0",
+    # One connection pool, concurrency cap, rate limiter and retry policy for all LLM calls:
+    # LLM_MAX_CONCURRENCY requests in flight, LLM_RPM / LLM_TPM budgets (else the API's quota)
+    transport=LLMTransport(
+        max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "64")),
+        requests_per_minute=float(os.environ["LLM_RPM"]) if os.getenv("LLM_RPM") else None,
+        tokens_per_minute=float(os.environ["LLM_TPM"]) if os.getenv("LLM_TPM") else None,
+    ),
+)
+warm_up_task: Optional[asyncio.Task] = None
 
 
 class DocumentEntry(BaseModel):
@@ -45,45 +124,443 @@ For example:
 """
     )
 
+class DocumentPage(BaseModel):
+    documents: List[DocumentEntry]
+    next_cursor: Optional[str] = Field(None, description="Pass as `cursor` to get the next page; null on the last page.")
+
 class DocumentAction(BaseModel):
     type: str
     description: str
     deadline: str | None = None
     priority: str | None = "medium"
 
+class IndexedAction(DocumentAction):
+    document_id: str
+    doc_type: str
+
+class ActionPage(BaseModel):
+    actions: List[IndexedAction]
+    next_cursor: Optional[str] = Field(None, description="Pass as `cursor` to get the next page; null on the last page.")
+
+# Uploads up to UPLOAD_SPILL_BYTES are kept in memory and parsed from there; larger ones are
+# written to a uniquely named file under tmp/uploads. Files over MAX_UPLOAD_BYTES get a 413 (0: no limit)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_SPILL_BYTES = int(os.getenv("UPLOAD_SPILL_BYTES", str(8 * 1024 * 1024)))
+# Starlette keeps uploads in memory up to the same size, so read_upload takes them over without a copy
+MultiPartParser.spool_max_size = UPLOAD_SPILL_BYTES
+# Room for the multipart framing around the file in the request body
+MULTIPART_OVERHEAD = 64 * 1024
+
+async def receive_upload(file: UploadFile, spill_bytes: int = UPLOAD_SPILL_BYTES) -> Upload:
+    """Read an upload off the event loop, hashing it as it comes in; 413 when it is too large."""
+    try:
+        return await asyncio.to_thread(read_upload, file.file, Path(file.filename or "upload").name,
+                                       MAX_UPLOAD_BYTES or None, spill_bytes)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+async def run_analysis(upload: Upload, timings: Optional[Dict[str, float]] = None,
+                       usage: Optional[Dict[str, float]] = None, id: Optional[str] = None) -> DocumentEntry:
+    """
+    Load, classify and extract one received upload, store the result (with its actions) and
+    return it. Pass the `id` of a stored document to replace its analysis.
+    """
+    with timed(timings, "load"):
+        # The hash computed while receiving the upload keys the page cache
+        pages = await pipeline.aload_document(upload.source, file_hash=upload.sha256)
+    classification_result, metadata_result = await pipeline.aanalyze(pages, timings, usage)
+
+    entry = DocumentEntry(
+        id=id or str(uuid4()),
+        classification=classification_result,
+        metadata=metadata_result.model_dump() if hasattr(metadata_result, "model_dump") else metadata_result,
+    )
+    with timed(timings, "store"):
+        await asyncio.to_thread(document_store.put, entry.model_dump())
+    return entry
+
+async def run_job(upload: Upload, timings: Dict[str, float], usage: Dict[str, float]) -> str:
+    try:
+        return (await run_analysis(upload, timings, usage)).id
+    finally:
+        await asyncio.to_thread(upload.close)
+
+# Background analysis: JOB_WORKERS documents are processed at a time, at most JOB_QUEUE_SIZE wait
+job_queue = JobQueue(
+    run_job,
+    workers=int(os.getenv("JOB_WORKERS", "4")),
+    max_queued=int(os.getenv("JOB_QUEUE_SIZE", "1000")),
+    store=document_store,
+    # Uploads of jobs dropped at shutdown are deleted with them
+    discard=Upload.close,
+)
+
+###### Metrics ######
+HTTP_SECONDS = REGISTRY.histogram(
+    "pdf_analyzer_http_request_seconds", "HTTP request latency by route", ["method", "route", "status"])
+HTTP_IN_PROGRESS = REGISTRY.gauge("pdf_analyzer_http_requests_in_progress", "HTTP requests being served")
+RESULT_CACHE_LOOKUPS = REGISTRY.counter(
+    "pdf_analyzer_result_cache_lookups_total", "Result cache lookups (page texts and results)", ["kind", "result"])
+DOCUMENT_STORE_READS = REGISTRY.counter(
+    "pdf_analyzer_document_store_reads_total", "Document store reads by where they were served from", ["source"])
+LOCAL_CLASSIFIER_DECISIONS = REGISTRY.counter(
+    "pdf_analyzer_local_classifier_decisions_total", "Documents the local classifier answered or passed on", ["result"])
+JOBS = REGISTRY.gauge("pdf_analyzer_jobs", "Background jobs by state", ["state"])
+
+def collect_metrics():
+    # Counters kept by the components themselves, copied at scrape time
+    if pipeline.cache is not None:
+        stats = pipeline.cache.stats()
+        for kind, prefix in (("result", ""), ("file", "file_")):
+            RESULT_CACHE_LOOKUPS.set_total(stats[f"{prefix}hits"], kind=kind, result="hit")
+            RESULT_CACHE_LOOKUPS.set_total(stats[f"{prefix}misses"], kind=kind, result="miss")
+    DOCUMENT_STORE_READS.set_total(document_store.hits, source="memory")
+    DOCUMENT_STORE_READS.set_total(document_store.misses, source="sqlite")
+    LOCAL_CLASSIFIER_DECISIONS.set_total(pipeline.local_hits, result="answered")
+    LOCAL_CLASSIFIER_DECISIONS.set_total(pipeline.local_misses, result="passed")
+    stats = job_queue.stats()
+    JOBS.set(stats["running"], state="running")
+    for lane, queued in stats["queued"].items():
+        JOBS.set(queued, state=f"queued_{lane}")
+
+REGISTRY.add_collector(collect_metrics)
+
+@app.middleware("http")
+async def reject_large_uploads(request: Request, call_next):
+    # Single-file uploads announced larger than MAX_UPLOAD_BYTES are refused before their body
+    # is read; bodies without a Content-Length (and batch files) are checked while they are read
+    length = request.headers.get("content-length", "")
+    if (MAX_UPLOAD_BYTES and request.method == "POST" and request.url.path != "/documents/analyze-batch"
+            and length.isdigit() and int(length) > MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD):
+        UPLOADS.inc(storage="rejected")
+        return JSONResponse(status_code=413,
+                            content={"detail": f"Upload exceeds the maximum size of {MAX_UPLOAD_BYTES} bytes"})
+    return await call_next(request)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    with HTTP_IN_PROGRESS.track():
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            # Route templates ("/documents/{id}") keep the number of series bounded
+            route = getattr(request.scope.get("route"), "path", "unmatched")
+            HTTP_SECONDS.observe(time.perf_counter() - start, method=request.method, route=route, status=status)
+
+@app.get("/health")
+def get_health():
+    """Liveness / readiness probe. `warm` is true once the start-up warm-up (WARMUP=1) has finished."""
+    warm = warm_up_task is not None and warm_up_task.done() and warm_up_task.exception() is None
+    return {"status": "ok", "warm": warm}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Prometheus text exposition of this worker process's metrics."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/documents/analyze")
 async def analyze_document(file: UploadFile = File(...)):
+    return await analyze_upload(file)
+
+@app.post("/documents/{id}/reanalyze")
+async def reanalyze_document(id: str, file: UploadFile = File(...)):
+    """Analyse a new upload of a stored document and replace its metadata and actions."""
+    if document_store.get(id) is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return await analyze_upload(file, id)
+
+async def analyze_upload(file: UploadFile, id: Optional[str] = None) -> Dict[str, Any]:
+    start = time.perf_counter()
+    timings, usage = {}, {}
+    # Blocking file I/O, PDF parsing and LLM calls are all kept off the event loop
+    with timed(timings, "upload"):
+        upload = await receive_upload(file)
     try:
-        tmp_path = Path("tmp") / file.filename
-        tmp_path.parent.mkdir(exist_ok=True)
-        with open(tmp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        pages = pipeline.load_document(str(tmp_path))
-        classification_result = pipeline.classify(pages)
-        metadata_result = pipeline.extract_metadata(pages, classification_result["type"])
-
-        doc_id = str(uuid4())
-        entry = DocumentEntry(
-            id=doc_id,
-            classification=classification_result,
-            metadata=metadata_result.model_dump() if hasattr(metadata_result, "model_dump") else metadata_result,
-        )
-        documents_db[doc_id] = entry
+        entry = await run_analysis(upload, timings, usage, id)
+        timings["total"] = time.perf_counter() - start
 
         return {
             "status": "success",
-            "document_id": doc_id,
+            "document_id": entry.id,
             "classification": entry.classification,
-            "metadata": entry.metadata
+            "metadata": entry.metadata,
+            # Seconds per stage and the LLM tokens / cost spent on this document
+            "timings": {stage: round(seconds, 4) for stage, seconds in timings.items()},
+            "usage": {**usage, "cost_usd": round(usage.get("cost_usd", 0.0), 6)},
         }
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process document: {e}")
+    finally:
+        await asyncio.to_thread(upload.close)
+
+def format_event(event: str, data: Any, fmt: str) -> str:
+    if fmt == "sse":
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return json.dumps({"event": event, "data": data}, ensure_ascii=False) + "\n"
+
+async def analysis_events(upload: Upload) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Events of a streamed analysis, in order: document (page count), load_progress, classification,
+    metadata_partial (zero or more), metadata, actions, done; or error at any point. When the
+    classifier reads fewer pages than extraction, it runs as soon as those are parsed, and the
+    load_progress of the remaining pages follows the classification.
+    """
+    start = time.perf_counter()
+    timings, usage = {}, {}
+    try:
+        page_count = await asyncio.to_thread(count_pages, upload.source, pipeline.pdf_backend)
+        yield "document", {"filename": upload.filename, "pages": page_count}
+
+        # Progress callbacks arrive on the event loop while the pages are parsed; None ends a load
+        progress: asyncio.Queue = asyncio.Queue()
+
+        async def load(first_page=0, last_page=None):
+            try:
+                with timed(timings, "load"):
+                    return await pipeline.aload_document(
+                        upload.source, first_page=first_page, last_page=last_page, file_hash=upload.sha256,
+                        progress=lambda loaded, total: progress.put_nowait((first_page + loaded, first_page + total)))
+            finally:
+                progress.put_nowait(None)
+
+        # Classify from the classifier's leading pages while the rest are parsed
+        window = pipeline.classification_window()
+        loading = asyncio.create_task(load(last_page=window))
+        while (item := await progress.get()) is not None:
+            yield "load_progress", {"pages_loaded": item[0], "pages": item[1]}
+        pages = await loading
+        more_pages = asyncio.create_task(load(first_page=len(pages))) if window is not None and len(pages) == window < page_count else None
+
+        classification, metadata = None, None
+        try:
+            async for event, data in pipeline.aanalyze_events(pages, timings, usage, more_pages):
+                if event == "classification":
+                    classification = data
+                    timings["time_to_classification"] = time.perf_counter() - start
+                elif event == "metadata":
+                    metadata = data.model_dump() if hasattr(data, "model_dump") else data
+                    data = metadata
+                yield event, data
+                if event == "classification" and more_pages is not None:
+                    # Report the remaining pages as they load (extraction waits for them anyway)
+                    while (item := await progress.get()) is not None:
+                        yield "load_progress", {"pages_loaded": item[0], "pages": item[1]}
+        finally:
+            if more_pages is not None and not more_pages.done():
+                more_pages.cancel()
+
+        entry = DocumentEntry(id=str(uuid4()), classification=classification, metadata=metadata)
+        with timed(timings, "store"):
+            await asyncio.to_thread(document_store.put, entry.model_dump())
+        yield "actions", generate_actions(classification["type"], metadata)
+        timings["total"] = time.perf_counter() - start
+        yield "done", {
+            "document_id": entry.id,
+            "timings": {stage: round(seconds, 4) for stage, seconds in timings.items()},
+            "usage": {**usage, "cost_usd": round(usage.get("cost_usd", 0.0), 6)},
+        }
+    except Exception as e:
+        # The status line has already been sent, so failures are reported in-band
+        yield "error", {"detail": f"Failed to process document: {e}"}
+    finally:
+        await asyncio.to_thread(upload.close)
+
+@app.post("/documents/analyze/stream")
+async def analyze_document_stream(
+    file: UploadFile = File(...),
+    format: Literal["ndjson", "sse"] = Query("ndjson", description="ndjson: one JSON object per line; sse: Server-Sent Events"),
+):
+    # Read before streaming starts: the upload is closed once this handler returns
+    with timed(None, "upload"):
+        upload = await receive_upload(file)
+
+    async def body():
+        async for event, data in analysis_events(upload):
+            yield format_event(event, data, format)
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    # X-Accel-Buffering: keep reverse proxies (nginx) from buffering the stream
+    return StreamingResponse(body(), media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Documents analysed at a time within one batch request, and files accepted per batch
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "500"))
+
+def save_batch(files: List[UploadFile], folder: Path) -> List[Upload]:
+    """
+    Save the uploads of a batch under `folder`, expanding zip archives into their PDF members,
+    and hash each file while saving it. Each file (zip members included) is held to
+    MAX_UPLOAD_BYTES. Returns one `Upload` per file.
+    """
+    items = []
+
+    def save(name: str, source):
+        # Batch files are always written to disk (a batch holds up to BATCH_MAX_FILES of them),
+        # under a generated name: zip member names are never used as paths
+        items.append(read_upload(source, name, MAX_UPLOAD_BYTES or None, spill_bytes=0, spill_dir=folder))
+        if len(items) > BATCH_MAX_FILES:
+            raise ValueError(f"A batch holds at most {BATCH_MAX_FILES} files")
+
+    for file in files:
+        name = Path(file.filename or "upload").name
+        if not name.lower().endswith(".zip"):
+            save(name, file.file)
+            continue
+        try:
+            with zipfile.ZipFile(file.file) as archive:
+                for member in archive.infolist():
+                    if (member.is_dir() or member.filename.startswith("__MACOSX/")
+                            or not member.filename.lower().endswith(".pdf")):
+                        continue
+                    with archive.open(member) as source:
+                        save(f"{name}/{member.filename}", source)
+        except zipfile.BadZipFile as e:
+            raise ValueError(f"{name} is not a valid zip archive") from e
+    return items
+
+async def batch_events(items: List[Upload], concurrency: int) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    One "result" event per file as soon as its document is analysed (or failed), then "done".
+    Identical files (same SHA-256) are analysed once; their copies report the same document
+    with `duplicate_of` set to the first file's name.
+    """
+    start = time.perf_counter()
+    by_hash: Dict[str, List[Upload]] = {}
+    for item in items:
+        by_hash.setdefault(item.sha256, []).append(item)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def analyze(copies: List[Upload]) -> Tuple[List[Upload], Dict[str, Any]]:
+        async with semaphore:
+            timings, usage = {}, {}
+            document_start = time.perf_counter()
+            try:
+                entry = await run_analysis(copies[0], timings, usage)
+                timings["total"] = time.perf_counter() - document_start
+            except Exception as e:
+                return copies, {"status": "error", "detail": f"Failed to process document: {e}"}
+            return copies, {
+                "status": "success",
+                "document_id": entry.id,
+                "classification": entry.classification,
+                "metadata": entry.metadata,
+                "timings": {stage: round(seconds, 4) for stage, seconds in timings.items()},
+                "usage": {**usage, "cost_usd": round(usage.get("cost_usd", 0.0), 6)},
+            }
+
+    tasks = [asyncio.create_task(analyze(copies)) for copies in by_hash.values()]
+    succeeded = failed = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            copies, result = await next_done
+            for i, item in enumerate(copies):
+                if result["status"] == "success":
+                    succeeded += 1
+                else:
+                    failed += 1
+                yield "result", {"filename": item.filename, **result,
+                                 **({"duplicate_of": copies[0].filename} if i else {})}
+        yield "done", {"files": len(items), "unique": len(by_hash), "succeeded": succeeded, "failed": failed,
+                       "total": round(time.perf_counter() - start, 4)}
+    finally:
+        # The client went away: stop analysing
+        for task in tasks:
+            task.cancel()
+
+@app.post("/documents/analyze-batch")
+async def analyze_batch(
+    files: List[UploadFile] = File(..., description="PDF files and/or zip archives of PDFs"),
+    concurrency: int = Query(BATCH_CONCURRENCY, ge=1, le=64, description="Documents analysed at a time"),
+    format: Literal["ndjson", "sse"] = Query("ndjson", description="ndjson: one JSON object per line; sse: Server-Sent Events"),
+):
+    folder = Path("tmp") / "batch" / uuid4().hex
+    try:
+        with timed(None, "upload"):
+            items = await asyncio.to_thread(save_batch, files, folder)
+    except ValueError as e:
+        await asyncio.to_thread(shutil.rmtree, folder, True)
+        raise HTTPException(status_code=413 if isinstance(e, UploadTooLargeError) else 400, detail=str(e))
+
+    async def body():
+        try:
+            async for event, data in batch_events(items, concurrency):
+                yield format_event(event, data, format)
+        finally:
+            await asyncio.to_thread(shutil.rmtree, folder, True)
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(body(), media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/jobs", status_code=202)
+async def submit_job(
+    file: UploadFile = File(...),
+    lane: Literal["interactive", "bulk"] = Query("interactive", description="Priority lane"),
+):
+    # Reject before reading the upload when there is no room
+    if job_queue.queued() >= job_queue.max_queued:
+        return queue_full_response(job_queue.retry_after())
+
+    # Queued uploads can wait a while: they are always written to disk to keep memory bounded
+    with timed(None, "upload"):
+        upload = await receive_upload(file, spill_bytes=0)
+    try:
+        job = await job_queue.submit(upload, lane=lane)
+    except QueueFullError as e:
+        await asyncio.to_thread(upload.close)
+        return queue_full_response(e.retry_after)
+    return {"job_id": job.id, "status": job.status, "lane": job.lane, "status_url": f"/jobs/{job.id}"}
+
+def queue_full_response(retry_after: int) -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Job queue is full, retry later"},
+        headers={"Retry-After": str(retry_after)},
+    )
+
+@app.get("/jobs/stats")
+def get_job_stats():
+    return job_queue.stats()
+
+@app.get("/jobs/{id}")
+async def get_job(id: str):
+    job = await job_queue.get(id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["document_id"]:
+        job["document_url"] = f"/documents/{job['document_id']}"
+    return job
+
+@app.get("/documents", response_model=DocumentPage)
+def list_documents(
+    type: Optional[str] = Query(None, description="Filter by document type (e.g., Invoice)"),
+    min_confidence: Optional[float] = Query(None, ge=0, le=1),
+    max_confidence: Optional[float] = Query(None, ge=0, le=1),
+    date_field: Optional[Literal["due_date", "effective_date", "termination_date"]] = Query(
+        None, description="Only documents with this date, ordered by it (earliest first)"),
+    date_from: Optional[str] = Query(None, description="Inclusive lower bound on date_field (YYYY-MM-DD)"),
+    date_before: Optional[str] = Query(None, description="Exclusive upper bound on date_field (YYYY-MM-DD)"),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+):
+    if (date_from or date_before) and not date_field:
+        raise HTTPException(status_code=400, detail="date_from/date_before require date_field")
+    try:
+        documents, next_cursor = document_store.list(
+            doc_type=type, min_confidence=min_confidence, max_confidence=max_confidence,
+            date_field=date_field, date_from=date_from, date_before=date_before, limit=limit, cursor=cursor,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"documents": documents, "next_cursor": next_cursor}
 
 @app.get("/documents/{id}", response_model=DocumentEntry)
 def get_document(id: str):
-    doc = documents_db.get(id)
+    doc = document_store.get(id)
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
     return doc
@@ -93,20 +570,47 @@ def get_actions(
     id: str,
     priority: Optional[str] = Query(None, description="Filter actions by priority (e.g., high, medium, low)"),
 ):
-    doc = documents_db.get(id)
-    if not doc:
+    # Generated when the document was stored (see DocumentStore.put_many)
+    actions = document_store.get_actions(id)
+    if not actions and document_store.get(id) is None:
         raise HTTPException(status_code=404, detail="Document not found")
 
-    doc_type = doc.classification.get("type")
-    generator = ACTION_GENERATORS.get(doc_type, actions_for_other)
-    actions = generator(doc.metadata)
-
     # Apply optional filters
     if priority:
         actions = [a for a in actions if a.get("priority") == priority]
 
     return actions
 
+@app.get("/actions", response_model=ActionPage)
+def list_actions(
+    deadline_from: Optional[str] = Query(None, description="Inclusive lower bound on the deadline (YYYY-MM-DD)"),
+    deadline_before: Optional[str] = Query(None, description="Exclusive upper bound on the deadline (YYYY-MM-DD)"),
+    due_within_days: Optional[int] = Query(
+        None, ge=0, le=3650, description="Deadline between today and today + N days (replaces deadline_from/deadline_before)"),
+    priority: Optional[Literal["high", "medium", "low"]] = Query(None, description="Only actions of this priority"),
+    type: Optional[str] = Query(None, description="Only actions of this type (e.g., payment_due)"),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+):
+    """Actions across every stored document, earliest deadline first (undated actions last)."""
+    if due_within_days is not None:
+        today = date.today()
+        deadline_from, deadline_before = today.isoformat(), (today + timedelta(days=due_within_days + 1)).isoformat()
+    try:
+        actions, next_cursor = document_store.list_actions(
+            deadline_from=deadline_from, deadline_before=deadline_before, priority=priority,
+            action_type=type, limit=limit, cursor=cursor,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"actions": actions, "next_cursor": next_cursor}
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    if pipeline.cache is None:
+        raise HTTPException(status_code=404, detail="Result cache is disabled")
+    return pipeline.cache.stats()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("api:app", host="127.0.0.1", port=8000, reload=True)
@@ -0,0 +1,72 @@
+"""
+Load benchmark for POST /documents/analyze against a local fake OpenAI server.
+
+Starts `benchmarks.fake_openai` and the API (single uvicorn worker, result cache off),
+then fires requests from 1, 8 and 32 concurrent clients and reports requests per second.
+
+    python -m benchmarks.async_load --latency-ms 200 --requests-per-client 4
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from benchmarks.utils import corpus_files, fake_openai, fake_openai_env, free_port, serve
+
+
+async def run_clients(url: str, files, concurrency: int, requests_per_client: int) -> dict:
+    latencies = []
+    errors = 0
+
+    async def client(worker_id: int, http: httpx.AsyncClient):
+        nonlocal errors
+        for i in range(requests_per_client):
+            path = files[(worker_id + i) % len(files)]
+            start = time.perf_counter()
+            response = await http.post(url, files={"file": (path.name, path.read_bytes(), "application/pdf")})
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    async with httpx.AsyncClient(timeout=600) as http:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(i, http) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 2),
+        "p50_latency_s": round(latencies[len(latencies) // 2], 3),
+        "max_latency_s": round(latencies[-1], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=float, default=200, help="Simulated LLM latency per call")
+    parser.add_argument("--requests-per-client", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--loader-workers", type=int, default=2)
+    parser.add_argument("--folder", default="documents", help="Folder of PDFs to upload")
+    args = parser.parse_args()
+
+    files = corpus_files(args.folder)
+    api_port = free_port()
+    with fake_openai(args.latency_ms) as base_url:
+        env = {**fake_openai_env(base_url), "RESULT_CACHE": "0", "LOADER_WORKERS": str(args.loader_workers)}
+        with serve("api:app", api_port, env):
+            url = f"http://127.0.0.1:{api_port}/documents/analyze"
+            results = [asyncio.run(run_clients(url, files, c, args.requests_per_client)) for c in args.concurrency]
+
+    for result in results:
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
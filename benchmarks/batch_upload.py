@@ -0,0 +1,68 @@
+"""
+One `POST /documents/analyze-batch` request vs one `POST /documents/analyze` call per file.
+
+Starts the API against `benchmarks.fake_openai` (result cache off) and sends the bundled
+documents, repeated --copies times (the copies exercise in-batch deduplication), first one by
+one to `/documents/analyze`, then as a single batch at each --concurrency value. Reports
+wall-clock time, the slowest single document, and how many documents were analysed.
+
+    python -m benchmarks.batch_upload --copies 2 --concurrency 1 4 8
+"""
+import argparse
+import json
+import time
+
+import httpx
+
+from benchmarks.utils import REPO_ROOT, corpus_files, fake_openai, fake_openai_env, free_port, serve
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--copies", type=int, default=2, help="Times each bundled document is sent")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--latency-ms", type=float, default=300, help="Simulated LLM latency per call")
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    args = parser.parse_args()
+
+    files = [(f"{i}_{path.name}", path.read_bytes()) for i in range(args.copies) for path in corpus_files("documents")]
+    results = {}
+    with fake_openai(args.latency_ms) as url:
+        port = free_port()
+        env = {**fake_openai_env(url), "RESULT_CACHE": "0",
+               "DOCUMENT_STORE": str(REPO_ROOT / "tmp" / f"batch_upload_{port}.sqlite")}
+        with serve("api:app", port, env), httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=600) as client:
+            start, slowest = time.perf_counter(), 0.0
+            for name, data in files:
+                r = client.post("/documents/analyze", files={"file": (name, data)})
+                r.raise_for_status()
+                slowest = max(slowest, r.json()["timings"]["total"])
+            results["one request per file"] = {"wall_s": time.perf_counter() - start, "slowest_document_s": slowest,
+                                               "analysed": len(files)}
+
+            for concurrency in args.concurrency:
+                start, slowest, done = time.perf_counter(), 0.0, None
+                with client.stream("POST", "/documents/analyze-batch", params={"concurrency": concurrency},
+                                   files=[("files", file) for file in files]) as r:
+                    r.raise_for_status()
+                    for line in r.iter_lines():
+                        event = json.loads(line)
+                        if event["event"] == "result" and event["data"]["status"] == "success":
+                            slowest = max(slowest, event["data"]["timings"].get("total", 0.0))
+                        elif event["event"] == "done":
+                            done = event["data"]
+                results[f"batch, concurrency={concurrency}"] = {
+                    "wall_s": time.perf_counter() - start, "slowest_document_s": slowest,
+                    "analysed": done["unique"], "failed": done["failed"]}
+
+    print(f"{'mode':<28}{'wall s':>8}{'slowest s':>11}{'analysed':>10}")
+    for name, result in results.items():
+        print(f"{name:<28}{result['wall_s']:>8.2f}{result['slowest_document_s']:>11.2f}{result['analysed']:>10}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
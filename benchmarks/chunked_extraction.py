@@ -0,0 +1,75 @@
+"""
+Compare single-prompt and map-reduce (chunked) contract extraction on long documents.
+
+For every bundled contract with at least --min-pages pages, plus one synthetic 100+ page
+contract made by concatenating all of them, `RunnableMetadataExtractor("Contract")` is run:
+- full:    the whole text in one prompt (max_prompt_tokens=None, the old default);
+- chunked: chunk_tokens=--chunk-tokens, chunks extracted concurrently and merged.
+
+The LLM is `benchmarks.fake_openai` with a fixed latency per call plus --ms-per-1k-tokens of
+prompt, so a single prompt gets slower as the document grows while the chunked mode should
+stay close to the latency of its largest chunk.
+
+    python -m benchmarks.chunked_extraction --chunk-tokens 3000 --ms-per-1k-tokens 100
+"""
+import argparse
+import json
+import os
+import time
+
+from benchmarks.utils import corpus_files, fake_openai, fake_openai_env
+
+CONTEXT_WINDOW = 128_000  # gpt-4o-mini
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunk-tokens", type=int, default=3000)
+    parser.add_argument("--min-pages", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=800, help="Fixed simulated latency per call")
+    parser.add_argument("--ms-per-1k-tokens", type=float, default=100, help="Simulated latency per 1k prompt tokens")
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    args = parser.parse_args()
+
+    from core.content_selection import count_tokens
+    from core.document_loader import extract_pages
+    documents = []
+    for path in corpus_files("documents-extra/Contract"):
+        pages = extract_pages(str(path))
+        if len(pages) >= args.min_pages:
+            documents.append(("_".join(path.stem.split("_")[:2]), pages))
+    documents.append(("all contracts concatenated", [p for _, pages in documents for p in pages]))
+
+    rows = []
+    extra_env = {"FAKE_OPENAI_MS_PER_1K_TOKENS": str(args.ms_per_1k_tokens)}
+    with fake_openai(args.latency_ms, extra_env=extra_env) as base_url:
+        os.environ.update(fake_openai_env(base_url))
+        from core.metadata_extraction import RunnableMetadataExtractor
+        full = RunnableMetadataExtractor("Contract")
+        chunked = RunnableMetadataExtractor("Contract", chunk_tokens=args.chunk_tokens)
+        full.invoke(documents[0][1][:1])  # warm up the HTTP connection
+
+        print(f"{'document':<30}{'pages':>6}{'tokens':>8}{'full s':>8}{'chunks':>8}{'largest':>9}{'chunked s':>11}")
+        for name, pages in documents:
+            document_tokens = count_tokens(full.build_content(pages))
+            row = {"document": name, "pages": len(pages), "document_tokens": document_tokens,
+                   "fits_context_window": document_tokens < CONTEXT_WINDOW}
+            for mode, extractor in (("full", full), ("chunked", chunked)):
+                start = time.perf_counter()
+                metadata = extractor.invoke(pages)
+                row[f"{mode}_s"] = time.perf_counter() - start
+                row[f"{mode}_metadata"] = metadata.model_dump()
+            chunks = chunked.build_chunks(pages)
+            row["chunks"] = len(chunks)
+            row["largest_chunk_tokens"] = max(count_tokens(c) for c in chunks)
+            rows.append(row)
+            print(f"{name[:28]:<30}{row['pages']:>6}{document_tokens:>8}{row['full_s']:>8.2f}"
+                  f"{row['chunks']:>8}{row['largest_chunk_tokens']:>9}{row['chunked_s']:>11.2f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Report tokens saved by token-budgeted content selection, and whether the evidence needed
+for extraction survives it.
+
+For every bundled document with recorded metadata (`output/`, `output-extra/`) this compares:
+- classification prompt text: first 3 pages cut at 5500 characters (old) vs the token budget;
+- extraction prompt text: all pages (old default) vs `select_content` for the document type.
+
+Extraction quality cannot be measured offline without calling the model, so it is estimated
+with evidence recall: of the recorded metadata values (vendor, amount, dates, parties, line
+items, metric values, ...) that appear verbatim in the full text, the fraction that is still
+present in the selected text.
+
+    python -m benchmarks.content_selection_report --extraction-budget 4000
+"""
+import argparse
+import json
+import re
+from datetime import datetime
+
+from benchmarks.utils import REPO_ROOT
+from core.content_selection import count_tokens, select_content
+from core.document_loader import extract_pages
+from core.local_classifier import FOLDER_LABELS
+
+
+def _normalise(text: str) -> str:
+    return re.sub(r"\s+", " ", text.lower())
+
+
+def _number_forms(value) -> set:
+    value = float(value)
+    forms = {f"{value:,.2f}", f"{value:.2f}", f"{value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")}
+    if value.is_integer():
+        forms |= {f"{int(value):,}", str(int(value))}
+    return forms
+
+
+def _date_forms(value: str) -> set:
+    try:
+        date = datetime.strptime(value, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return {value} if value else set()
+    return {value, date.strftime("%d/%m/%Y"), date.strftime("%m/%d/%Y"), date.strftime("%d.%m.%Y"),
+            f"{date.strftime('%B')} {date.day}, {date.year}", f"{date.day} {date.strftime('%B')} {date.year}",
+            f"{date.strftime('%b')} {date.day}, {date.year}"}
+
+
+def evidence(metadata: dict) -> list:
+    """Alternative surface forms for every recorded metadata value worth looking for."""
+    items = []
+    for key in ("vendor", "reporting_period"):
+        if metadata.get(key):
+            items.append({metadata[key]})
+    if metadata.get("amount") is not None:
+        items.append(_number_forms(metadata["amount"]))
+    for key in ("due_date", "effective_date", "termination_date"):
+        if metadata.get(key):
+            items.append(_date_forms(metadata[key]))
+    for party in metadata.get("parties") or []:
+        items.append({party})
+    for item in metadata.get("line_items") or []:
+        if item.get("description"):
+            items.append({item["description"]})
+    for metric in metadata.get("key_metrics") or []:
+        if metric.get("value"):
+            items.append({metric["value"]})
+    return [{_normalise(form) for form in forms if form} for forms in items]
+
+
+def recorded_documents():
+    """Yield (key, pdf path, document type, recorded metadata)."""
+    all_results = json.loads((REPO_ROOT / "output-extra" / "all_results.json").read_text(encoding="utf-8"))
+    for folder in FOLDER_LABELS:
+        for path in sorted((REPO_ROOT / "documents-extra" / folder).glob("*")):
+            key = f"{folder}_{path.name.split('.')[0]}"
+            if path.suffix.lower() == ".pdf" and key in all_results:
+                result = all_results[key]
+                yield key, path, result["classification"]["type"], result["metadata"]
+    for path in sorted((REPO_ROOT / "documents").glob("*")):
+        golden = REPO_ROOT / "output" / f"{path.stem}.json"
+        if path.suffix.lower() == ".pdf" and golden.exists():
+            result = json.loads(golden.read_text(encoding="utf-8"))
+            yield path.stem, path, result["classification"]["type"], result["metadata"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--classification-budget", type=int, default=1200)
+    parser.add_argument("--extraction-budget", type=int, default=4000)
+    parser.add_argument("--output", help="Write per-document results as JSON to this path")
+    args = parser.parse_args()
+
+    rows = []
+    print(f"{'document':<58}{'cls old':>8}{'cls new':>8}{'ext old':>9}{'ext new':>9}{'evidence kept':>15}")
+    for key, path, doc_type, metadata in recorded_documents():
+        pages = extract_pages(str(path))
+        old_classification = "\n\n".join(p["text"] for p in pages[:3])[:5500]
+        new_classification = select_content(pages[:3], args.classification_budget)
+        old_extraction = "\n\n".join(p["text"] for p in pages)
+        new_extraction = select_content(pages, args.extraction_budget, doc_type=doc_type)
+
+        full, selected = _normalise(old_extraction), _normalise(new_extraction)
+        findable = [forms for forms in evidence(metadata) if any(f in full for f in forms)]
+        kept = [forms for forms in findable if any(f in selected for f in forms)]
+        row = {
+            "document": key, "type": doc_type, "pages": len(pages),
+            "classification_tokens_old": count_tokens(old_classification),
+            "classification_tokens_new": count_tokens(new_classification),
+            "extraction_tokens_old": count_tokens(old_extraction),
+            "extraction_tokens_new": count_tokens(new_extraction),
+            "evidence_findable": len(findable), "evidence_kept": len(kept),
+        }
+        rows.append(row)
+        kept_text = f"{len(kept)}/{len(findable)}" if findable else "-"
+        print(f"{key[:56]:<58}{row['classification_tokens_old']:>8}{row['classification_tokens_new']:>8}"
+              f"{row['extraction_tokens_old']:>9}{row['extraction_tokens_new']:>9}{kept_text:>15}")
+
+    totals = {k: sum(r[k] for r in rows) for k in rows[0] if k.endswith(("_old", "_new", "findable", "kept"))}
+    print(f"\nClassification tokens: {totals['classification_tokens_old']} -> {totals['classification_tokens_new']}")
+    print(f"Extraction tokens:     {totals['extraction_tokens_old']} -> {totals['extraction_tokens_new']} "
+          f"({1 - totals['extraction_tokens_new'] / totals['extraction_tokens_old']:.0%} saved)")
+    print(f"Evidence recall:       {totals['evidence_kept']}/{totals['evidence_findable']} "
+          f"({totals['evidence_kept'] / max(totals['evidence_findable'], 1):.0%})")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"totals": totals, "documents": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Lookup and listing latency of `DocumentStore` with a large number of stored documents.
+
+Fills a fresh store with --documents synthetic documents (realistic type mix, confidences,
+due / effective / termination dates and metadata sizes), then reports:
+- bulk insert throughput;
+- `get` latency for random ids, with a cold and a warm in-memory cache;
+- `list` latency of the first page and of a deep page (reached by following cursors) for the
+  listings the API exposes, together with SQLite's query plan for each;
+- the same for `list_actions` over the action index (about 1.7 actions per document), the
+  latency of re-storing (re-analysing) a document, and, with --scan-baseline, the time to
+  answer "high priority, due within a week" by regenerating the actions of every document.
+
+    python -m benchmarks.document_store_scale --documents 1000000
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+from datetime import date, timedelta
+from pathlib import Path
+
+from core.action_generator import generate_actions
+from core.document_store import DocumentStore
+
+TYPES = [("Invoice", 0.5), ("Contract", 0.25), ("Earnings", 0.15), ("Other", 0.10)]
+
+
+def synthetic_document(rng: random.Random) -> dict:
+    doc_type = rng.choices([t for t, _ in TYPES], weights=[w for _, w in TYPES])[0]
+    day = date(2020, 1, 1) + timedelta(days=rng.randrange(6 * 365))
+    if doc_type == "Invoice":
+        metadata = {"vendor": f"Vendor {rng.randrange(5000)}", "amount": round(rng.uniform(10, 10000), 2),
+                    "due_date": day.isoformat() if rng.random() < 0.8 else None,
+                    "line_items": [{"description": f"Item {i}", "quantity": 1, "amount": 10.0}
+                                   for i in range(rng.randrange(1, 6))]}
+    elif doc_type == "Contract":
+        metadata = {"parties": ["Party A", f"Party {rng.randrange(5000)}"], "effective_date": day.isoformat(),
+                    "termination_date": (day + timedelta(days=rng.randrange(365, 5 * 365))).isoformat(),
+                    "key_terms": ["Term of five years", "Exclusivity"]}
+    elif doc_type == "Earnings":
+        metadata = {"reporting_period": f"Q{rng.randrange(1, 5)} {day.year}",
+                    "key_metrics": [{"name": "Revenue", "value": "$1.2B"}], "executive_summary": "Revenue grew."}
+    else:
+        metadata = {"summary": "A general business document."}
+    return {"id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "classification": {"type": doc_type, "confidence": round(rng.betavariate(8, 1), 4)},
+            "metadata": metadata}
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def time_calls(fn, args_list) -> dict:
+    latencies = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {"p50_ms": round(percentile(latencies, 0.5), 3), "p99_ms": round(percentile(latencies, 0.99), 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=1_000_000)
+    parser.add_argument("--path", default="tmp/document_store_scale.sqlite")
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--deep-page", type=int, default=100, help="Page number of the deep-page measurement")
+    parser.add_argument("--scan-baseline", action="store_true",
+                        help="Also time regenerating every document's actions for one query")
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    for suffix in ("", "-wal", "-shm"):
+        Path(args.path + suffix).unlink(missing_ok=True)
+    rng = random.Random(0)
+    store = DocumentStore(args.path, max_memory_entries=10000)
+    ids = []
+    start = time.perf_counter()
+    for offset in range(0, args.documents, 10000):
+        batch = [synthetic_document(rng) for _ in range(min(10000, args.documents - offset))]
+        store.put_many(batch)
+        ids.extend(d["id"] for d in batch)
+    insert_s = time.perf_counter() - start
+    report = {"documents": store.count(), "actions": store.count_actions(),
+              "insert_docs_per_s": round(args.documents / insert_s),
+              "file_mb": round(Path(args.path).stat().st_size / 1e6, 1)}
+    print(f"{report['documents']} documents ({report['actions']} actions) inserted at "
+          f"{report['insert_docs_per_s']} docs/s, {report['file_mb']} MB")
+    store.close()
+
+    # A new store starts with an empty in-memory cache
+    store = DocumentStore(args.path, max_memory_entries=10000)
+    sample = [(rng.choice(ids),) for _ in range(args.lookups)]
+    report["get_cold"] = time_calls(store.get, sample)
+    report["get_warm"] = time_calls(store.get, sample)
+    print(f"get: cold p50 {report['get_cold']['p50_ms']} ms / p99 {report['get_cold']['p99_ms']} ms, "
+          f"warm p50 {report['get_warm']['p50_ms']} ms / p99 {report['get_warm']['p99_ms']} ms")
+
+    listings = {
+        "newest": {},
+        "invoices": {"doc_type": "Invoice"},
+        "invoices due before 2023-01-01": {"doc_type": "Invoice", "date_field": "due_date", "date_before": "2023-01-01"},
+        "contracts ending in 2026": {"doc_type": "Contract", "date_field": "termination_date",
+                                     "date_from": "2026-01-01", "date_before": "2027-01-01"},
+        "low-confidence contracts": {"doc_type": "Contract", "max_confidence": 0.6},
+    }
+    report["list"] = {}
+    print(f"\n{'listing':<34}{'first page p50 ms':>19}{'deep page p50 ms':>18}  plan")
+    for name, filters in listings.items():
+        first = time_calls(lambda: store.list(limit=50, **filters), [()] * 50)
+        cursor = None
+        for _ in range(args.deep_page - 1):
+            _, cursor = store.list(limit=50, cursor=cursor, **filters)
+            if cursor is None:
+                break
+        deep = time_calls(lambda: store.list(limit=50, cursor=cursor, **filters), [()] * 50)
+        plan = store.explain(limit=50, **filters)
+        report["list"][name] = {"first_page": first, "deep_page": deep, "plan": plan}
+        print(f"{name:<34}{first['p50_ms']:>19}{deep['p50_ms']:>18}  {'; '.join(plan)}")
+
+    action_listings = {
+        "all actions": {},
+        "high priority, due 2023-03-01..07": {"priority": "high", "deadline_from": "2023-03-01",
+                                              "deadline_before": "2023-03-08"},
+        "payments due in 2024": {"action_type": "payment_due", "deadline_from": "2024-01-01",
+                                 "deadline_before": "2025-01-01"},
+        "high priority": {"priority": "high"},
+    }
+    report["list_actions"] = {}
+    print(f"\n{'action listing':<34}{'first page p50 ms':>19}{'deep page p50 ms':>18}  plan")
+    for name, filters in action_listings.items():
+        first = time_calls(lambda: store.list_actions(limit=50, **filters), [()] * 50)
+        cursor = None
+        for _ in range(args.deep_page - 1):
+            _, cursor = store.list_actions(limit=50, cursor=cursor, **filters)
+            if cursor is None:
+                break
+        deep = time_calls(lambda: store.list_actions(limit=50, cursor=cursor, **filters), [()] * 50)
+        plan = store.explain_actions(limit=50, cursor=cursor, **filters)
+        report["list_actions"][name] = {"first_page": first, "deep_page": deep, "plan": plan}
+        print(f"{name:<34}{first['p50_ms']:>19}{deep['p50_ms']:>18}  {'; '.join(plan)}")
+
+    # Re-analysis: the same ids stored again with new metadata replace their actions
+    replaced = [store.get(id) for id, in sample[:200]]
+    for entry in replaced:
+        if entry["metadata"].get("due_date"):
+            entry["metadata"]["due_date"] = "2030-01-01"
+    report["reanalyze_put"] = time_calls(store.put, [(entry,) for entry in replaced])
+    print(f"\nre-analysed document stored: p50 {report['reanalyze_put']['p50_ms']} ms / "
+          f"p99 {report['reanalyze_put']['p99_ms']} ms")
+
+    if args.scan_baseline:
+        start = time.perf_counter()
+        matches, cursor = [], None
+        while True:
+            documents, cursor = store.list(limit=500, cursor=cursor)
+            matches.extend(a for d in documents for a in generate_actions(d["classification"]["type"], d["metadata"])
+                           if a["priority"] == "high" and a["deadline"] and "2023-03-01" <= a["deadline"] < "2023-03-08")
+            if cursor is None:
+                break
+        report["scan_baseline_s"] = round(time.perf_counter() - start, 2)
+        print(f"regenerating every document's actions for one query: {report['scan_baseline_s']} s "
+              f"({len(matches)} matches)")
+    store.close()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Incremental (early-exit) classification against a fixed page window, on the bundled corpus.
+
+Classifies every bundled document (first 10 pages) against `benchmarks.fake_openai`:
+
+- fixed: one call over --fixed-pages pages cut at --fixed-tokens tokens (the API default),
+  and one over the widest incremental window, as a reference;
+- incremental: the --windows (pages:tokens) read in turn, moving on to the next one while
+  the top-label margin is below --min-margin.
+
+For each mode it reports calls, classification input tokens and LLM latency per document,
+and agreement with the folder labels and with the recorded GPT labels. For the incremental
+mode it also reports where documents exited and the mean prompt tokens of each window's call.
+`FAKE_OPENAI_MS_PER_1K_TOKENS` (--ms-per-1k-tokens) makes longer prompts slower, like
+prompt processing does.
+
+    python -m benchmarks.early_exit_classification --windows 1:400,3:1200,10:4000 --min-margin 0.5
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from collections import Counter
+
+from benchmarks.utils import REPO_ROOT, fake_openai, fake_openai_env
+
+
+def classify(classifier, pages) -> dict:
+    """Run the classifier window by window, recording each call."""
+    calls = []
+    start = time.perf_counter()
+    for step, content in classifier.window_contents(pages):
+        usage = {}
+        output = classifier.invoke(pages, usage=usage, step=step, content=content)
+        calls.append({"step": step + 1, "input_tokens": usage["input_tokens"]})
+        if classifier.is_final(output):
+            break
+    return {"type": output["type"], "calls": calls, "latency_s": time.perf_counter() - start}
+
+
+def summarize(results: list) -> dict:
+    return {
+        "calls_per_document": round(statistics.mean(len(r["calls"]) for r in results), 2),
+        "input_tokens_per_document": round(statistics.mean(sum(c["input_tokens"] for c in r["calls"])
+                                                           for r in results)),
+        "latency_ms_p50": round(1000 * statistics.median(r["latency_s"] for r in results)),
+        "latency_ms_mean": round(1000 * statistics.mean(r["latency_s"] for r in results)),
+        "agrees_with_folder": sum(r["type"] == r["folder_label"] for r in results),
+        "agrees_with_recorded": sum(r["type"] == r["recorded_label"] for r in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--windows", default="1:400,3:1200,10:4000", help="Incremental windows, pages:tokens")
+    parser.add_argument("--min-margin", type=float, default=0.5, help="Margin at which classification stops")
+    parser.add_argument("--fixed-pages", type=int, default=10)
+    parser.add_argument("--fixed-tokens", type=int, default=1200)
+    parser.add_argument("--latency-ms", type=float, default=300, help="Simulated LLM latency per call")
+    parser.add_argument("--ms-per-1k-tokens", type=float, default=100, help="Simulated latency per 1k prompt tokens")
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    args = parser.parse_args()
+
+    from core.document_pipeline import LABEL_DESCRIPTIONS, parse_classification_windows
+    from core.local_classifier import FOLDER_LABELS, load_labelled_corpus
+
+    windows = parse_classification_windows(args.windows)
+    corpus = load_labelled_corpus(str(REPO_ROOT), max_pages=max(pages for pages, _ in windows))
+    folder_labels = {key: FOLDER_LABELS.get(key.split("_", 1)[0], key.rstrip("0123456789").capitalize())
+                     for key, _, _ in corpus}
+
+    with fake_openai(args.latency_ms, extra_env={"FAKE_OPENAI_MS_PER_1K_TOKENS": str(args.ms_per_1k_tokens)}) as url:
+        os.environ.update(fake_openai_env(url))
+        from core.document_classification import RunnableGPTLogprobClassifier
+        classifiers = {
+            f"fixed {args.fixed_pages}p/{args.fixed_tokens}t": RunnableGPTLogprobClassifier(
+                LABEL_DESCRIPTIONS, max_pages=args.fixed_pages, max_prompt_tokens=args.fixed_tokens),
+            f"fixed {windows[-1][0]}p/{windows[-1][1]}t": RunnableGPTLogprobClassifier(
+                LABEL_DESCRIPTIONS, max_pages=windows[-1][0], max_prompt_tokens=windows[-1][1]),
+            "incremental": RunnableGPTLogprobClassifier(LABEL_DESCRIPTIONS, windows=windows,
+                                                        min_margin=args.min_margin),
+        }
+        runs = {}
+        for name, classifier in classifiers.items():
+            runs[name] = [{**classify(classifier, pages), "key": key, "recorded_label": label,
+                           "folder_label": folder_labels[key]} for key, pages, label in corpus]
+
+    results = {"documents": len(corpus), "windows": windows, "min_margin": args.min_margin}
+    for name, run in runs.items():
+        results[name] = summarize(run)
+    incremental = runs["incremental"]
+    exits = Counter(r["calls"][-1]["step"] for r in incremental)
+    step_tokens = {}
+    for r in incremental:
+        for call in r["calls"]:
+            step_tokens.setdefault(call["step"], []).append(call["input_tokens"])
+    results["incremental"]["exits_by_window"] = {str(step): exits[step] for step in sorted(exits)}
+    results["incremental"]["mean_input_tokens_by_window"] = {
+        str(step): round(statistics.mean(tokens)) for step, tokens in sorted(step_tokens.items())}
+    reference = runs[f"fixed {windows[-1][0]}p/{windows[-1][1]}t"]
+    results["incremental"]["changed_vs_fixed"] = [
+        {"key": r["key"], "fixed": f["type"], "incremental": r["type"], "folder": r["folder_label"]}
+        for r, f in zip(incremental, runs[next(iter(runs))]) if r["type"] != f["type"]]
+    results["incremental"]["agrees_with_widest_window"] = sum(r["type"] == f["type"] for r, f in zip(incremental, reference))
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+"""
+Local, deterministic stand-in for the OpenAI chat completions endpoint.
+
+Point the pipeline at it with `OPENAI_BASE_URL=http://127.0.0.1:<port>/v1`. Each request
+sleeps for `FAKE_OPENAI_LATENCY_MS` milliseconds (default 200) before answering, which
+mimics a network-bound LLM call without spending tokens. `FAKE_OPENAI_MS_PER_1K_TOKENS`
+(default 0) adds latency proportional to the prompt length, like prompt processing does.
+`FAKE_OPENAI_LOGPROB_SCALE` (default 1) multiplies the keyword counts the label logprobs
+are derived from: values below 1 make the classifier less confident, above 1 more.
+`FAKE_OPENAI_MS_PER_OUTPUT_TOKEN` (default 0) adds generation time per completion token.
+Requests with `stream=True` get the same answer as server-sent chunks of ~4 characters: the
+first after the fixed and prompt latency, then one per output token, followed by a usage
+chunk when `stream_options.include_usage` is set.
+
+Quota emulation, like the real API's per-key rate limits: with `FAKE_OPENAI_RPM` and/or
+`FAKE_OPENAI_TPM` set, requests (and tokens: prompt + `max_tokens`) are drawn from buckets
+that refill continuously and hold `FAKE_OPENAI_BURST_S` seconds of quota (default 60). A request the buckets cannot cover
+gets a 429 with `retry-after` / `retry-after-ms` headers. Every response carries
+`x-ratelimit-limit-*` / `x-ratelimit-remaining-*` headers. `FAKE_OPENAI_ERROR_RATE`
+(default 0) answers that fraction of requests with a random 429 or 503 regardless of quota.
+`GET /stats` returns the request counts by status and `POST /stats/reset` clears them.
+
+- Requests with `logprobs=True` (classification) get a single label token whose top
+  logprobs are derived from keyword counts in the prompt.
+- Other requests (metadata extraction) get a fixed, schema-valid JSON payload for the
+  document type named in the prompt. Without a `json_schema` response format (structured
+  outputs, which the real API guarantees to follow), `FAKE_OPENAI_MALFORMED_RATE` (default 0)
+  of these answers come back damaged like real free-form answers do: a trailing comma, prose
+  around the JSON, a missing key, Python literals, cut off, or no JSON at all.
+- The response schema counts as prompt tokens, and answers longer than the request's
+  `max_tokens` are cut there with `finish_reason: "length"`, like the real API does.
+- Fused requests (`core.fused_analysis`, JSON response asking for "scores") get the
+  keyword-based label, its scores and the fixed payload of that label in one JSON object,
+  with logprobs on the label token.
+
+Run with:
+    uvicorn benchmarks.fake_openai:app --port 8100
+
+`FakeBatchClient` is an in-process stand-in for `core.batch_mode.OpenAIBatchClient` that
+answers every request of a submitted batch file with the same fake completions.
+"""
+import asyncio
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from uuid import uuid4
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI()
+
+LATENCY_MS = float(os.getenv("FAKE_OPENAI_LATENCY_MS", "200"))
+MS_PER_1K_TOKENS = float(os.getenv("FAKE_OPENAI_MS_PER_1K_TOKENS", "0"))
+LOGPROB_SCALE = float(os.getenv("FAKE_OPENAI_LOGPROB_SCALE", "1"))
+MS_PER_OUTPUT_TOKEN = float(os.getenv("FAKE_OPENAI_MS_PER_OUTPUT_TOKEN", "0"))
+RPM = float(os.getenv("FAKE_OPENAI_RPM", "0"))
+TPM = float(os.getenv("FAKE_OPENAI_TPM", "0"))
+ERROR_RATE = float(os.getenv("FAKE_OPENAI_ERROR_RATE", "0"))
+MALFORMED_RATE = float(os.getenv("FAKE_OPENAI_MALFORMED_RATE", "0"))
+MALFORMED_RANDOM = random.Random(int(os.getenv("FAKE_OPENAI_SEED", "0")))
+BURST_S = float(os.getenv("FAKE_OPENAI_BURST_S", "60"))
+
+LABEL_KEYWORDS = {
+    "Invoice": ["invoice", "amount due", "bill to", "subtotal", "vat"],
+    "Contract": ["agreement", "party", "parties", "hereby", "termination"],
+    "Earnings": ["revenue", "quarter", "earnings", "operating income", "fiscal"],
+}
+
+METADATA_BY_LABEL = {
+    "Invoice": {
+        "vendor": "Example, LLC", "amount": 19.0, "due_date": "2024-03-25",
+        "line_items": [{"description": "Subscription", "quantity": 1, "amount": 19.0}],
+    },
+    "Contract": {
+        "parties": ["Party A", "Party B"], "effective_date": "2020-01-01",
+        "termination_date": "2025-01-01", "key_terms": ["Term of five years"],
+    },
+    "Earnings": {
+        "reporting_period": "Q1 2025", "key_metrics": [{"name": "Revenue", "value": "$1.2B"}],
+        "executive_summary": "Revenue grew year over year.",
+    },
+    "Other": {"summary": "A general business document."},
+}
+METADATA_BY_PROMPT = [
+    ("business invoices", METADATA_BY_LABEL["Invoice"]),
+    ("contracts", METADATA_BY_LABEL["Contract"]),
+    ("earnings reports", METADATA_BY_LABEL["Earnings"]),
+]
+OTHER_METADATA = METADATA_BY_LABEL["Other"]
+
+
+def _prompt_text(body: dict) -> str:
+    return "\n".join(str(m.get("content", "")) for m in body.get("messages", []))
+
+
+def _label_logprobs(prompt: str) -> dict:
+    # Only look at the document content, not at the label descriptions in the instructions
+    content = prompt.split("Document content:", 1)[-1].split("Respond with only", 1)[0].lower()
+    scores = {label: LOGPROB_SCALE * sum(content.count(k) for k in keywords) for label, keywords in LABEL_KEYWORDS.items()}
+    scores["Other"] = LOGPROB_SCALE
+    # Turn keyword counts into normalised log-probabilities
+    log_z = math.log(sum(math.exp(min(s, 50)) for s in scores.values()))
+    return {label: min(s, 50) - log_z for label, s in scores.items()}
+
+
+def _usage(prompt: str, completion_tokens: int) -> dict:
+    prompt_tokens = max(1, len(prompt) // 4)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def _is_fused(body: dict, prompt: str) -> bool:
+    return (body.get("response_format") or {}).get("type") == "json_object" and '"scores"' in prompt
+
+
+def _malformed(payload: dict) -> str:
+    """A damaged version of a JSON answer, the way free-form model answers go wrong."""
+    content = json.dumps(payload)
+    kind = MALFORMED_RANDOM.choice(["trailing_comma", "prose", "missing_key", "python", "truncated", "no_json"])
+    if kind == "trailing_comma":
+        return content[:-1] + ",}"
+    if kind == "prose":
+        return f"Here is the extracted metadata:\n{content}\nLet me know if you need anything else."
+    if kind == "missing_key":
+        return json.dumps(dict(list(payload.items())[1:]))
+    if kind == "python":
+        return repr(payload)
+    if kind == "truncated":
+        return content[:int(len(content) * 0.8)]
+    return "I could not find the requested information in this document."
+
+
+def build_completion(body: dict) -> dict:
+    prompt = _prompt_text(body)
+    schema = ((body.get("response_format") or {}).get("json_schema") or {}).get("schema")
+    finish_reason = "stop"
+    if _is_fused(body, prompt):
+        logprobs = _label_logprobs(prompt)
+        ranked = sorted(logprobs.items(), key=lambda kv: kv[1], reverse=True)
+        label = ranked[0][0]
+        top = [{"token": l, "logprob": lp, "bytes": None} for l, lp in ranked]
+        prefix = '{"type": "'
+        rest = '", "scores": ' + json.dumps({l: round(math.exp(lp), 4) for l, lp in ranked})
+        rest += ', "metadata": ' + json.dumps(METADATA_BY_LABEL[label]) + "}"
+        content = prefix + label + rest
+        choice_logprobs = {"content": [
+            {"token": prefix, "logprob": 0.0, "bytes": None, "top_logprobs": []},
+            {"token": label, "logprob": ranked[0][1], "bytes": None, "top_logprobs": top},
+            {"token": rest, "logprob": 0.0, "bytes": None, "top_logprobs": []},
+        ]}
+        completion_tokens = max(1, len(content) // 4)
+    elif body.get("logprobs"):
+        logprobs = _label_logprobs(prompt)
+        ranked = sorted(logprobs.items(), key=lambda kv: kv[1], reverse=True)
+        top = [{"token": label, "logprob": lp, "bytes": None} for label, lp in ranked]
+        content = ranked[0][0]
+        choice_logprobs = {"content": [{"token": content, "logprob": ranked[0][1], "bytes": None, "top_logprobs": top}]}
+        completion_tokens = 1
+    else:
+        payload = next((m for key, m in METADATA_BY_PROMPT if key in prompt), OTHER_METADATA)
+        content = json.dumps(payload)
+        if schema is None and MALFORMED_RATE and MALFORMED_RANDOM.random() < MALFORMED_RATE:
+            content = _malformed(payload)
+        choice_logprobs = None
+        completion_tokens = max(1, len(content) // 4)
+        max_tokens = body.get("max_completion_tokens") or body.get("max_tokens")
+        if max_tokens and completion_tokens > max_tokens:
+            content, completion_tokens, finish_reason = content[:4 * max_tokens], max_tokens, "length"
+
+    return {
+        "id": f"chatcmpl-{uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-4o-mini"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "logprobs": choice_logprobs,
+            "finish_reason": finish_reason,
+        }],
+        # The API counts the response schema as prompt tokens
+        "usage": _usage(prompt + (json.dumps(schema) if schema else ""), completion_tokens),
+    }
+
+
+def _chunk(completion: dict, delta: dict, finish_reason=None, usage=None) -> str:
+    chunk = {
+        "id": completion["id"], "object": "chat.completion.chunk", "created": completion["created"],
+        "model": completion["model"],
+        "choices": [] if usage else [{"index": 0, "delta": delta, "logprobs": None, "finish_reason": finish_reason}],
+    }
+    if usage:
+        chunk["usage"] = usage
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+async def stream_completion(body: dict, completion: dict):
+    content = completion["choices"][0]["message"]["content"]
+    yield _chunk(completion, {"role": "assistant", "content": ""})
+    for i in range(0, len(content), 4):
+        await asyncio.sleep(MS_PER_OUTPUT_TOKEN / 1000)
+        yield _chunk(completion, {"content": content[i:i + 4]})
+    yield _chunk(completion, {}, finish_reason=completion["choices"][0]["finish_reason"])
+    if (body.get("stream_options") or {}).get("include_usage"):
+        yield _chunk(completion, {}, usage=completion["usage"])
+    yield "data: [DONE]\n\n"
+
+
+class Quota:
+    """Per-minute limits of the fake API key: buckets of `burst_s` seconds of quota, refilled continuously."""
+
+    def __init__(self, limits: dict, burst_s: float = 60):
+        self.limits = {kind: limit for kind, limit in limits.items() if limit}
+        self.capacity = {kind: limit * burst_s / 60 for kind, limit in self.limits.items()}
+        self.remaining = dict(self.capacity)
+        self.updated_at = time.monotonic()
+        self.started_at = None
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def take(self, amounts: dict):
+        """Charge a request; returns the seconds until it would fit if the quota cannot cover it, else None."""
+        with self._lock:
+            now = time.monotonic()
+            self.started_at = self.started_at or now
+            for kind, limit in self.limits.items():
+                self.remaining[kind] = min(self.capacity[kind], self.remaining[kind] + (now - self.updated_at) * limit / 60)
+            self.updated_at = now
+            shortfall = {kind: amounts[kind] - self.remaining[kind] for kind in self.limits}
+            wait = max((60 * short / self.limits[kind] for kind, short in shortfall.items() if short > 0), default=None)
+            if wait is None:
+                for kind in self.limits:
+                    self.remaining[kind] -= amounts[kind]
+            return wait
+
+    def headers(self) -> dict:
+        headers = {}
+        for kind, limit in self.limits.items():
+            headers[f"x-ratelimit-limit-{kind}"] = str(int(limit))
+            headers[f"x-ratelimit-remaining-{kind}"] = str(max(0, int(self.remaining[kind])))
+        return headers
+
+    def count(self, status: int):
+        with self._lock:
+            self.counts[status] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            elapsed = time.monotonic() - self.started_at if self.started_at else 0.0
+            return {"limits": self.limits, "statuses": {str(k): v for k, v in self.counts.items()},
+                    "elapsed_s": elapsed}
+
+    def reset(self):
+        with self._lock:
+            self.remaining = dict(self.capacity)
+            self.updated_at = time.monotonic()
+            self.started_at = None
+            self.counts.clear()
+
+
+quota = Quota({"requests": RPM, "tokens": TPM}, BURST_S)
+
+
+def _error(status: int, message: str, headers: dict) -> JSONResponse:
+    quota.count(status)
+    error_type = "rate_limit_exceeded" if status == 429 else "server_error"
+    return JSONResponse({"error": {"message": message, "type": error_type, "code": error_type}},
+                        status_code=status, headers=headers)
+
+
+@app.get("/stats")
+async def stats():
+    return quota.stats()
+
+
+@app.post("/stats/reset")
+async def reset_stats():
+    quota.reset()
+    return quota.stats()
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    completion = build_completion(body)
+    # Like the real API, the quota is charged the prompt and the requested completion length
+    requested_tokens = completion["usage"]["prompt_tokens"] + (body.get("max_completion_tokens") or body.get("max_tokens") or 1000)
+    wait = quota.take({"requests": 1, "tokens": requested_tokens})
+    headers = quota.headers()
+    if wait is not None:
+        return _error(429, "Rate limit reached, please retry later.",
+                      {**headers, "retry-after": str(math.ceil(wait)), "retry-after-ms": str(math.ceil(1000 * wait))})
+    if ERROR_RATE and random.random() < ERROR_RATE:
+        if random.random() < 0.5:
+            return _error(429, "Injected rate limit error.", {**headers, "retry-after-ms": "500"})
+        return _error(503, "Injected server error.", headers)
+    quota.count(200)
+    prompt_tokens = completion["usage"]["prompt_tokens"]
+    await asyncio.sleep((LATENCY_MS + MS_PER_1K_TOKENS * prompt_tokens / 1000) / 1000)
+    if body.get("stream"):
+        return StreamingResponse(stream_completion(body, completion), media_type="text/event-stream", headers=headers)
+    await asyncio.sleep(MS_PER_OUTPUT_TOKEN * completion["usage"]["completion_tokens"] / 1000)
+    return JSONResponse(completion, headers=headers)
+
+
+class FakeBatchClient:
+    """
+    Local stand-in for the OpenAI Batch API. `submit` records the request file; `download`
+    reports the batch as running for `polls_before_complete` calls, then writes output lines
+    in the Batch API format. Request custom ids listed in `fail_ids` get an error line.
+    """
+
+    def __init__(self, polls_before_complete: int = 0, fail_ids=()):
+        self.polls_before_complete = polls_before_complete
+        self.fail_ids = set(fail_ids)
+        self.batches = {}
+
+    def submit(self, requests_path: Path) -> str:
+        batch_id = f"batch_{uuid4().hex}"
+        self.batches[batch_id] = {"requests_path": Path(requests_path), "polls_left": self.polls_before_complete}
+        return batch_id
+
+    def download(self, batch_id: str, output_path: Path) -> bool:
+        batch = self.batches[batch_id]
+        if batch["polls_left"] > 0:
+            batch["polls_left"] -= 1
+            return False
+        with open(batch["requests_path"], "r", encoding="utf-8") as src, open(output_path, "w", encoding="utf-8") as dst:
+            for line in src:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                if request["custom_id"] in self.fail_ids:
+                    response = None
+                    error = {"code": "server_error", "message": "Injected failure"}
+                else:
+                    response = {"status_code": 200, "request_id": uuid4().hex, "body": build_completion(request["body"])}
+                    error = None
+                dst.write(json.dumps({"id": f"batch_req_{uuid4().hex}", "custom_id": request["custom_id"],
+                                      "response": response, "error": error}) + "\n")
+        return True
@@ -0,0 +1,116 @@
+"""
+Compare the fused single-call mode with the two-call path (classify, then extract).
+
+Every bundled PDF is analysed sequentially by both `DocumentPipelineManager(fused=False)` and
+`DocumentPipelineManager(fused=True)` (result cache off, pages extracted once up front), and
+the script reports per-document latency, input/output tokens as reported by the API, and how
+often the two modes agree on the label and on the extracted metadata.
+
+By default the LLM is `benchmarks.fake_openai` with --latency-ms per call, which measures the
+round-trip and prompt-size effects but says nothing about answer quality (the fake answers are
+fixed per label). With --live the real OpenAI API is used (needs OPENAI_API_KEY and spends
+tokens), which makes the agreement columns meaningful.
+
+    python -m benchmarks.fused_comparison --latency-ms 600
+    python -m benchmarks.fused_comparison --live --folder documents
+"""
+import argparse
+import contextlib
+import json
+import os
+import time
+
+from benchmarks.utils import corpus_files, fake_openai, fake_openai_env
+
+
+def runnable_tokens(pipeline) -> tuple:
+    # Per-runnable counters hold exactly what the API reported for each call
+    runnables = [pipeline.classifier, *pipeline.extractors.values()]
+    if pipeline.fused_analyzer is not None:
+        runnables.append(pipeline.fused_analyzer)
+    return sum(r.input_tokens for r in runnables), sum(r.output_tokens for r in runnables)
+
+
+def run_mode(pipeline, documents) -> list:
+    results = []
+    for path, pages in documents:
+        input_before, output_before = runnable_tokens(pipeline)
+        start = time.perf_counter()
+        classification, metadata = pipeline.analyze(pages)
+        latency = time.perf_counter() - start
+        input_after, output_after = runnable_tokens(pipeline)
+        results.append({
+            "document": str(path.name), "latency_s": latency,
+            "input_tokens": input_after - input_before, "output_tokens": output_after - output_before,
+            "classification": classification, "metadata": metadata.model_dump(),
+        })
+    return results
+
+
+def summarise(name: str, results: list) -> dict:
+    latencies = sorted(r["latency_s"] for r in results)
+    summary = {
+        "mode": name,
+        "documents": len(results),
+        "mean_latency_s": sum(latencies) / len(latencies),
+        "p50_latency_s": latencies[len(latencies) // 2],
+        "input_tokens": sum(r["input_tokens"] for r in results),
+        "output_tokens": sum(r["output_tokens"] for r in results),
+    }
+    print(f"{name:<10}{summary['mean_latency_s']:>16.3f}{summary['p50_latency_s']:>15.3f}"
+          f"{summary['input_tokens']:>14}{summary['output_tokens']:>15}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=float, default=600, help="Simulated LLM latency per call (fake server)")
+    parser.add_argument("--live", action="store_true", help="Call the real OpenAI API instead of the fake server")
+    parser.add_argument("--folder", nargs="+", default=["documents", "documents-extra"])
+    parser.add_argument("--full-text", action="store_true",
+                        help="Disable the token budgets and send the full document text (README cost model)")
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N documents")
+    parser.add_argument("--output", help="Write per-document results as JSON to this path")
+    args = parser.parse_args()
+
+    from core.document_loader import extract_pages
+    files = corpus_files(*args.folder)[:args.limit]
+    documents = [(path, extract_pages(str(path))) for path in files]
+
+    server = contextlib.nullcontext() if args.live else fake_openai(args.latency_ms)
+    with server as base_url:
+        if base_url is not None:
+            os.environ.update(fake_openai_env(base_url))
+        from core.document_pipeline import DocumentPipelineManager
+
+        budgets = dict(max_tokens_classification=None, max_tokens_extraction=None) if args.full_text else {}
+        two_call = DocumentPipelineManager(max_pages_classification=3, cache=None, **budgets)
+        fused = DocumentPipelineManager(max_pages_classification=3, cache=None, fused=True, **budgets)
+        # Warm up connections so the first document does not pay for the TLS/TCP handshake
+        two_call.analyze(documents[0][1])
+        fused.analyze(documents[0][1])
+        two_call_results = run_mode(two_call, documents)
+        fused_results = run_mode(fused, documents)
+
+    print(f"{len(documents)} documents, {'live OpenAI' if args.live else f'fake LLM with {args.latency_ms:.0f} ms per call'}\n")
+    print(f"{'mode':<10}{'mean latency s':>16}{'p50 latency s':>15}{'input tokens':>14}{'output tokens':>15}")
+    summaries = [summarise("two-call", two_call_results), summarise("fused", fused_results)]
+
+    same_label = sum(a["classification"]["type"] == b["classification"]["type"]
+                     for a, b in zip(two_call_results, fused_results))
+    same_metadata = sum(a["metadata"] == b["metadata"] for a, b in zip(two_call_results, fused_results))
+    base, new = summaries
+    print(f"\nLatency: {1 - new['mean_latency_s'] / base['mean_latency_s']:.0%} lower, "
+          f"input tokens: {1 - new['input_tokens'] / base['input_tokens']:.0%} lower")
+    print(f"Same label: {same_label}/{len(documents)}, identical metadata: {same_metadata}/{len(documents)}")
+    for a, b in zip(two_call_results, fused_results):
+        if a["classification"]["type"] != b["classification"]["type"]:
+            print(f"  {a['document']}: {a['classification']['type']} (two-call) vs {b['classification']['type']} (fused)")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"summary": summaries, "two_call": two_call_results, "fused": fused_results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
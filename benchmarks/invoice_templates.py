@@ -0,0 +1,142 @@
+"""
+Invoice templates: extraction of new invoices of a known layout, template vs LLM.
+
+1. Learns templates from the recorded outputs of the bundled invoices (like
+   `python -m core.invoice_templates`).
+2. Writes --variants copies of every invoice a template was learned for, with the total and
+   line-item amounts scaled down by a random factor (the old values are redacted and the new
+   ones written where they ended, right-aligned): the same vendor billing different amounts.
+3. Loads and extracts every variant with the async pipeline against `benchmarks.fake_openai`,
+   with and without the template store. Reports load and extraction times, LLM calls,
+   template hits and fallbacks, and how many template results equal the scaled recorded
+   metadata. Bundled invoices without a template check that no other template claims them.
+
+    python -m benchmarks.invoice_templates --variants 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+from pathlib import Path
+
+import pymupdf
+
+from benchmarks.utils import REPO_ROOT, fake_openai, fake_openai_env
+from core.document_loader import open_pdf
+from core.invoice_templates import InvoiceTemplateStore, agrees, decimal_separator, learn_recorded, parse_number
+from core.metrics import TEMPLATE_EXTRACTIONS
+
+CORPUS = [("documents-extra/Invoice", "output-extra/Invoice"), ("documents", "output")]
+
+
+def recorded_metadata(path: Path) -> dict:
+    for pdf_folder, output_folder in CORPUS:
+        if path.parent == REPO_ROOT / pdf_folder:
+            with open(REPO_ROOT / output_folder / f"{path.name.split('.')[0]}.json", "r", encoding="utf-8") as f:
+                return json.load(f)["metadata"]
+    raise ValueError(path)
+
+
+def format_amount(value: float, decimal: str) -> str:
+    return f"{value:,.2f}".replace(",", "_").replace(".", decimal).replace("_", "." if decimal == "," else ",")
+
+
+def write_variant(path: Path, metadata: dict, factor: float, output: Path) -> dict:
+    """Copy of the invoice with its amounts times `factor` (< 1, so they fit the old boxes); returns its metadata."""
+    doc = open_pdf(str(path))
+    try:
+        _, words = doc.extract_layout(0)
+    finally:
+        doc.close()
+    decimal = decimal_separator(words)
+    items = [i for i in metadata["line_items"] or [] if i.get("amount") is not None]
+    amounts = {round(metadata["amount"], 2)} | {round(i["amount"], 2) for i in items}
+
+    pdf = pymupdf.open(str(path))
+    page, replaced = pdf[0], []
+    for word in words:
+        value = parse_number(word["text"], decimal)
+        if value is not None and round(value, 2) in amounts and decimal in word["text"]:
+            page.add_redact_annot(pymupdf.Rect(word["x0"], word["top"], word["x1"], word["bottom"]))
+            prefix = word["text"][:len(word["text"]) - len(word["text"].lstrip("€$£"))]
+            replaced.append((word, prefix + format_amount(value * factor, decimal)))
+    page.apply_redactions(images=pymupdf.PDF_REDACT_IMAGE_NONE)
+    for word, text in replaced:
+        size = (word["bottom"] - word["top"]) * 0.95
+        width = pymupdf.get_text_length(text, fontname="helv", fontsize=size)
+        page.insert_text((word["x1"] - width, word["bottom"] - size * 0.22), text, fontname="helv", fontsize=size)
+    pdf.save(str(output))
+    pdf.close()
+    return {**metadata, "amount": round(metadata["amount"] * factor, 2),
+            "line_items": [{**i, "amount": round(i["amount"] * factor, 2)} for i in items]}
+
+
+async def extract_all(paths: list, store) -> dict:
+    from core.document_pipeline import DocumentPipelineManager
+    pipeline = DocumentPipelineManager(invoice_templates=store, max_pages_extraction=10)
+    usage, results, load_s, extract_s = {}, [], [], []
+    for path in paths:
+        start = time.perf_counter()
+        pages = await pipeline.aload_document(str(path))
+        load_s.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        results.append(await pipeline.aextract_metadata(pages, "Invoice", usage))
+        extract_s.append(time.perf_counter() - start)
+    await pipeline.aclose()
+    return {"results": results, "load_ms": 1000 * statistics.median(load_s),
+            "extract_ms": 1000 * statistics.median(extract_s), "llm_calls": usage.get("calls", 0)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--variants", type=int, default=5, help="Copies of each templated invoice")
+    parser.add_argument("--latency-ms", type=float, default=300, help="Simulated LLM latency per call")
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    args = parser.parse_args()
+
+    folder = REPO_ROOT / "tmp" / "invoice_templates"
+    folder.mkdir(parents=True, exist_ok=True)
+    store_path = folder / "templates.sqlite"
+    store_path.unlink(missing_ok=True)
+    store = InvoiceTemplateStore(str(store_path))
+    events = {}
+    for pdf_folder, output_folder in CORPUS:
+        events.update(learn_recorded(store, str(REPO_ROOT / pdf_folder), str(REPO_ROOT / output_folder)))
+    templated = [Path(p) for p, event in events.items() if event != "unlearnable"]
+    untemplated = [Path(p) for p, event in events.items() if event == "unlearnable"]
+
+    rng, variants, expected = random.Random(0), [], []
+    for path in templated:
+        for n in range(args.variants):
+            output = folder / f"{path.stem}_{n}.pdf"
+            expected.append(write_variant(path, recorded_metadata(path), rng.uniform(0.3, 0.9), output))
+            variants.append(output)
+
+    with fake_openai(args.latency_ms) as url:
+        os.environ.update(fake_openai_env(url))
+        llm = asyncio.run(extract_all(variants, None))
+        templates = asyncio.run(extract_all(variants, store))
+        stats, unmatched = store.stats(), TEMPLATE_EXTRACTIONS.value(result="none")
+        asyncio.run(extract_all(untemplated, store))
+    results = {
+        "invoices": len(events), "templates": store.stats()["templates"], "variants": len(variants),
+        "llm": {k: llm[k] for k in ("load_ms", "extract_ms", "llm_calls")},
+        "templates_on": {k: templates[k] for k in ("load_ms", "extract_ms", "llm_calls")},
+        "template_hits": stats["hits"], "template_fallbacks": stats["fallbacks"],
+        "exact_matches": sum(agrees(result, metadata) for result, metadata in zip(templates["results"], expected)),
+        "untemplated_invoices": len(untemplated),
+        "untemplated_without_template": int(TEMPLATE_EXTRACTIONS.value(result="none") - unmatched),
+    }
+    store.close()
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Load test of the background job API (`POST /jobs`, `GET /jobs/{id}`).
+
+For each --workers value the API is started with JOB_WORKERS=<n> against
+`benchmarks.fake_openai` (result cache off) and --jobs uploads are submitted as fast as
+possible, every --bulk-every-th one in the bulk lane. The script reports:
+- submit latency (time to the 202), which should stay flat whatever the backlog;
+- throughput until every job is done (polling `GET /jobs/{id}`);
+- queue wait and total time per lane, from the per-stage timings of each job;
+- how many submissions were rejected with 429 when JOB_QUEUE_SIZE=--small-queue.
+
+    python -m benchmarks.job_queue_load --jobs 200 --workers 1 4 16
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from benchmarks.utils import REPO_ROOT, corpus_files, fake_openai, fake_openai_env, free_port, serve
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+
+async def submit_all(base: str, files: list, jobs: int, bulk_every: int):
+    submitted, rejected, submit_ms = [], 0, []
+    async with httpx.AsyncClient(base_url=base, timeout=60) as client:
+        async def submit(i):
+            nonlocal rejected
+            path = files[i % len(files)]
+            lane = "bulk" if bulk_every and i % bulk_every == bulk_every - 1 else "interactive"
+            start = time.perf_counter()
+            r = await client.post("/jobs", params={"lane": lane}, files={"file": (path.name, path.read_bytes())})
+            submit_ms.append((time.perf_counter() - start) * 1000)
+            if r.status_code == 429:
+                rejected += 1
+            else:
+                r.raise_for_status()
+                submitted.append(r.json()["job_id"])
+
+        await asyncio.gather(*(submit(i) for i in range(jobs)))
+    return submitted, rejected, submit_ms
+
+
+async def wait_all(base: str, job_ids: list) -> list:
+    pending, finished = set(job_ids), []
+    async with httpx.AsyncClient(base_url=base, timeout=60) as client:
+        while pending:
+            responses = await asyncio.gather(*(client.get(f"/jobs/{job_id}") for job_id in pending))
+            for r in responses:
+                job = r.json()
+                if job["status"] in ("done", "failed"):
+                    pending.discard(job["id"])
+                    finished.append(job)
+            if pending:
+                await asyncio.sleep(0.2)
+    return finished
+
+
+def run(base: str, files: list, jobs: int, bulk_every: int) -> dict:
+    start = time.perf_counter()
+    job_ids, rejected, submit_ms = asyncio.run(submit_all(base, files, jobs, bulk_every))
+    finished = asyncio.run(wait_all(base, job_ids))
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "submitted": len(job_ids), "rejected_429": rejected,
+        "failed": sum(job["status"] == "failed" for job in finished),
+        "submit_p50_ms": round(percentile(submit_ms, 0.5), 1), "submit_p99_ms": round(percentile(submit_ms, 0.99), 1),
+        "jobs_per_s": round(len(finished) / elapsed, 2),
+    }
+    for lane in ("interactive", "bulk"):
+        jobs_in_lane = [job for job in finished if job["lane"] == lane and job["status"] == "done"]
+        if jobs_in_lane:
+            result[f"{lane}_queued_p50_s"] = round(percentile([j["timings"]["queued"] for j in jobs_in_lane], 0.5), 2)
+            result[f"{lane}_total_p50_s"] = round(
+                percentile([j["finished_at"] - j["submitted_at"] for j in jobs_in_lane], 0.5), 2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16], help="JOB_WORKERS values to compare")
+    parser.add_argument("--bulk-every", type=int, default=2, help="Every N-th job goes to the bulk lane (0: none)")
+    parser.add_argument("--small-queue", type=int, default=20, help="JOB_QUEUE_SIZE of the backpressure run")
+    parser.add_argument("--latency-ms", type=float, default=300, help="Simulated LLM latency per call")
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    args = parser.parse_args()
+
+    files = corpus_files("documents")
+    runs = [(f"workers={n}", {"JOB_WORKERS": str(n)}) for n in args.workers]
+    runs.append((f"workers={args.workers[-1]}, queue={args.small_queue}",
+                 {"JOB_WORKERS": str(args.workers[-1]), "JOB_QUEUE_SIZE": str(args.small_queue)}))
+    results = {}
+    with fake_openai(args.latency_ms) as base_url:
+        for name, env in runs:
+            db = REPO_ROOT / "tmp" / f"job_queue_load_{free_port()}.sqlite"
+            port = free_port()
+            with serve("api:app", port, {**fake_openai_env(base_url), "RESULT_CACHE": "0",
+                                         "DOCUMENT_STORE": str(db), **env}):
+                results[name] = run(f"http://127.0.0.1:{port}", files, args.jobs, args.bulk_every)
+            print(f"{name}: {json.dumps(results[name])}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Evaluate the local fast-path classifier cascade on the bundled corpus.
+
+Uses leave-one-out cross-validation: every document is classified by a model trained on all
+other documents, so the numbers reflect unseen documents. For each confidence threshold it
+reports the fraction of documents resolved locally, the accuracy of those local answers and
+the classification tokens and latency saved versus always calling GPT.
+
+GPT tokens are the classifier's own `estimate_tokens` for the real classification prompt;
+GPT latency is not measured (no network) and is taken from --llm-latency-ms.
+
+    python -m benchmarks.local_classifier_report --thresholds 0.6 0.8 0.9
+"""
+import argparse
+import json
+import os
+import time
+
+from benchmarks.utils import REPO_ROOT
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.6, 0.7, 0.8, 0.9, 0.95])
+    parser.add_argument("--max-pages", type=int, default=3)
+    parser.add_argument("--llm-latency-ms", type=float, default=600, help="Assumed latency of one GPT classification call")
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    os.environ.setdefault("OPENAI_API_KEY", "sk-fake")  # clients are built but never called
+    from core.document_classification import RunnableGPTLogprobClassifier
+    from core.document_pipeline import LABEL_DESCRIPTIONS
+    from core.local_classifier import LocalNgramClassifier, load_labelled_corpus
+
+    corpus = load_labelled_corpus(str(REPO_ROOT), max_pages=args.max_pages)
+    gpt = RunnableGPTLogprobClassifier(LABEL_DESCRIPTIONS, max_pages=args.max_pages)
+
+    predictions = []
+    for i, (key, pages, label) in enumerate(corpus):
+        train = corpus[:i] + corpus[i + 1:]
+        model = LocalNgramClassifier(labels=LABEL_DESCRIPTIONS.keys(), max_pages=args.max_pages)
+        model.fit([p for _, p, _ in train], [l for _, _, l in train])
+        start = time.perf_counter()
+        output = model.invoke(pages)
+        local_ms = (time.perf_counter() - start) * 1000
+        predictions.append({
+            "key": key, "label": label, "local_type": output["type"], "local_confidence": output["confidence"],
+            "local_ms": local_ms, "gpt_tokens": gpt.estimate_tokens(pages),
+        })
+
+    total_tokens = sum(p["gpt_tokens"] for p in predictions)
+    mean_local_ms = sum(p["local_ms"] for p in predictions) / len(predictions)
+    rows = []
+    print(f"{len(predictions)} documents, mean local inference {mean_local_ms:.2f} ms, "
+          f"{total_tokens} GPT classification tokens without the cascade\n")
+    print(f"{'threshold':>10}{'local %':>9}{'local acc':>11}{'tokens saved':>14}{'mean latency ms':>17}")
+    for threshold in args.thresholds:
+        local = [p for p in predictions if p["local_confidence"] >= threshold]
+        saved = sum(p["gpt_tokens"] for p in local)
+        # Every document pays the local model; the rest also pay a GPT call
+        mean_latency = mean_local_ms + args.llm_latency_ms * (len(predictions) - len(local)) / len(predictions)
+        row = {
+            "threshold": threshold,
+            "resolved_locally": len(local) / len(predictions),
+            "local_accuracy": sum(p["local_type"] == p["label"] for p in local) / len(local) if local else None,
+            "tokens_saved": saved,
+            "tokens_saved_fraction": saved / total_tokens,
+            "mean_latency_ms": mean_latency,
+            "latency_saved_fraction": 1 - mean_latency / args.llm_latency_ms,
+        }
+        rows.append(row)
+        accuracy = f"{row['local_accuracy']:.0%}" if local else "-"
+        print(f"{threshold:>10}{row['resolved_locally']:>9.0%}{accuracy:>11}"
+              f"{saved:>8} ({row['tokens_saved_fraction']:.0%}){mean_latency:>12.1f}")
+
+    misses = [p for p in predictions if p["local_type"] != p["label"]]
+    if misses:
+        print("\nLocal mistakes (before thresholding):")
+        for p in misses:
+            print(f"  {p['key']}: {p['local_type']} ({p['local_confidence']:.2f}) vs {p['label']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"thresholds": rows, "documents": predictions}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
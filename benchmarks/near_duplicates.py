@@ -0,0 +1,129 @@
+"""
+Near-duplicate index: lookup latency at scale, then hit rate and token savings on templated documents.
+
+1. Scale: fills a `NearDuplicateIndex` with --documents random signatures (in batches) and
+   times `query` for indexed signatures (hits) and fresh ones (misses).
+2. Templated documents: makes --variants copies of every bundled document (page text loaded
+   once) with the digits and a few words changed, like recurring invoices, and analyses the
+   originals then the variants with the async pipeline against `benchmarks.fake_openai`, with
+   and without the index. Reports the index hit rate, the classifications reused, the
+   extraction prompts hinted, the API-reported tokens, and how often the labels agree.
+
+    python -m benchmarks.near_duplicates --documents 1000000 --variants 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import statistics
+import time
+
+import numpy as np
+
+from benchmarks.utils import REPO_ROOT, corpus_files, fake_openai, fake_openai_env
+from core.document_loader import extract_pages
+from core.near_duplicates import NearDuplicateIndex
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def scale(documents: int, queries: int = 2000) -> dict:
+    path = REPO_ROOT / "tmp" / f"near_duplicates_{documents}.sqlite"
+    path.unlink(missing_ok=True)
+    index = NearDuplicateIndex(str(path))
+    rng = np.random.default_rng(0)
+    size = index.bands * index.rows
+    classification = {"type": "Invoice", "confidence": 0.99}
+    start, sample = time.perf_counter(), []
+    for offset in range(0, documents, 10000):
+        batch = rng.integers(0, 2 ** 32, size=(min(10000, documents - offset), size), dtype=np.uint64).astype(np.uint32)
+        index.add_many((signature, classification, None) for signature in batch)
+        sample.extend(batch[:max(1, queries // max(1, documents // 10000))])
+    fill_s = time.perf_counter() - start
+
+    timings = {}
+    for name, signatures in (("hit", sample[:queries]),
+                             ("miss", rng.integers(0, 2 ** 32, size=(queries, size), dtype=np.uint64).astype(np.uint32))):
+        elapsed = []
+        for signature in signatures:
+            start = time.perf_counter()
+            index.query(signature)
+            elapsed.append((time.perf_counter() - start) * 1000)
+        timings[name] = {"p50_ms": percentile(elapsed, 0.5), "p99_ms": percentile(elapsed, 0.99)}
+    index.close()
+    return {"documents": documents, "fill_s": fill_s, "inserts_per_s": documents / fill_s,
+            "file_mb": path.stat().st_size / 1e6, **{f"{k}_{m}": v[m] for k, v in timings.items() for m in v}}
+
+
+def variant(pages: list, rng: random.Random, word_changes: float = 0.02) -> list:
+    """Same template, different fields: new digits and a few replaced words."""
+    def change(text):
+        text = re.sub(r"\d", lambda _: str(rng.randrange(10)), text)
+        return re.sub(r"[A-Za-z]{4,}", lambda m: rng.choice(["Acme", "Globex", "Initech", "Umbrella"])
+                      if rng.random() < word_changes else m.group(0), text)
+    return [{"page": p["page"], "text": change(p["text"])} for p in pages]
+
+
+async def analyse_all(documents: list, near_duplicates) -> dict:
+    from core.document_pipeline import DocumentPipelineManager
+    pipeline = DocumentPipelineManager(near_duplicates=near_duplicates, max_pages_extraction=10)
+    labels, usage = [], {}
+    for pages in documents:
+        classification, _ = await pipeline.aanalyze(pages, usage=usage)
+        labels.append(classification["type"])
+    await pipeline.aclose()
+    return {"labels": labels, "usage": usage}
+
+
+def templated(variants: int, latency_ms: float) -> dict:
+    rng = random.Random(0)
+    originals = [extract_pages(str(path), 10) for path in corpus_files("documents", "documents-extra")]
+    documents = originals + [variant(pages, rng) for _ in range(variants) for pages in originals]
+
+    with fake_openai(latency_ms) as base_url:
+        os.environ.update(fake_openai_env(base_url))
+        baseline = asyncio.run(analyse_all(documents, None))
+        path = REPO_ROOT / "tmp" / "near_duplicates_templated.sqlite"
+        path.unlink(missing_ok=True)
+        index = NearDuplicateIndex(str(path))
+        indexed = asyncio.run(analyse_all(documents, index))
+
+    from core.metrics import NEAR_DUPLICATE_REUSES, NEAR_DUPLICATE_TOKENS_SAVED
+    result = {
+        "documents": len(documents), "indexed": index.count(), **index.stats(),
+        "classifications_reused": NEAR_DUPLICATE_REUSES.value(stage="classify"),
+        "extractions_hinted": NEAR_DUPLICATE_REUSES.value(stage="extract"),
+        "estimated_tokens_saved": {stage: NEAR_DUPLICATE_TOKENS_SAVED.value(stage=stage) for stage in ("classify", "extract")},
+        "input_tokens": {"without_index": baseline["usage"]["input_tokens"], "with_index": indexed["usage"]["input_tokens"]},
+        "llm_calls": {"without_index": baseline["usage"]["calls"], "with_index": indexed["usage"]["calls"]},
+        "label_agreement": statistics.mean(a == b for a, b in zip(baseline["labels"], indexed["labels"])),
+    }
+    index.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=1_000_000, help="Signatures indexed for the scale test")
+    parser.add_argument("--variants", type=int, default=3, help="Templated copies of each bundled document")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Simulated LLM latency per call")
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    args = parser.parse_args()
+
+    results = {"scale": scale(args.documents)}
+    print(json.dumps(results["scale"], indent=2))
+    results["templated"] = templated(args.variants, args.latency_ms)
+    print(json.dumps(results["templated"], indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Compare PDF text-extraction backends over `documents/` and `documents-extra/`.
+
+For every backend (and optionally parallel page-range extraction) this reports pages per
+second, peak RSS of the extracting process and text parity against pdfplumber, the
+reference backend whose output the prompts were written for. Each measurement runs in a
+fresh process so peak RSS is not polluted by earlier runs.
+
+    python -m benchmarks.pdf_backends --parallel-workers 4 --output bench_pdf_backends.json
+"""
+import argparse
+import json
+import multiprocessing
+import re
+import resource
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.utils import REPO_ROOT, corpus_files
+from core.document_loader import PDF_BACKENDS, extract_pages, extract_pages_parallel
+
+
+def _peak_rss_mb() -> float:
+    # Largest of this process and any page-range worker processes it spawned
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _measure(path: str, backend: str, parallel_workers: int, pages_per_task: int, queue):
+    start = time.perf_counter()
+    if parallel_workers > 1:
+        with ProcessPoolExecutor(max_workers=parallel_workers) as pool:
+            pages = extract_pages_parallel(path, pool, backend=backend, pages_per_task=pages_per_task)
+    else:
+        pages = extract_pages(path, backend=backend)
+    elapsed = time.perf_counter() - start
+    queue.put({"seconds": elapsed, "peak_rss_mb": _peak_rss_mb(), "pages": pages})
+
+
+def measure(path: str, backend: str, parallel_workers: int = 1, pages_per_task: int = 16) -> dict:
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_measure, args=(path, backend, parallel_workers, pages_per_task, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def text_parity(reference: list, candidate: list) -> float:
+    """Word-multiset overlap (Dice coefficient) between two page lists, ignoring layout whitespace."""
+    ref = Counter(re.findall(r"\w+", " ".join(p["text"] for p in reference).lower()))
+    cand = Counter(re.findall(r"\w+", " ".join(p["text"] for p in candidate).lower()))
+    total = sum(ref.values()) + sum(cand.values())
+    return 1.0 if total == 0 else 2 * sum((ref & cand).values()) / total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=list(PDF_BACKENDS))
+    parser.add_argument("--parallel-workers", type=int, default=1,
+                        help="Also measure parallel page-range extraction with this many processes")
+    parser.add_argument("--pages-per-task", type=int, default=16)
+    parser.add_argument("--folders", nargs="+", default=["documents", "documents-extra"])
+    parser.add_argument("--output", help="Write per-file results as JSON to this path")
+    args = parser.parse_args()
+
+    configs = [(backend, 1) for backend in args.backends]
+    if args.parallel_workers > 1:
+        configs += [(backend, args.parallel_workers) for backend in args.backends]
+
+    rows = []
+    totals = {config: {"pages": 0, "seconds": 0.0, "peak_rss_mb": 0.0, "parity": []} for config in configs}
+    for path in corpus_files(*args.folders):
+        reference = None
+        for backend, workers in configs:
+            result = measure(str(path), backend, workers, args.pages_per_task)
+            if reference is None:
+                reference = measure(str(path), "pdfplumber")["pages"] if backend != "pdfplumber" else result["pages"]
+            parity = text_parity(reference, result["pages"])
+            row = {
+                "file": str(path.relative_to(REPO_ROOT)),
+                "backend": backend,
+                "workers": workers,
+                "pages": len(result["pages"]),
+                "seconds": round(result["seconds"], 4),
+                "pages_per_second": round(len(result["pages"]) / result["seconds"], 2) if result["seconds"] else None,
+                "peak_rss_mb": round(result["peak_rss_mb"], 1),
+                "text_parity": round(parity, 4),
+            }
+            rows.append(row)
+            total = totals[(backend, workers)]
+            total["pages"] += row["pages"]
+            total["seconds"] += result["seconds"]
+            total["peak_rss_mb"] = max(total["peak_rss_mb"], row["peak_rss_mb"])
+            total["parity"].append(parity)
+
+    print(f"{'backend':<12}{'workers':>8}{'pages':>8}{'pages/s':>10}{'peak RSS MB':>13}{'mean parity':>13}")
+    summary = []
+    for (backend, workers), total in totals.items():
+        item = {
+            "backend": backend,
+            "workers": workers,
+            "pages": total["pages"],
+            "pages_per_second": round(total["pages"] / total["seconds"], 2) if total["seconds"] else None,
+            "peak_rss_mb": total["peak_rss_mb"],
+            "mean_text_parity": round(sum(total["parity"]) / len(total["parity"]), 4) if total["parity"] else None,
+        }
+        summary.append(item)
+        print(f"{backend:<12}{workers:>8}{item['pages']:>8}{item['pages_per_second']:>10}"
+              f"{item['peak_rss_mb']:>13}{item['mean_text_parity']:>13}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "files": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
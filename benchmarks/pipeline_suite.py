@@ -0,0 +1,276 @@
+"""
+Offline benchmark suite: the full `DocumentPipelineManager` flow over the bundled corpus.
+
+Every PDF under --folder is loaded, classified and extracted with `aload_document` +
+`aanalyze` (result cache off) against `benchmarks.fake_openai`, once per --concurrency level
+(documents in flight, like `core.main --concurrency`). Each level runs in a fresh process so
+its peak RSS is its own. The report holds, per level:
+- end-to-end docs/s and pages/s, and peak RSS of the pipeline process (loader pool workers
+  are separate processes and not included);
+- p50 / p99 / mean seconds per stage (load, classify, extract, or analyze in fused mode);
+- LLM calls and input / output tokens as reported by the API (the fake server counts
+  4 characters per token);
+- agreement with the golden results in output/ and output-extra/ (label, and metadata
+  fields after normalising case, whitespace and list order). With the fake LLM the metadata
+  is a fixed payload per label, so only the label column says something; use --live for
+  answer quality.
+
+The report is written as JSON (--output, by default under tmp/benchmarks/) and can be
+diffed against an earlier run with --compare, which lists every metric that got worse by
+more than --threshold and exits with status 1 if any did.
+
+    python -m benchmarks.pipeline_suite --concurrency 1 4 16
+    python -m benchmarks.pipeline_suite --compare tmp/benchmarks/pipeline_suite-<before>.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, List, Optional
+
+from benchmarks.utils import REPO_ROOT, corpus_files, fake_openai, fake_openai_env
+
+GOLDEN_FOLDERS = {"documents": "output", "documents-extra": "output-extra"}
+
+
+def golden_path(path: Path) -> Optional[Path]:
+    """output/<name>.json for documents/<name>.pdf, likewise for documents-extra (as written by core.main)."""
+    relative = path.relative_to(REPO_ROOT)
+    output_root = GOLDEN_FOLDERS.get(relative.parts[0])
+    if output_root is None:
+        return None
+    golden = REPO_ROOT / output_root / Path(*relative.parts[1:-1]) / f"{path.name.split('.')[0]}.json"
+    return golden if golden.exists() else None
+
+
+def normalise(value: Any) -> Any:
+    if isinstance(value, str):
+        return " ".join(value.lower().split())
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return round(float(value), 2)
+    if isinstance(value, list):
+        return sorted(json.dumps(normalise(v), sort_keys=True) for v in value)
+    if isinstance(value, dict):
+        return {k: normalise(v) for k, v in value.items()}
+    return value
+
+
+def compare_to_golden(classification: dict, metadata: dict, golden: dict) -> dict:
+    fields = golden.get("metadata") or {}
+    mismatched = [name for name, value in fields.items() if normalise(metadata.get(name)) != normalise(value)]
+    return {
+        "label_match": classification["type"] == golden["classification"]["type"],
+        "fields_total": len(fields),
+        "fields_matched": len(fields) - len(mismatched),
+        "mismatched_fields": mismatched,
+    }
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run_documents(pipeline, files: List[Path], concurrency: int) -> List[dict]:
+    from core.metrics import timed
+    queue, records = iter(files), []
+
+    async def worker():
+        # Workers share one iterator, so at most `concurrency` documents are in flight
+        for path in queue:
+            timings, usage = {}, {}
+            start = time.perf_counter()
+            with timed(timings, "load"):
+                pages = await pipeline.aload_document(str(path))
+            classification, metadata = await pipeline.aanalyze(pages, timings, usage)
+            record = {"document": str(path.relative_to(REPO_ROOT)), "pages": len(pages),
+                      "latency_s": time.perf_counter() - start, "timings": timings, "usage": usage,
+                      "classification": classification, "metadata": metadata.model_dump()}
+            golden = golden_path(path)
+            if golden is not None:
+                with open(golden, "r", encoding="utf-8") as f:
+                    record["golden"] = compare_to_golden(classification, record["metadata"], json.load(f))
+            records.append(record)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return records
+
+
+def summarise(records: List[dict], elapsed: float, concurrency: int) -> dict:
+    stages = sorted({stage for r in records for stage in r["timings"]})
+    compared = [r["golden"] for r in records if "golden" in r]
+    return {
+        "concurrency": concurrency,
+        "documents": len(records),
+        "pages": sum(r["pages"] for r in records),
+        "elapsed_s": elapsed,
+        "docs_per_s": len(records) / elapsed,
+        "pages_per_s": sum(r["pages"] for r in records) / elapsed,
+        # Linux reports ru_maxrss in KiB
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "latency_s": {"p50": percentile([r["latency_s"] for r in records], 0.5),
+                      "p99": percentile([r["latency_s"] for r in records], 0.99)},
+        "stages": {
+            stage: {"p50": percentile(values, 0.5), "p99": percentile(values, 0.99), "mean": sum(values) / len(values)}
+            for stage in stages
+            for values in [[r["timings"][stage] for r in records if stage in r["timings"]]]
+        },
+        "llm_calls": sum(r["usage"]["calls"] for r in records),
+        "input_tokens": sum(r["usage"]["input_tokens"] for r in records),
+        "output_tokens": sum(r["usage"]["output_tokens"] for r in records),
+        "golden": {
+            "documents": len(compared),
+            "label_accuracy": sum(g["label_match"] for g in compared) / len(compared) if compared else None,
+            "field_agreement": (sum(g["fields_matched"] for g in compared) / max(1, sum(g["fields_total"] for g in compared))
+                                if compared else None),
+        },
+    }
+
+
+def run_level(args: argparse.Namespace) -> dict:
+    """Run every document at one concurrency level in this process (see `--level`)."""
+    from core.document_pipeline import DocumentPipelineManager
+    files = corpus_files(*args.folder)[:args.limit]
+    pipeline = DocumentPipelineManager(cache=None, loader_workers=args.loader_workers, fused=args.fused,
+                                       extraction_chunk_tokens=args.extraction_chunk_tokens)
+    try:
+        start = time.perf_counter()
+        records = asyncio.run(run_documents(pipeline, files, args.level))
+        elapsed = time.perf_counter() - start
+    finally:
+        pipeline.close()
+    records.sort(key=lambda r: r["document"])
+    return {"summary": summarise(records, elapsed, args.level), "documents": records}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# (metric path, label, True if higher is better)
+COMPARED_METRICS = [
+    (("docs_per_s",), "docs/s", True),
+    (("pages_per_s",), "pages/s", True),
+    (("latency_s", "p50"), "latency p50 s", False),
+    (("latency_s", "p99"), "latency p99 s", False),
+    (("peak_rss_mb",), "peak RSS MB", False),
+    (("input_tokens",), "input tokens", False),
+    (("output_tokens",), "output tokens", False),
+    (("llm_calls",), "LLM calls", False),
+    (("golden", "label_accuracy"), "label accuracy", True),
+    (("golden", "field_agreement"), "field agreement", True),
+]
+
+
+def _lookup(summary: dict, path: tuple):
+    for key in path:
+        summary = summary.get(key) if isinstance(summary, dict) else None
+    return summary
+
+
+def compare_reports(before: dict, after: dict, threshold: float) -> List[str]:
+    """Print old vs new per level and metric; return the metrics that got worse by more than `threshold`."""
+    regressions = []
+    before_levels = {s["summary"]["concurrency"]: s["summary"] for s in before["levels"]}
+    print(f"\nCompared with {before.get('commit')} ({before.get('created_at')}):")
+    changed = {k: (v, after["config"].get(k)) for k, v in before.get("config", {}).items()
+               if k != "concurrency" and after["config"].get(k) != v}
+    if changed:
+        print(f"  Note: the runs used different settings {changed}")
+    print(f"{'level':>6}  {'metric':<20}{'before':>12}{'after':>12}{'change':>9}")
+    for level in after["levels"]:
+        new = level["summary"]
+        old = before_levels.get(new["concurrency"])
+        if old is None:
+            continue
+        metrics = COMPARED_METRICS + [(("stages", stage, "p99"), f"{stage} p99 s", False) for stage in new["stages"]]
+        for path, label, higher_is_better in metrics:
+            a, b = _lookup(old, path), _lookup(new, path)
+            if a is None or b is None:
+                continue
+            change = (b - a) / a if a else 0.0
+            worse = -change if higher_is_better else change
+            # Quality metrics must not drop at all, performance metrics only beyond the threshold
+            regressed = worse > (0 if path[0] == "golden" else threshold) and b != a
+            flag = "  <-- regression" if regressed else ""
+            print(f"{new['concurrency']:>6}  {label:<20}{a:>12.3f}{b:>12.3f}{change:>+9.1%}{flag}")
+            if regressed:
+                regressions.append(f"concurrency {new['concurrency']}: {label} {a:.3f} -> {b:.3f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="Documents in flight per run")
+    parser.add_argument("--folder", nargs="+", default=["documents", "documents-extra"])
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N documents")
+    parser.add_argument("--latency-ms", type=float, default=300, help="Fixed simulated latency per LLM call")
+    parser.add_argument("--ms-per-1k-tokens", type=float, default=50, help="Simulated latency per 1k prompt tokens")
+    parser.add_argument("--logprob-scale", type=float, default=1.0,
+                        help="Sharpness of the fake classification logprobs (below 1: less confident)")
+    parser.add_argument("--live", action="store_true", help="Call the real OpenAI API instead of the fake server")
+    parser.add_argument("--fused", action="store_true", help="Benchmark the fused single-call mode")
+    parser.add_argument("--extraction-chunk-tokens", type=int, default=None, help="Benchmark chunked extraction")
+    parser.add_argument("--loader-workers", type=int, default=2)
+    parser.add_argument("--output", help="Report path (default: tmp/benchmarks/pipeline_suite-<commit>-<time>.json)")
+    parser.add_argument("--compare", help="Earlier report to diff against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change counted as a regression")
+    parser.add_argument("--level", type=int, help=argparse.SUPPRESS)  # internal: run one level, print JSON
+    args = parser.parse_args()
+
+    if args.level is not None:
+        json.dump(run_level(args), sys.stdout)
+        return
+
+    config = {k: v for k, v in vars(args).items() if k not in ("output", "compare", "threshold", "level")}
+    report = {"created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"), "commit": git_commit(),
+              "config": config, "levels": []}
+    extra_env = {"FAKE_OPENAI_MS_PER_1K_TOKENS": str(args.ms_per_1k_tokens),
+                 "FAKE_OPENAI_LOGPROB_SCALE": str(args.logprob_scale)}
+    server = contextlib.nullcontext() if args.live else fake_openai(args.latency_ms, extra_env=extra_env)
+    with server as base_url:
+        env = {**os.environ, **(fake_openai_env(base_url) if base_url else {})}
+        print(f"{'concurrency':>11}{'docs/s':>8}{'pages/s':>9}{'p50 s':>7}{'p99 s':>7}{'RSS MB':>8}"
+              f"{'in tokens':>11}{'labels ok':>11}")
+        for level in args.concurrency:
+            # A fresh process per level, so peak RSS and warm state do not carry over
+            child = subprocess.run([sys.executable, "-W", "ignore", "-m", "benchmarks.pipeline_suite",
+                                    *sys.argv[1:], "--level", str(level)],
+                                   cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+            if child.returncode != 0:
+                sys.exit(f"Concurrency {level} failed:\n{child.stderr}")
+            result = json.loads(child.stdout)
+            report["levels"].append(result)
+            s = result["summary"]
+            labels = f"{s['golden']['label_accuracy']:.0%}" if s["golden"]["label_accuracy"] is not None else "-"
+            print(f"{level:>11}{s['docs_per_s']:>8.2f}{s['pages_per_s']:>9.1f}{s['latency_s']['p50']:>7.2f}"
+                  f"{s['latency_s']['p99']:>7.2f}{s['peak_rss_mb']:>8.0f}{s['input_tokens']:>11}{labels:>11}")
+
+    output = Path(args.output) if args.output else (
+        REPO_ROOT / "tmp" / "benchmarks" / f"pipeline_suite-{report['commit'] or 'nogit'}-{int(time.time())}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport written to {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare_reports(json.load(f), report, args.threshold)
+        if regressions:
+            print("\nRegressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+LLM calls against a rate-limited API: throughput, 429s and failures under load.
+
+Starts `benchmarks.fake_openai` with a quota of --rpm requests (and optionally --tpm tokens)
+per minute, of which the fake key can burst --burst-s seconds' worth, and analyzes --docs
+copies of one document with --concurrency documents in flight through the async pipeline
+(classification + extraction: two calls per document, result cache off). Nothing about the
+quota is configured client-side: the pipeline has to find it from the API's responses.
+Reports the requests per minute the API accepted against the quota, the 429s and other
+error responses, documents that failed, and the p50 / p99 document latency.
+
+With --baseline REF, the same load runs on the tree of a git ref (e.g. the commit before
+the shared transport), exported to tmp/ with `git archive`.
+
+    python -m benchmarks.rate_limit_load --docs 300 --rpm 600 --baseline HEAD~1
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DOCUMENT = "documents/invoice2.pdf"
+
+
+async def analyze_all(docs: int, concurrency: int) -> dict:
+    from core.document_pipeline import DocumentPipelineManager
+    pipeline = DocumentPipelineManager(cache=None)
+    pages = await pipeline.aload_document(str(REPO_ROOT / DOCUMENT))
+    latencies, failures = [], []
+    queue = iter(range(docs))
+
+    async def worker():
+        for _ in queue:
+            start = time.perf_counter()
+            try:
+                await pipeline.aanalyze(pages)
+            except Exception as e:
+                failures.append(type(e).__name__)
+            else:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    await pipeline.aclose()
+    return {"elapsed_s": elapsed, "latencies": latencies, "failures": failures}
+
+
+def run_worker(tree: Path, env: dict, docs: int, concurrency: int) -> dict:
+    """Run the load in a fresh interpreter on `tree`'s code (this script is reused for older trees)."""
+    env = {**os.environ, **env, "PYTHONPATH": str(tree)}
+    proc = subprocess.run([sys.executable, "-W", "ignore", str(Path(__file__).resolve()), "--worker",
+                           "--docs", str(docs), "--concurrency", str(concurrency)],
+                          cwd=tree, env=env, capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def summarize(run: dict, server: dict, rpm: float) -> dict:
+    latencies = sorted(run["latencies"]) or [0.0]
+    statuses = server["statuses"]
+    accepted = statuses.get("200", 0)
+    return {
+        "documents": len(run["latencies"]) + len(run["failures"]),
+        "failed_documents": len(run["failures"]),
+        "elapsed_s": round(run["elapsed_s"], 1),
+        "accepted_requests": accepted,
+        "accepted_per_minute": round(60 * accepted / run["elapsed_s"], 1),
+        "quota_per_minute": rpm,
+        "rate_limited_429": statuses.get("429", 0),
+        "other_errors": sum(v for k, v in statuses.items() if k not in ("200", "429")),
+        "latency_p50_s": round(statistics.median(latencies), 2),
+        "latency_p99_s": round(latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=300, help="Documents to analyze")
+    parser.add_argument("--concurrency", type=int, default=32, help="Documents in flight")
+    parser.add_argument("--rpm", type=float, default=600, help="Requests per minute the fake API accepts")
+    parser.add_argument("--tpm", type=float, default=0, help="Tokens per minute the fake API accepts (0: no limit)")
+    parser.add_argument("--burst-s", type=float, default=5, help="Seconds of quota the fake API lets through at once")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests answered with a random 429/503")
+    parser.add_argument("--latency-ms", type=float, default=100, help="Simulated LLM latency per call")
+    parser.add_argument("--baseline", help="Git ref to compare with, e.g. HEAD~1")
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(asyncio.run(analyze_all(args.docs, args.concurrency))))
+        return
+
+    from benchmarks.startup import export_tree
+    from benchmarks.utils import fake_openai, fake_openai_env
+
+    trees = {"current": REPO_ROOT}
+    if args.baseline:
+        trees[f"baseline ({args.baseline})"] = export_tree(args.baseline)
+    quota = {"FAKE_OPENAI_RPM": str(args.rpm), "FAKE_OPENAI_TPM": str(args.tpm),
+             "FAKE_OPENAI_BURST_S": str(args.burst_s), "FAKE_OPENAI_ERROR_RATE": str(args.error_rate)}
+
+    results = {}
+    with fake_openai(args.latency_ms, extra_env=quota) as url:
+        stats_url = url[:-len("/v1")] + "/stats"
+        for name, tree in trees.items():
+            httpx.post(stats_url + "/reset").raise_for_status()
+            run = run_worker(tree, fake_openai_env(url), args.docs, args.concurrency)
+            results[name] = summarize(run, httpx.get(stats_url).json(), args.rpm)
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Where does request latency go? Per-stage p50 / p99 from the API's own `/metrics`.
+
+Starts the API against `benchmarks.fake_openai` (result cache off), posts --requests
+uploads of the bundled documents to `POST /documents/analyze` with --concurrency in flight,
+then scrapes `GET /metrics` and estimates quantiles from the `pdf_analyzer_stage_seconds`
+and `pdf_analyzer_http_request_seconds` histograms the same way Prometheus'
+`histogram_quantile` does (linear interpolation inside a bucket).
+
+    python -m benchmarks.stage_latency --requests 100 --concurrency 8
+"""
+import argparse
+import asyncio
+import json
+import math
+import re
+from collections import defaultdict
+
+import httpx
+
+from benchmarks.utils import REPO_ROOT, corpus_files, fake_openai, fake_openai_env, free_port, serve
+
+SAMPLE = re.compile(r'^(\w+)\{(.*)\} (\S+)$')
+
+
+def parse_histograms(text: str, name: str) -> dict:
+    """{labels without "le": [(upper bound, cumulative count), ...]} for one histogram."""
+    bounds = defaultdict(list)
+    for line in text.splitlines():
+        match = SAMPLE.match(line)
+        if match and match.group(1) == f"{name}_bucket":
+            labels = dict(re.findall(r'(\w+)="([^"]*)"', match.group(2)))
+            le = labels.pop("le")
+            bounds[tuple(sorted(labels.items()))].append(
+                (math.inf if le == "+Inf" else float(le), float(match.group(3))))
+    return {key: sorted(values) for key, values in bounds.items()}
+
+
+def quantile(buckets: list, q: float) -> float:
+    total = buckets[-1][1]
+    if total == 0:
+        return float("nan")
+    rank, lower, below = q * total, 0.0, 0.0
+    for bound, cumulative in buckets:
+        if cumulative >= rank:
+            if math.isinf(bound):
+                return lower
+            return lower + (bound - lower) * (rank - below) / max(cumulative - below, 1e-9)
+        lower, below = bound, cumulative
+    return lower
+
+
+async def post_all(base: str, files: list, requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(base_url=base, timeout=120) as client:
+        async def post(i):
+            path = files[i % len(files)]
+            async with semaphore:
+                r = await client.post("/documents/analyze", files={"file": (f"{i}_{path.name}", path.read_bytes())})
+                r.raise_for_status()
+
+        await asyncio.gather(*(post(i) for i in range(requests)))
+        return (await client.get("/metrics")).text
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=300, help="Simulated LLM latency per call")
+    parser.add_argument("--output", help="Write the quantiles as JSON to this path")
+    args = parser.parse_args()
+
+    files = corpus_files("documents", "documents-extra")
+    with fake_openai(args.latency_ms) as base_url:
+        port = free_port()
+        env = {**fake_openai_env(base_url), "RESULT_CACHE": "0",
+               "DOCUMENT_STORE": str(REPO_ROOT / "tmp" / f"stage_latency_{port}.sqlite")}
+        with serve("api:app", port, env):
+            metrics = asyncio.run(post_all(f"http://127.0.0.1:{port}", files, args.requests, args.concurrency))
+
+    report = {}
+    print(f"{'stage':<22}{'p50 s':>8}{'p99 s':>8}")
+    histograms = {**parse_histograms(metrics, "pdf_analyzer_stage_seconds"),
+                  **{(("stage", "request total"),): buckets
+                     for labels, buckets in parse_histograms(metrics, "pdf_analyzer_http_request_seconds").items()
+                     if ("route", "/documents/analyze") in labels}}
+    for labels, buckets in histograms.items():
+        stage = dict(labels)["stage"]
+        report[stage] = {"count": int(buckets[-1][1]), "p50_s": quantile(buckets, 0.5), "p99_s": quantile(buckets, 0.99)}
+        print(f"{stage:<22}{report[stage]['p50_s']:>8.3f}{report[stage]['p99_s']:>8.3f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
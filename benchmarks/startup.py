@@ -0,0 +1,131 @@
+"""
+API cold start: import-time breakdown, time until listening and time to the first analysis.
+
+1. Imports: runs `python -X importtime -c "import api"` and sums the self time of every
+   module by top-level package (fastapi, langchain_core, openai, ...), for the total and the
+   slowest packages.
+2. Start-up: launches `uvicorn api:app` --runs times against `benchmarks.fake_openai`
+   (result cache off, fresh document store) and measures, from process launch, when the
+   port accepts connections and when the first `POST /documents/analyze` returns, plus the
+   latency of that first request and of a second one. With --warmup the server also runs
+   with WARMUP=1 and the time until `GET /health` reports it warm is measured.
+3. With --baseline REF, the same is measured on the tree of a git ref (e.g. the commit
+   before lazy loading), exported to tmp/ with `git archive`.
+
+    python -m benchmarks.startup --runs 5 --warmup --baseline HEAD~1
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tarfile
+import time
+from collections import Counter
+from pathlib import Path
+
+import httpx
+
+from benchmarks.utils import REPO_ROOT, fake_openai, fake_openai_env, free_port, wait_for_port
+
+DOCUMENT = "documents/invoice2.pdf"
+
+
+def import_breakdown(tree: Path, top: int = 10) -> dict:
+    env = {**os.environ, "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "sk-fake"), "PYTHONPATH": str(tree)}
+    proc = subprocess.run([sys.executable, "-W", "ignore", "-X", "importtime", "-c", "import api"],
+                          cwd=tree, env=env, capture_output=True, text=True, check=True)
+    packages, total_us = Counter(), 0
+    for line in proc.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)", line)
+        if match is None:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        packages[module.split(".")[0]] += int(self_us)
+        if len(indent) == 1:
+            total_us += int(cumulative_us)
+    return {"total_ms": total_us / 1000,
+            "packages_ms": {name: us / 1000 for name, us in packages.most_common(top)}}
+
+
+def start_once(tree: Path, env: dict, warmup: bool) -> dict:
+    port = free_port()
+    env = {**os.environ, **env, "PYTHONPATH": str(tree), "RESULT_CACHE": "0",
+           "DOCUMENT_STORE": str(REPO_ROOT / "tmp" / "startup" / f"documents_{port}.sqlite"),
+           "WARMUP": "1" if warmup else "0"}
+    cmd = [sys.executable, "-W", "ignore", "-m", "uvicorn", "api:app", "--host", "127.0.0.1",
+           "--port", str(port), "--log-level", "warning"]
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=tree, env=env)
+    try:
+        wait_for_port(port, timeout=60, interval=0.005)
+        result = {"listening_s": time.perf_counter() - start}
+        data = (REPO_ROOT / DOCUMENT).read_bytes()
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=120) as client:
+            if warmup:
+                while not client.get("/health").json()["warm"]:
+                    time.sleep(0.005)
+                result["warm_s"] = time.perf_counter() - start
+            for name in ("first", "second"):
+                sent = time.perf_counter()
+                client.post("/documents/analyze", files={"file": (Path(DOCUMENT).name, data)}).raise_for_status()
+                result[f"{name}_request_s"] = time.perf_counter() - sent
+                if name == "first":
+                    result["first_response_s"] = time.perf_counter() - start
+        return result
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def measure(tree: Path, env: dict, runs: int, warmup: bool) -> dict:
+    results = [start_once(tree, env, warmup) for _ in range(runs)]
+    return {key: statistics.median(r[key] for r in results) for key in results[0]}
+
+
+def export_tree(ref: str) -> Path:
+    tree = REPO_ROOT / "tmp" / "startup" / f"tree_{re.sub(r'[^A-Za-z0-9]', '_', ref)}"
+    shutil.rmtree(tree, ignore_errors=True)
+    tree.mkdir(parents=True)
+    archive = subprocess.run(["git", "archive", ref], cwd=REPO_ROOT, capture_output=True, check=True).stdout
+    archive_path = tree.parent / f"{tree.name}.tar"
+    archive_path.write_bytes(archive)
+    with tarfile.open(archive_path) as tar:
+        tar.extractall(tree)
+    archive_path.unlink()
+    return tree
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Server starts per configuration (medians are reported)")
+    parser.add_argument("--warmup", action="store_true", help="Also start with WARMUP=1")
+    parser.add_argument("--baseline", help="Git ref to compare with, e.g. HEAD~1")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Simulated LLM latency per call")
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    args = parser.parse_args()
+
+    (REPO_ROOT / "tmp" / "startup").mkdir(parents=True, exist_ok=True)
+    trees = {"current": REPO_ROOT}
+    if args.baseline:
+        trees[f"baseline ({args.baseline})"] = export_tree(args.baseline)
+
+    results = {}
+    with fake_openai(args.latency_ms) as url:
+        env = fake_openai_env(url)
+        for name, tree in trees.items():
+            results[name] = {"imports": import_breakdown(tree), "start": measure(tree, env, args.runs, False)}
+            if args.warmup and name == "current":
+                results[name]["start_warmup"] = measure(tree, env, args.runs, True)
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
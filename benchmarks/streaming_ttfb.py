@@ -0,0 +1,73 @@
+"""
+Time to the first useful result: `POST /documents/analyze/stream` vs `POST /documents/analyze`.
+
+Starts the API against `benchmarks.fake_openai` (result cache off, generation slowed down by
+--ms-per-output-token) and uploads every bundled document once per endpoint, one at a time.
+For the stream it records when the first byte, the classification, the first partial metadata
+and the final metadata arrive; for the plain endpoint, the time to the whole response.
+
+    python -m benchmarks.streaming_ttfb --latency-ms 300 --ms-per-output-token 20
+"""
+import argparse
+import json
+import statistics
+import time
+
+import httpx
+
+from benchmarks.utils import REPO_ROOT, corpus_files, fake_openai, fake_openai_env, free_port, serve
+
+
+def stream_timings(client: httpx.Client, path) -> dict:
+    start, marks = time.perf_counter(), {}
+    with client.stream("POST", "/documents/analyze/stream", files={"file": (path.name, path.read_bytes())}) as r:
+        r.raise_for_status()
+        for line in r.iter_lines():
+            if not line:
+                continue
+            marks.setdefault("first_byte", time.perf_counter() - start)
+            event = json.loads(line)["event"]
+            if event == "error":
+                raise RuntimeError(line)
+            marks.setdefault(event, time.perf_counter() - start)
+    return marks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=float, default=300, help="Simulated LLM latency per call")
+    parser.add_argument("--ms-per-output-token", type=float, default=20, help="Simulated generation time per token")
+    parser.add_argument("--output", help="Write the per-document timings as JSON to this path")
+    args = parser.parse_args()
+
+    files = corpus_files("documents", "documents-extra")
+    rows = []
+    with fake_openai(args.latency_ms, extra_env={"FAKE_OPENAI_MS_PER_OUTPUT_TOKEN": str(args.ms_per_output_token)}) as url:
+        port = free_port()
+        env = {**fake_openai_env(url), "RESULT_CACHE": "0",
+               "DOCUMENT_STORE": str(REPO_ROOT / "tmp" / f"streaming_ttfb_{port}.sqlite")}
+        with serve("api:app", port, env), httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=300) as client:
+            print(f"{'document':<42}{'class s':>8}{'done s':>8}{'plain s':>8}")
+            for path in files:
+                marks = stream_timings(client, path)
+                start = time.perf_counter()
+                client.post("/documents/analyze", files={"file": (path.name, path.read_bytes())}).raise_for_status()
+                rows.append({"document": path.name, "analyze_s": time.perf_counter() - start,
+                             **{f"{event}_s": marks.get(event) for event in
+                                ("first_byte", "classification", "metadata_partial", "metadata", "done")}})
+                print(f"{path.name[:40]:<42}{rows[-1]['classification_s']:>8.2f}{rows[-1]['done_s']:>8.2f}"
+                      f"{rows[-1]['analyze_s']:>8.2f}")
+
+    print(f"\n{'median over ' + str(len(rows)) + ' documents':<32}{'seconds':>8}")
+    for key in ("first_byte_s", "classification_s", "metadata_partial_s", "metadata_s", "done_s", "analyze_s"):
+        values = [row[key] for row in rows if row[key] is not None]
+        if values:
+            print(f"{key:<32}{statistics.median(values):>8.2f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Metadata extraction with free-form JSON answers vs structured outputs: prompt tokens per call,
+local repairs and whole-document resends.
+
+Extracts the metadata of every bundled document (with its known type, --rounds times, result
+cache off) against `benchmarks.fake_openai`, where --malformed-rate of the free-form answers
+come back damaged (see FAKE_OPENAI_MALFORMED_RATE; schema-constrained answers are always
+valid, as the real API guarantees). Configurations:
+
+- structured: answers constrained to the metadata JSON schema (the default);
+- free-form: format instructions in the prompt (STRUCTURED_EXTRACTION=0), with local repair;
+- with --baseline REF: the tree of a git ref, e.g. the commit before this change (free-form
+  answers, no repair), exported to tmp/ with `git archive`.
+
+Reports LLM calls and prompt tokens per extraction call, answers repaired locally, retried
+extractions (each one re-sends the whole document) and extractions that failed after all
+retries.
+
+    python -m benchmarks.structured_extraction --rounds 3 --malformed-rate 0.1 --baseline HEAD~1
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def extract_all(rounds: int, structured: str) -> dict:
+    from core.document_pipeline import DocumentPipelineManager
+    from core.local_classifier import load_labelled_corpus
+    from core import metrics
+
+    options = {} if structured == "default" else {"structured_extraction": structured == "on"}
+    pipeline = DocumentPipelineManager(cache=None, **options)
+    corpus = load_labelled_corpus(str(REPO_ROOT), max_pages=None)
+    failures = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for _, pages, label in corpus:
+            try:
+                pipeline.extract_metadata(pages, label)
+            except Exception:
+                failures += 1
+    elapsed = time.perf_counter() - start
+    pipeline.close()
+    parses = getattr(metrics, "METADATA_PARSES", None)
+    return {
+        "extractions": rounds * len(corpus),
+        "calls": metrics.LLM_CALLS.value(stage="extract"),
+        "input_tokens": metrics.LLM_TOKENS.value(stage="extract", kind="input"),
+        "repaired": parses.value(result="repaired") if parses is not None else 0,
+        "retries": metrics.RETRIES.value(operation="extract_metadata"),
+        "failed": failures,
+        "elapsed_s": elapsed,
+    }
+
+
+def run_worker(tree: Path, env: dict, rounds: int, structured: str) -> dict:
+    """Run the extractions in a fresh interpreter on `tree`'s code (this script is reused for older trees)."""
+    env = {**os.environ, **env, "PYTHONPATH": str(tree)}
+    proc = subprocess.run([sys.executable, "-W", "ignore", str(Path(__file__).resolve()), "--worker",
+                           "--rounds", str(rounds), "--structured", structured],
+                          cwd=tree, env=env, capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def summarize(run: dict) -> dict:
+    return {
+        "extractions": run["extractions"],
+        "calls_per_extraction": round(run["calls"] / run["extractions"], 3),
+        "input_tokens_per_call": round(run["input_tokens"] / max(run["calls"], 1)),
+        "repaired_answers": int(run["repaired"]),
+        "retried_extractions": int(run["retries"]),
+        "retry_rate": round(run["retries"] / run["extractions"], 3),
+        "failed_extractions": run["failed"],
+        "elapsed_s": round(run["elapsed_s"], 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=3, help="Extractions of each bundled document")
+    parser.add_argument("--malformed-rate", type=float, default=0.1, help="Fraction of free-form answers damaged")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Simulated LLM latency per call")
+    parser.add_argument("--baseline", help="Git ref to compare with, e.g. HEAD~1")
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--structured", default="default", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(extract_all(args.rounds, args.structured)))
+        return
+
+    from benchmarks.startup import export_tree
+    from benchmarks.utils import fake_openai, fake_openai_env
+
+    configurations = {"structured": (REPO_ROOT, "on"), "free-form + repair": (REPO_ROOT, "off")}
+    if args.baseline:
+        configurations[f"baseline ({args.baseline})"] = (export_tree(args.baseline), "default")
+
+    results = {}
+    with fake_openai(args.latency_ms, extra_env={"FAKE_OPENAI_MALFORMED_RATE": str(args.malformed_rate)}) as url:
+        for name, (tree, structured) in configurations.items():
+            results[name] = summarize(run_worker(tree, fake_openai_env(url), args.rounds, structured))
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Upload handling of `POST /documents/analyze`: same-name uploads under concurrency, per-request
+upload and load time, and files left behind.
+
+Starts the API against `benchmarks.fake_openai` (result cache off) and posts the bundled
+documents, all under the same client file name ("document.pdf"): once one at a time, which
+gives the reference label of each file, then --rounds times with --concurrency requests in
+flight. Reports the requests that failed or came back with a label different from the
+reference (an upload parsed from another request's bytes), the p50 / p99 of the `upload`
+and `load` stages from the responses' timings, and the files the run left under tmp/.
+
+With --baseline REF, the same requests are sent to the API of a git ref's tree (e.g. the
+commit before in-memory uploads), exported to tmp/ with `git archive`.
+
+    python -m benchmarks.upload_handling --rounds 5 --concurrency 8 --baseline HEAD~1
+"""
+import argparse
+import json
+import statistics
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import httpx
+
+from benchmarks.utils import REPO_ROOT, corpus_files, fake_openai, fake_openai_env, free_port, serve
+
+FILENAME = "document.pdf"
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values) or [0.0]
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def tmp_files(tree: Path) -> set:
+    # Baseline trees are exported under tmp/startup: leave them out of the count
+    return {p for p in (tree / "tmp").rglob("*")
+            if p.is_file() and "startup" not in p.relative_to(tree / "tmp").parts}
+
+
+def run(tree: Path, url: str, files: list, rounds: int, concurrency: int) -> dict:
+    port = free_port()
+    store = tempfile.TemporaryDirectory()
+    env = {**fake_openai_env(url), "RESULT_CACHE": "0", "DOCUMENT_STORE": str(Path(store.name) / "documents.sqlite")}
+    before = tmp_files(tree)
+    with store, serve("api:app", port, env, cwd=tree), \
+            httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=600,
+                         limits=httpx.Limits(max_connections=concurrency)) as client:
+
+        def post(path: Path) -> dict:
+            r = client.post("/documents/analyze", files={"file": (FILENAME, path.read_bytes())})
+            if r.status_code != 200:
+                return {"path": path, "label": None, "timings": {}}
+            body = r.json()
+            return {"path": path, "label": body["classification"]["type"], "timings": body["timings"]}
+
+        sequential = list(map(post, files))
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(post, files * rounds))
+    left = tmp_files(tree) - before
+    reference = {r["path"]: r["label"] for r in sequential}
+    ok = [r for r in results if r["label"] is not None]
+    return {
+        "requests": len(results),
+        "failed": len(results) - len(ok),
+        "wrong_label": sum(r["label"] != reference[r["path"]] for r in ok),
+        # Stage times of the one-at-a-time pass, where every request parses its own file
+        **stage_times(sequential, "upload"),
+        **stage_times(sequential, "load"),
+        "files_left_in_tmp": len(left),
+    }
+
+
+def stage_times(results: list, stage: str) -> dict:
+    seconds = [r["timings"][stage] for r in results if r["label"] is not None]
+    return {f"{stage}_ms_p50": round(1000 * statistics.median(seconds), 2),
+            f"{stage}_ms_p99": round(1000 * percentile(seconds, 0.99), 2),
+            f"{stage}_ms_total": round(1000 * sum(seconds), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=5, help="Times each bundled document is posted concurrently")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight")
+    parser.add_argument("--latency-ms", type=float, default=100, help="Simulated LLM latency per call")
+    parser.add_argument("--baseline", help="Git ref to compare with, e.g. HEAD~1")
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    args = parser.parse_args()
+
+    from benchmarks.startup import export_tree
+
+    files = corpus_files()
+    trees = {"current": REPO_ROOT}
+    if args.baseline:
+        trees[f"baseline ({args.baseline})"] = export_tree(args.baseline)
+
+    results = {"documents": len(files)}
+    with fake_openai(args.latency_ms) as url:
+        for name, tree in trees.items():
+            results[name] = run(tree, url, files, args.rounds, args.concurrency)
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
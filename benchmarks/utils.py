@@ -0,0 +1,63 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 30.0, interval: float = 0.1):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(interval)
+    raise TimeoutError(f"Nothing listening on port {port} after {timeout}s")
+
+
+@contextmanager
+def serve(app: str, port: int, env: Optional[Dict[str, str]] = None, workers: int = 1,
+          cwd: Optional[Path] = None) -> Iterator[subprocess.Popen]:
+    """Run `uvicorn <app>` from the repo root (or `cwd`) in a subprocess for the duration of the block."""
+    cmd = [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(port),
+           "--workers", str(workers), "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, cwd=cwd or REPO_ROOT, env={**os.environ, **(env or {})})
+    try:
+        wait_for_port(port)
+        yield proc
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+@contextmanager
+def fake_openai(latency_ms: float = 200, port: Optional[int] = None, extra_env: Optional[Dict[str, str]] = None) -> Iterator[str]:
+    """Start `benchmarks.fake_openai` and yield its base URL."""
+    port = port or free_port()
+    env = {"FAKE_OPENAI_LATENCY_MS": str(latency_ms), **(extra_env or {})}
+    with serve("benchmarks.fake_openai:app", port, env):
+        yield f"http://127.0.0.1:{port}/v1"
+
+
+def fake_openai_env(base_url: str) -> Dict[str, str]:
+    """Environment that points both the openai SDK and langchain-openai at a fake server."""
+    return {"OPENAI_BASE_URL": base_url, "OPENAI_API_KEY": "sk-fake"}
+
+
+def corpus_files(*folders: str) -> List[Path]:
+    files = []
+    for folder in folders or ("documents", "documents-extra"):
+        files.extend(sorted(p for p in (REPO_ROOT / folder).rglob("*") if p.suffix.lower() == ".pdf"))
+    return files
@@ -1,17 +1,29 @@
-from typing import List, Dict
+from datetime import date
+from typing import Any, List, Dict, Optional
+
+from core.invoice_templates import parse_date
+
+# Action priorities, most urgent first (the action index stores their position)
+PRIORITIES = ("high", "medium", "low")
+
+def _parties(metadata: Dict) -> str:
+    # Extraction returns parties=None (or null entries) when the document names none
+    parties = [str(party) for party in metadata.get("parties") or [] if party]
+    return ", ".join(parties) or "unknown parties"
 
 def actions_for_invoice(metadata: Dict) -> List[Dict]:
+    vendor = metadata.get("vendor") or "unknown vendor"
     actions = []
     actions.append({
         "type": "talk_to_finance_team",
-        "description": f"Discuss invoice from {metadata.get('vendor', 'unknown vendor')} with finance team.",
-        "deadline": metadata["due_date"],
+        "description": f"Discuss invoice from {vendor} with finance team.",
+        "deadline": metadata.get("due_date"),
         "priority": "medium"
     })
     if metadata.get("due_date"):
         actions.append({
             "type": "payment_due",
-            "description": f"Schedule payment of {metadata.get('amount')} to {metadata.get('vendor')}.",
+            "description": f"Schedule payment of {metadata.get('amount') or 'the invoiced amount'} to {vendor}.",
             "deadline": metadata["due_date"],
             "priority": "high"
         })
@@ -21,7 +33,7 @@ def actions_for_contract(metadata: Dict) -> List[Dict]:
     actions = []
     actions.append({
         "type": "print_contract",
-        "description": f"Print contract with {', '.join(metadata.get('parties', []))}.",
+        "description": f"Print contract with {_parties(metadata)}.",
         "priority": "low"
     })
 
@@ -29,14 +41,14 @@ def actions_for_contract(metadata: Dict) -> List[Dict]:
     if metadata.get("termination_date"):
         actions.append({
             "type": "review_contract",
-            "description": f"Review contract before termination with {', '.join(metadata.get('parties', []))}.",
+            "description": f"Review contract before termination with {_parties(metadata)}.",
             "deadline": metadata["termination_date"],
             "priority": "medium"
         })
 
         actions.append({
             "type": "sign_contract",
-            "description": f"Sign contract with {', '.join(metadata.get('parties', []))}.",
+            "description": f"Sign contract with {_parties(metadata)}.",
             "deadline": metadata["termination_date"],
             "priority": "high"
         })
@@ -67,3 +79,41 @@ ACTION_GENERATORS = {
     "Earnings": actions_for_earnings,
     "Other": actions_for_other
 }
+
+
+def parse_deadline(value: Any) -> Optional[str]:
+    """
+    A deadline as YYYY-MM-DD, or None if it is missing or not a date. Besides ISO dates, the
+    LLM often writes dates like "March 5, 2024" or "31/12/2026": those are read like invoice
+    template dates (`parse_date`), as long as they have a single reading ("03/05/2024" does not).
+    """
+    if not isinstance(value, str):
+        return None
+    try:
+        return date.fromisoformat(value.strip()[:10]).isoformat()
+    except ValueError:
+        pass
+    readings = {iso for iso, _ in parse_date(value)}
+    return readings.pop() if len(readings) == 1 else None
+
+
+def generate_actions(doc_type: str, metadata: Dict) -> List[Dict]:
+    """
+    Actions of a document, normalized: every action has a type, a description, a deadline
+    (YYYY-MM-DD or None) and a priority from `PRIORITIES` (unknown ones become "medium").
+
+    Actions are generated inside the document store's write, so this never raises: metadata
+    a generator cannot handle falls back to a human review action, and malformed actions
+    are skipped.
+    """
+    generator = ACTION_GENERATORS.get(doc_type, actions_for_other)
+    try:
+        actions = generator(metadata if isinstance(metadata, dict) else {})
+    except Exception:
+        actions = actions_for_other({})
+    return [{
+        "type": str(action["type"]),
+        "description": str(action["description"]),
+        "deadline": parse_deadline(action.get("deadline")),
+        "priority": action.get("priority") if action.get("priority") in PRIORITIES else "medium",
+    } for action in actions if isinstance(action, dict) and action.get("type") and action.get("description")]
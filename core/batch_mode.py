@@ -0,0 +1,292 @@
+"""
+Offline OpenAI Batch API mode for bulk classification and extraction.
+
+A batch run lives in a work directory and advances through these states:
+
+1. classification: render one classification request per document into
+   `classification_requests.jsonl` and submit it as a batch.
+2. extraction: once the classification batch completes, compute the label softmax from the
+   returned logprobs, render the type-specific extraction requests into
+   `extraction_requests.jsonl` and submit them as a second batch.
+3. done: once the extraction batch completes, parse the metadata with the Pydantic parsers
+   and write one record per document to `results.jsonl` (same format as `core/main.py`).
+
+Extraction sends what the online path sends: one request per chunk in map-reduce mode
+(custom id "<key>#<chunk>", chunk counts in `extraction_chunks.json`), merged at ingest with
+the same `METADATA_MERGERS`. Classification sends a single window per document: incremental
+windows need each answer before the next, wider window, so the batch classifies with the last
+(widest) window, as the online path does when it reads every window.
+
+Each `advance` call moves the run forward as far as it can without blocking, so it can be
+driven by cron; `--wait` polls until the run is done.
+
+    python -m core.batch_mode --input documents-extra --work-dir batch/nightly --wait
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import uuid4
+from openai import OpenAI
+from openai.types.chat import ChatCompletion
+from core.document_pipeline import DocumentPipelineManager
+from core.main import iter_documents
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+
+class OpenAIBatchClient:
+    """Submits request files to the OpenAI Batch API and downloads their output."""
+
+    def __init__(self, client: Optional[OpenAI] = None, completion_window: str = "24h"):
+        self.client = client or OpenAI()
+        self.completion_window = completion_window
+
+    def submit(self, requests_path: Path) -> str:
+        with open(requests_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    def download(self, batch_id: str, output_path: Path) -> bool:
+        """
+        Write the batch output (including failed requests) to `output_path`.
+
+        Returns:
+            bool: True if the batch finished and its output was written, False if it is still running.
+        """
+        batch = self.client.batches.retrieve(batch_id)
+        if batch.status in ("failed", "expired", "cancelled"):
+            raise RuntimeError(f"Batch {batch_id} ended with status '{batch.status}'")
+        if batch.status != "completed":
+            return False
+        with open(output_path, "wb") as f:
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    f.write(self.client.files.content(file_id).read())
+        return True
+
+
+def _read_jsonl(path: Path) -> Iterable[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _chunk_ids(key: str, count: int) -> List[str]:
+    """Custom ids of a document's extraction requests: the key itself unless it was split into chunks."""
+    return [key] if count == 1 else [f"{key}#{i}" for i in range(count)]
+
+
+def _write_jsonl(path: Path, records: Iterable[dict]) -> int:
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+class BatchPipeline:
+    """
+    Two-phase (render + submit, then ingest) Batch API driver around a DocumentPipelineManager.
+
+    Args:
+        pipeline (DocumentPipelineManager): Provides the loader, prompts and parsers.
+        work_dir (str): Directory holding the state, request and output files of one run.
+        client: Object with `submit(path) -> batch_id` and `download(batch_id, path) -> bool`,
+                e.g. `OpenAIBatchClient` or a local stand-in.
+    """
+
+    def __init__(self, pipeline: DocumentPipelineManager, work_dir: str, client=None):
+        self.pipeline = pipeline
+        self.work_dir = Path(work_dir)
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.client = client or OpenAIBatchClient()
+        self.state_path = self.work_dir / "state.json"
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def load_state(self) -> dict:
+        if self.state_path.exists():
+            return json.loads(self.state_path.read_text(encoding="utf-8"))
+        return {"phase": "new"}
+
+    def save_state(self, state: dict):
+        self.state_path.write_text(json.dumps(state, indent=2), encoding="utf-8")
+
+    def _documents(self) -> Dict[str, str]:
+        return {d["key"]: d["path"] for d in _read_jsonl(self.work_dir / "documents.jsonl")}
+
+    def _record_usage(self, body: dict):
+        usage = body.get("usage") or {}
+        self.input_tokens += usage.get("prompt_tokens", 0)
+        self.output_tokens += usage.get("completion_tokens", 0)
+
+    def render_classification(self, documents: Iterable[Tuple[str, Path]]) -> Path:
+        """Phase 1: write the document manifest and one classification request per document."""
+        documents = list(documents)
+        _write_jsonl(self.work_dir / "documents.jsonl", ({"key": k, "path": str(p)} for k, p in documents))
+
+        def requests():
+            for key, path in documents:
+                with self.pipeline.load_document(str(path)) as pages:
+                    body = self.pipeline.classifier.build_request(pages)
+                yield {"custom_id": key, "method": "POST", "url": BATCH_ENDPOINT, "body": body}
+
+        requests_path = self.work_dir / "classification_requests.jsonl"
+        _write_jsonl(requests_path, requests())
+        return requests_path
+
+    def ingest_classification(self, output_path: Path) -> Dict[str, dict]:
+        """Phase 2: turn classification batch output into {"type", "confidence"} per document."""
+        classifications = {}
+        for line in _read_jsonl(output_path):
+            response = line.get("response") or {}
+            if response.get("status_code") != 200:
+                classifications[line["custom_id"]] = {"error": str(line.get("error") or response)}
+                continue
+            self._record_usage(response["body"])
+            try:
+                classifier = self.pipeline.classifier
+                classifications[line["custom_id"]] = classifier.result(classifier.parse_response(
+                    ChatCompletion.model_validate(response["body"])
+                ))
+            except ValueError as e:
+                classifications[line["custom_id"]] = {"error": str(e)}
+        (self.work_dir / "classifications.json").write_text(json.dumps(classifications, indent=2), encoding="utf-8")
+        return classifications
+
+    def render_extraction(self, classifications: Dict[str, dict]) -> Path:
+        """
+        Phase 1 of the second round: one type-specific extraction request per classified document
+        (per chunk in map-reduce mode).
+        """
+        documents = self._documents()
+        chunk_counts = {}
+
+        def requests():
+            for key, classification in classifications.items():
+                if "error" in classification:
+                    continue
+                extractor = self.pipeline.get_extractor(classification["type"])
+                with self.pipeline.load_document(documents[key]) as pages:
+                    # The texts `invoke` sends: the budgeted text, or each chunk in map-reduce mode
+                    bodies = [extractor.build_request(pages, content) for content in extractor.build_chunks(pages)]
+                chunk_counts[key] = len(bodies)
+                for custom_id, body in zip(_chunk_ids(key, len(bodies)), bodies):
+                    yield {"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}
+
+        requests_path = self.work_dir / "extraction_requests.jsonl"
+        _write_jsonl(requests_path, requests())
+        (self.work_dir / "extraction_chunks.json").write_text(json.dumps(chunk_counts, indent=2), encoding="utf-8")
+        return requests_path
+
+    def ingest_extraction(self, output_path: Path, classifications: Dict[str, dict]) -> Path:
+        """Phase 2 of the second round: parse metadata and write results keyed by document."""
+        documents = self._documents()
+        outputs = {line["custom_id"]: line for line in _read_jsonl(output_path)}
+        chunks_path = self.work_dir / "extraction_chunks.json"
+        # Runs rendered before chunking was supported have one request per document
+        chunk_counts = json.loads(chunks_path.read_text(encoding="utf-8")) if chunks_path.exists() else {}
+
+        def results():
+            for key, classification in classifications.items():
+                record = {"key": key, "path": documents[key]}
+                if "error" in classification:
+                    yield {**record, "status": "error", "error": classification["error"]}
+                    continue
+                lines = [outputs.get(custom_id) or {} for custom_id in _chunk_ids(key, chunk_counts.get(key, 1))]
+                responses = [line.get("response") or {} for line in lines]
+                # Count every chunk's tokens before looking for failures, as the online merge does
+                for response in responses:
+                    if response.get("status_code") == 200:
+                        self._record_usage(response["body"])
+                failed = next((i for i, r in enumerate(responses) if r.get("status_code") != 200), None)
+                if failed is not None:
+                    yield {**record, "status": "error", "error": str(lines[failed].get("error") or responses[failed])}
+                    continue
+                extractor = self.pipeline.get_extractor(classification["type"])
+                try:
+                    metadata = extractor.merge([extractor.parse_content(r["body"]["choices"][0]["message"]["content"])
+                                                for r in responses])
+                except ValueError as e:
+                    yield {**record, "status": "error", "error": str(e)}
+                    continue
+                yield {**record, "status": "success", "id": str(uuid4()),
+                       "classification": classification, "metadata": metadata.model_dump()}
+
+        results_path = self.work_dir / "results.jsonl"
+        _write_jsonl(results_path, results())
+        return results_path
+
+    def advance(self, documents: Optional[Iterable[Tuple[str, Path]]] = None) -> str:
+        """Move the run as far forward as possible without waiting; returns the current phase."""
+        state = self.load_state()
+
+        if state["phase"] == "new":
+            requests_path = self.render_classification(documents or [])
+            state = {"phase": "classification", "batch_id": self.client.submit(requests_path)}
+            self.save_state(state)
+
+        if state["phase"] == "classification":
+            output_path = self.work_dir / "classification_output.jsonl"
+            if not self.client.download(state["batch_id"], output_path):
+                return state["phase"]
+            classifications = self.ingest_classification(output_path)
+            requests_path = self.render_extraction(classifications)
+            state = {"phase": "extraction", "batch_id": self.client.submit(requests_path),
+                     "usage": {"input_tokens": self.input_tokens, "output_tokens": self.output_tokens}}
+            self.save_state(state)
+
+        if state["phase"] == "extraction":
+            output_path = self.work_dir / "extraction_output.jsonl"
+            if not self.client.download(state["batch_id"], output_path):
+                return state["phase"]
+            classifications = json.loads((self.work_dir / "classifications.json").read_text(encoding="utf-8"))
+            self.input_tokens = state["usage"]["input_tokens"]
+            self.output_tokens = state["usage"]["output_tokens"]
+            self.ingest_extraction(output_path, classifications)
+            state = {"phase": "done", "usage": {"input_tokens": self.input_tokens, "output_tokens": self.output_tokens}}
+            self.save_state(state)
+
+        return state["phase"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", default="documents-extra", help="Folder to scan recursively for PDFs (first call only)")
+    parser.add_argument("--work-dir", required=True, help="Directory holding the state of this batch run")
+    parser.add_argument("--max-pages-classification", type=int, default=3)
+    parser.add_argument("--max-pages-extraction", type=int, default=None)
+    parser.add_argument("--extraction-chunk-tokens", type=int, default=None,
+                        help="Extract from the whole document in chunks of this many tokens (one request each) and merge")
+    parser.add_argument("--wait", action="store_true", help="Poll until the run is done")
+    parser.add_argument("--poll-seconds", type=float, default=60)
+    args = parser.parse_args()
+
+    pipeline = DocumentPipelineManager(
+        max_pages_classification=args.max_pages_classification,
+        max_pages_extraction=args.max_pages_extraction,
+        extraction_chunk_tokens=args.extraction_chunk_tokens,
+    )
+    batch = BatchPipeline(pipeline, args.work_dir)
+    phase = batch.advance(iter_documents(Path(args.input)))
+    while args.wait and phase != "done":
+        print(f"Waiting for {phase} batch...")
+        time.sleep(args.poll_seconds)
+        phase = batch.advance()
+    print(f"Phase: {phase}")
+    if phase == "done":
+        usage = batch.load_state()["usage"]
+        print(f"Results written to {Path(args.work_dir) / 'results.jsonl'}; usage: {usage}")
+
+
+if __name__ == "__main__":
+    main()
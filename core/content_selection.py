@@ -0,0 +1,200 @@
+"""
+Token-budgeted content selection for LLM prompts.
+
+Instead of cutting document text at a fixed number of characters (or sending all of it),
+`select_content` fits the text into an explicit token budget:
+
+1. Boilerplate removal: lines repeated on many pages (headers, footers, "Page 3 of 40",
+   confidentiality notices) are dropped.
+2. Segmentation: each page is split into segments of consecutive lines (~`segment_tokens`).
+3. Selection: segments are ranked by value (the opening of the document, then density of
+   type-specific keywords, dates and amounts) and greedily packed into the budget.
+4. The chosen segments are emitted in their original document order.
+
+`chunk_content` is the map-reduce counterpart: it keeps all of the (boilerplate-free) text
+and splits it into consecutive chunks of at most ~`max_tokens` tokens each.
+"""
+import re
+import warnings
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence
+
+# Terms that signal the fields each metadata extractor is looking for
+TYPE_KEYWORDS = {
+    "Invoice": ["invoice", "total", "amount due", "balance due", "due date", "payment", "subtotal", "vat",
+                "tax", "qty", "quantity", "unit price", "bill to", "vendor"],
+    "Contract": ["agreement", "party", "parties", "effective date", "term", "terminate", "termination",
+                 "expire", "renewal", "payment", "fee", "exclusive", "obligation", "governing law",
+                 "hereby", "shall", "warrant", "indemnif", "confidential", "in witness whereof"],
+    "Earnings": ["revenue", "quarter", "fiscal", "year", "net income", "operating income", "eps",
+                 "earnings per share", "margin", "guidance", "growth", "cash flow", "highlights", "results"],
+    "Other": [],
+}
+
+DATE_PATTERN = re.compile(
+    r"\b(\d{4}-\d{2}-\d{2}|\d{1,2}[/.]\d{1,2}[/.]\d{2,4}|"
+    r"(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.? \d{1,2},? \d{4}|"
+    r"\d{1,2} (jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]* \d{4})\b"
+)
+AMOUNT_PATTERN = re.compile(r"([$€£]\s?\d[\d,.]*|\d[\d,.]*\s?(usd|eur|gbp|€|\$))")
+DIGITS_PATTERN = re.compile(r"\d+")
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str):
+    """
+    Return the tiktoken encoding for `model`, cached per process. Returns None when the
+    encoding files cannot be loaded (e.g. an offline host without a tiktoken cache); token
+    counts then fall back to a ~4 characters per token estimate.
+    """
+    # Imported on first use: loading tiktoken is part of the startup cost the API defers
+    import tiktoken
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        warnings.warn(f"tiktoken encoding for {model} unavailable ({e}); estimating 4 characters per token.")
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    encoding = get_encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = "gpt-4o-mini") -> str:
+    encoding = get_encoding(model)
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+
+def _line_signature(line: str) -> str:
+    # "Page 3 of 40" and "Page 4 of 40" count as the same line
+    return DIGITS_PATTERN.sub("#", line.strip().lower())
+
+
+def remove_boilerplate(pages: Sequence[Dict[str, Any]], min_fraction: float = 0.5) -> List[str]:
+    """
+    Return the text of each page without lines that repeat on at least `min_fraction`
+    of the pages (only applied to documents with 3 or more pages).
+    """
+    page_lines = [[line for line in p["text"].splitlines() if line.strip()] for p in pages]
+    if len(page_lines) < 3:
+        return ["\n".join(lines) for lines in page_lines]
+
+    counts = Counter(sig for lines in page_lines for sig in {_line_signature(line) for line in lines})
+    threshold = max(2, min_fraction * len(page_lines))
+    repeated = {sig for sig, n in counts.items() if n >= threshold}
+    return ["\n".join(line for line in lines if _line_signature(line) not in repeated) for lines in page_lines]
+
+
+def _segments(page_texts: List[str], segment_tokens: int, model: str) -> List[Dict[str, Any]]:
+    segments = []
+    for page_index, text in enumerate(page_texts):
+        current, current_tokens = [], 0
+        for line in text.splitlines():
+            line_tokens = count_tokens(line, model) + 1
+            if current and current_tokens + line_tokens > segment_tokens:
+                segments.append({"page": page_index, "text": "\n".join(current), "tokens": current_tokens})
+                current, current_tokens = [], 0
+            current.append(line)
+            current_tokens += line_tokens
+        if current:
+            segments.append({"page": page_index, "text": "\n".join(current), "tokens": current_tokens})
+    return segments
+
+
+def _score(segment: Dict[str, Any], position: int, keywords: List[str]) -> float:
+    text = segment["text"].lower()
+    hits = sum(text.count(k) for k in keywords)
+    hits += len(DATE_PATTERN.findall(text)) + len(AMOUNT_PATTERN.findall(text))
+    density = hits / max(segment["tokens"], 1) ** 0.5
+    # The opening of a document names the vendor / parties / period: always most valuable
+    opening_bonus = 100.0 if position < 2 else 0.0
+    return opening_bonus + density
+
+
+def select_content(pages: Sequence[Dict[str, Any]], max_tokens: Optional[int], doc_type: Optional[str] = None,
+                   model: str = "gpt-4o-mini", segment_tokens: int = 200,
+                   keywords: Optional[List[str]] = None) -> str:
+    """
+    Select the most valuable text from `pages` that fits in `max_tokens` tokens.
+
+    Args:
+        pages: Page dicts with a "text" field.
+        max_tokens: Token budget for the returned text (None keeps everything after boilerplate removal).
+        doc_type: Document type whose `TYPE_KEYWORDS` guide the ranking. Without it the
+                  document is simply kept from the start until the budget is used.
+        model: Model whose tokenizer is used to count tokens.
+        segment_tokens: Approximate size of the segments that are ranked and selected.
+        keywords: Ranking keywords to use instead of those of `doc_type` (e.g. when the type
+                  is not known yet).
+
+    Returns:
+        str: Selected segments joined in document order, pages separated by blank lines.
+    """
+    page_texts = remove_boilerplate(pages)
+    if max_tokens is None:
+        return "\n\n".join(t for t in page_texts if t)
+
+    segments = _segments(page_texts, segment_tokens, model)
+    if keywords is None:
+        keywords = TYPE_KEYWORDS.get(doc_type)
+    if keywords is None:
+        ranked = list(range(len(segments)))
+    else:
+        ranked = sorted(range(len(segments)), key=lambda i: _score(segments[i], i, keywords), reverse=True)
+
+    chosen, used = {}, 0
+    for i in ranked:
+        segment = segments[i]
+        if used + segment["tokens"] <= max_tokens:
+            chosen[i] = segment["text"]
+            used += segment["tokens"]
+        elif keywords is None or not chosen:
+            # Fill the rest of the budget with the start of this segment, then stop
+            remaining = max_tokens - used
+            if remaining > 0:
+                chosen[i] = truncate_to_tokens(segment["text"], remaining, model)
+            break
+
+    parts, last_page = [], None
+    for i in sorted(chosen):
+        separator = "\n" if segments[i]["page"] == last_page else "\n\n"
+        parts.append((separator if parts else "") + chosen[i])
+        last_page = segments[i]["page"]
+    return "".join(parts)
+
+
+def chunk_content(pages: Sequence[Dict[str, Any]], max_tokens: int, model: str = "gpt-4o-mini") -> List[str]:
+    """
+    Split the boilerplate-free text of `pages` into consecutive chunks of about `max_tokens`
+    tokens. Chunks end at line boundaries and may span pages; a single line longer than the
+    budget becomes a chunk of its own.
+
+    Returns:
+        List[str]: The chunks in document order (a single chunk if the document fits).
+    """
+    chunks, current, current_tokens = [], [], 0
+    for text in remove_boilerplate(pages):
+        if not text:
+            continue
+        lines = text.splitlines()
+        for line_number, line in enumerate(lines):
+            line_tokens = count_tokens(line, model) + 1
+            if current and current_tokens + line_tokens > max_tokens:
+                chunks.append("".join(current).strip("\n"))
+                current, current_tokens = [], 0
+            # Pages are separated by a blank line, as in the single-prompt content
+            current.append(("\n\n" if line_number == 0 else "\n") + line)
+            current_tokens += line_tokens
+    if current:
+        chunks.append("".join(current).strip("\n"))
+    return chunks or [""]
@@ -1,21 +1,42 @@
 from langchain_core.runnables import Runnable
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import numpy as np
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional, Sequence, Tuple
 from langchain.prompts import PromptTemplate
-import tiktoken
 from openai.types.chat import ChatCompletion
+import hashlib
+from core.content_selection import TYPE_KEYWORDS, select_content, count_tokens
+from core.metrics import add_usage
+from core.llm_transport import LLMTransport
 
 
 class RunnableGPTLogprobClassifier(Runnable):
-    def __init__(self, label_descs: dict, model="gpt-4o-mini", max_prompt_chars=5500, max_pages=10):
+    def __init__(self, label_descs: dict, model="gpt-4o-mini", max_prompt_chars=5500, max_pages=10,
+                 max_prompt_tokens=None, transport: Optional[LLMTransport] = None,
+                 windows: Optional[Sequence[Tuple[Optional[int], Optional[int]]]] = None,
+                 min_margin: float = 0.5):
         self.model = model
         self.labels_descriptions = label_descs
         self.labels = list(label_descs.keys())
         self.max_prompt_chars = max_prompt_chars
+        # Token budget for the document text; replaces the character cut when set
+        self.max_prompt_tokens = max_prompt_tokens
         self.max_pages = max_pages
-        self.client = OpenAI()
+        # Incremental mode: (max pages, max prompt tokens) windows read in turn, moving on to
+        # the next one only while the two most likely labels are less than `min_margin` apart
+        self.incremental = bool(windows)
+        self.windows = list(windows) if windows else [(max_pages, max_prompt_tokens)]
+        self.min_margin = min_margin
+        # Windows after the first rank segments by the keywords of every type, so that a late
+        # signal (e.g. the results pages of an investor deck) makes it into the budget
+        self.keywords = sorted({k for label in self.labels for k in TYPE_KEYWORDS.get(label, [])})
+        # Shared pool, concurrency cap, rate limiter and retries of the pipeline's LLM calls
+        self.client = transport.client if transport is not None else OpenAI()
+        self.async_client = transport.async_client if transport is not None else AsyncOpenAI()
+        # The SDK imports its chat resources on first access: do it now rather than in the first call
+        self.async_client.chat.completions
         self.prompt_template = self.build_classification_prompt_template()
+        self.prompt_version = hashlib.sha256(self.prompt_template.template.encode("utf-8")).hexdigest()[:12]
         self.input_tokens = 0  # Initialize input tokens count
         self.output_tokens = 0  # Initialize output tokens count
 
@@ -54,20 +75,31 @@ class RunnableGPTLogprobClassifier(Runnable):
         probs = exp_logits / exp_logits.sum()
         return dict(zip(label_logprobs.keys(), map(float, probs)))
 
-    def invoke(self, input: List[Dict[str, Any]]) -> Dict[str, Any]:
-        # input: list of page dicts (with "text" field)
-        if self.max_pages is not None:
-            input = input[:self.max_pages]
-        sample_text = "\n\n".join(p["text"] for p in input)
+    def build_content(self, pages: List[Dict[str, Any]], step: int = -1) -> str:
+        """Return the document text that is sent to the model for the given pages (in window `step`, default the last)."""
+        step %= len(self.windows)
+        max_pages, max_prompt_tokens = self.windows[step]
+        if max_pages is not None:
+            pages = pages[:max_pages]
+        if max_prompt_tokens is not None:
+            # Boilerplate-free opening of the document, cut at the token budget
+            return select_content(pages, max_prompt_tokens, model=self.model,
+                                  keywords=self.keywords if step > 0 else None)
+        sample_text = "\n\n".join(p["text"] for p in pages)
         # Truncate to max characters
         if self.max_prompt_chars is not None:
             sample_text = sample_text[:self.max_prompt_chars]
+        return sample_text
 
+    def build_request(self, pages: List[Dict[str, Any]], step: int = -1, content: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Return the chat completion arguments for classifying the given pages (in window `step`).
+        `content` is the window's text when already built (see `window_contents`).
+        """
         prompt = self.prompt_template.format(
-            content=sample_text
+            content=self.build_content(pages, step) if content is None else content
         )
-
-        response: ChatCompletion = self.client.chat.completions.create(
+        return dict(
             model=self.model,
             messages=[{"role": "user", "content": prompt}],
             max_tokens=1,
@@ -75,16 +107,50 @@ class RunnableGPTLogprobClassifier(Runnable):
             temperature=0,
             top_logprobs=10
         )
-        try:
-            logprobs_data = response.choices[0].logprobs.content[0].top_logprobs
-        except (AttributeError, IndexError):
-            raise ValueError("Unexpected response format from OpenAI API. Ensure the model supports logprobs.\n Response: " + str(response))
+
+    def estimate_tokens(self, pages: List[Dict[str, Any]], step: int = -1) -> int:
+        """Tokens one call will use at most: the prompt plus the maximum completion length."""
+        request = self.build_request(pages, step)
+        return count_tokens(request["messages"][0]["content"], self.model) + request["max_tokens"]
+
+    def window_contents(self, pages: List[Dict[str, Any]]) -> Iterator[Tuple[int, str]]:
+        """
+        Windows to read in turn with their text, as (step, content), skipping those that would
+        send the same text as the previous one (short documents). Each window's text is built once.
+        """
+        previous = None
+        for step in range(len(self.windows)):
+            content = self.build_content(pages, step)
+            if content != previous:
+                yield step, content
+            previous = content
+
+    def is_final(self, output: Dict[str, Any]) -> bool:
+        """Whether a window's answer is clear enough to stop reading."""
+        return not self.incremental or output.get("margin", 1.0) >= self.min_margin
+
+    @staticmethod
+    def result(output: Dict[str, Any]) -> Dict[str, Any]:
+        """The public {"type", "confidence"} of a window's answer, without the internal "margin"."""
+        return {"type": output["type"], "confidence": output["confidence"]}
+
+    def parse_response(self, response: ChatCompletion, usage: Optional[dict] = None) -> Dict[str, Any]:
+        """
+        Turn a chat completion into {"type", "confidence"} (plus the "margin" between the two
+        most likely labels in incremental mode). The call's tokens are added to the running
+        totals and, when given, to `usage` (before parsing, so failed calls count too).
+        """
         try:
             self.input_tokens += response.usage.prompt_tokens
             self.output_tokens += response.usage.completion_tokens
+            add_usage(usage, response.usage.prompt_tokens, response.usage.completion_tokens)
         except AttributeError:
             print("Warning: Usage information not available in the response. Make sure your OpenAI client is configured correctly.")
             pass
+        try:
+            logprobs_data = response.choices[0].logprobs.content[0].top_logprobs
+        except (AttributeError, IndexError):
+            raise ValueError("Unexpected response format from OpenAI API. Ensure the model supports logprobs.\n Response: " + str(response))
 
         label_logprobs = {}
         for entry in logprobs_data:
@@ -98,8 +164,36 @@ class RunnableGPTLogprobClassifier(Runnable):
         probs = self._softmax_from_logprobs(label_logprobs)
         top_label = max(probs, key=probs.get)
 
-        return {
+        output = {
             "type": top_label,
             "confidence": probs[top_label],
             # "probs": probs ## Uncomment if you want to return all probabilities
         }
+        if self.incremental:
+            runner_up = sorted(probs.values(), reverse=True)[1:2]
+            output["margin"] = probs[top_label] - (runner_up[0] if runner_up else 0.0)
+        return output
+
+    def invoke(self, input: List[Dict[str, Any]], config=None, usage: Optional[dict] = None,
+               step: Optional[int] = None, content: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        # input: list of page dicts (with "text" field)
+        if step is None:
+            # Widen the window until the answer is clear (a single call outside incremental mode)
+            for step, content in self.window_contents(input):
+                output = self.invoke(input, usage=usage, step=step, content=content)
+                if self.is_final(output):
+                    break
+            return self.result(output)
+        response: ChatCompletion = self.client.chat.completions.create(**self.build_request(input, step, content))
+        return self.parse_response(response, usage)
+
+    async def ainvoke(self, input: List[Dict[str, Any]], config=None, usage: Optional[dict] = None,
+                      step: Optional[int] = None, content: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        if step is None:
+            for step, content in self.window_contents(input):
+                output = await self.ainvoke(input, usage=usage, step=step, content=content)
+                if self.is_final(output):
+                    break
+            return self.result(output)
+        response: ChatCompletion = await self.async_client.chat.completions.create(**self.build_request(input, step, content))
+        return self.parse_response(response, usage)
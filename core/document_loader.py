@@ -0,0 +1,254 @@
+import importlib
+import io
+from collections.abc import Sequence
+from concurrent.futures import Executor
+from typing import Dict, List, Optional, Tuple, Union
+
+# A PDF is opened from its path or, for uploads kept in memory, from its bytes
+PDFSource = Union[str, bytes]
+
+
+def _word(text: str, x0: float, x1: float, top: float, bottom: float) -> dict:
+    return {"text": text, "x0": round(x0, 1), "x1": round(x1, 1), "top": round(top, 1), "bottom": round(bottom, 1)}
+
+
+class PdfPlumberDocument:
+    """pdfplumber backend: slower, but the reference text layout used by the prompts."""
+    library = "pdfplumber"
+
+    def __init__(self, source: PDFSource):
+        import pdfplumber
+        self._pdf = pdfplumber.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+
+    def __len__(self) -> int:
+        return len(self._pdf.pages)
+
+    def extract_text(self, index: int) -> str:
+        page = self._pdf.pages[index]
+        text = page.extract_text() or ""
+        # Release pdfplumber's per-page object caches
+        page.close()
+        return text
+
+    def extract_layout(self, index: int) -> Tuple[str, List[dict]]:
+        """Page text and word boxes ({"text", "x0", "x1", "top", "bottom"} in points), parsed once."""
+        page = self._pdf.pages[index]
+        text = page.extract_text() or ""
+        words = [_word(w["text"], w["x0"], w["x1"], w["top"], w["bottom"]) for w in page.extract_words()]
+        page.close()
+        return text, words
+
+    def close(self):
+        self._pdf.close()
+
+
+class PyMuPDFDocument:
+    """PyMuPDF backend: much faster on large, object-heavy documents such as investor decks."""
+    library = "pymupdf"
+
+    def __init__(self, source: PDFSource):
+        import pymupdf
+        self._doc = pymupdf.open(stream=source, filetype="pdf") if isinstance(source, bytes) else pymupdf.open(source)
+
+    def __len__(self) -> int:
+        return self._doc.page_count
+
+    def extract_text(self, index: int) -> str:
+        return self._doc.load_page(index).get_text() or ""
+
+    def extract_layout(self, index: int) -> Tuple[str, List[dict]]:
+        page = self._doc.load_page(index)
+        words = [_word(w[4], w[0], w[2], w[1], w[3]) for w in page.get_text("words")]
+        return page.get_text() or "", words
+
+    def close(self):
+        self._doc.close()
+
+
+PDF_BACKENDS = {
+    "pdfplumber": PdfPlumberDocument,
+    "pymupdf": PyMuPDFDocument,
+}
+
+
+def _backend_cls(backend: str):
+    backend_cls = PDF_BACKENDS.get(backend)
+    if backend_cls is None:
+        raise ValueError(f"Unsupported PDF backend: {backend}. Choose one of {list(PDF_BACKENDS)}")
+    return backend_cls
+
+
+def open_pdf(source: PDFSource, backend: str = "pdfplumber"):
+    return _backend_cls(backend)(source)
+
+
+def import_backend(backend: str = "pdfplumber") -> str:
+    """
+    Import the PDF library of a backend, which is otherwise imported when the first document
+    is opened (e.g. to warm up a loader worker process). Returns the library name.
+    """
+    library = _backend_cls(backend).library
+    importlib.import_module(library)
+    return library
+
+
+def count_pages(source: PDFSource, backend: str = "pdfplumber") -> int:
+    doc = open_pdf(source, backend)
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+
+def extract_pages(source: PDFSource, max_pages: Optional[int] = None, backend: str = "pdfplumber",
+                  start: int = 0, layout_pages: int = 0) -> List[dict]:
+    """
+    Extract the text of pages [start, max_pages) of a PDF (up to the last page if max_pages is None).
+
+    Kept as a module-level function so it can be shipped to a process pool (bytes sources are
+    pickled to the worker with the task).
+
+    Returns:
+        List[dict]: One {"page": <1-based number>, "text": <page text>} dict per page. The first
+        `layout_pages` pages also get their word boxes under "words" (see `extract_layout`).
+    """
+    doc = open_pdf(source, backend)
+    try:
+        stop = len(doc) if max_pages is None else min(max_pages, len(doc))
+        pages = []
+        for i in range(start, stop):
+            if i < layout_pages:
+                text, words = doc.extract_layout(i)
+                pages.append({"page": i + 1, "text": text, "words": words})
+            else:
+                pages.append({"page": i + 1, "text": doc.extract_text(i)})
+        return pages
+    finally:
+        doc.close()
+
+
+def page_ranges(page_count: int, pages_per_task: int) -> List[range]:
+    return [range(start, min(start + pages_per_task, page_count))
+            for start in range(0, page_count, pages_per_task)]
+
+
+def extract_pages_parallel(source: PDFSource, executor: Executor, max_pages: Optional[int] = None,
+                           backend: str = "pdfplumber", pages_per_task: int = 16) -> List[dict]:
+    """
+    Extract pages by splitting the document into page ranges that are parsed concurrently
+    on `executor` (typically a ProcessPoolExecutor). Output matches `extract_pages`.
+    """
+    page_count = count_pages(source, backend)
+    if max_pages is not None:
+        page_count = min(page_count, max_pages)
+    futures = [executor.submit(extract_pages, source, r.stop, backend, r.start)
+               for r in page_ranges(page_count, pages_per_task)]
+    return [page for future in futures for page in future.result()]
+
+
+class LazyPDFPages(Sequence):
+    """
+    Read-only sequence of {"page", "text"} dicts that extracts page text on first access.
+
+    Each page is extracted at most once and memoized; pdfplumber's per-page object caches
+    are released right after extraction, so memory and latency scale with the pages that
+    are actually read (e.g. `pages[:3]` for classification) rather than with document length.
+
+    Args:
+        source (str | bytes): Path to the PDF file, or its content.
+        page_count (int, optional): Number of pages, if already known (avoids opening the PDF).
+        known_pages (dict, optional): Already extracted texts keyed by 0-based page index.
+        file_hash (str, optional): Content hash of the file, used by the result cache.
+        backend (str): Text extraction backend, one of `PDF_BACKENDS`.
+    """
+
+    def __init__(self, source: PDFSource, page_count: Optional[int] = None,
+                 known_pages: Optional[Dict[int, str]] = None, file_hash: Optional[str] = None,
+                 backend: str = "pdfplumber"):
+        self.source = source
+        self.file_hash = file_hash
+        self.backend = backend
+        self._pdf = None
+        self._page_count = page_count
+        self._texts: Dict[int, str] = dict(known_pages or {})
+        self._words: Dict[int, List[dict]] = {}
+        self._dirty = False
+
+    def _open(self):
+        if self._pdf is None:
+            self._pdf = open_pdf(self.source, self.backend)
+            self._page_count = len(self._pdf)
+        return self._pdf
+
+    def __len__(self) -> int:
+        if self._page_count is None:
+            self._open()
+        return self._page_count
+
+    def _text(self, index: int) -> str:
+        text = self._texts.get(index)
+        if text is None:
+            text = self._open().extract_text(index)
+            self._texts[index] = text
+            self._dirty = True
+            if len(self._texts) == self._page_count:
+                self.close()
+        return text
+
+    def words(self, index: int) -> List[dict]:
+        """Word boxes of a page (see `extract_layout`), parsed on first access."""
+        words = self._words.get(index)
+        if words is None:
+            text, words = self._open().extract_layout(index)
+            self._texts.setdefault(index, text)
+            self._words[index] = words
+        return words
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        n = len(self)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError("page index out of range")
+        return {"page": index + 1, "text": self._text(index)}
+
+    def prefetch(self, executor: Executor, pages_per_task: int = 16):
+        """Extract every page not parsed yet, in parallel page ranges on `executor`."""
+        missing = [i for i in range(len(self)) if i not in self._texts]
+        if not missing:
+            return
+        futures = [executor.submit(extract_pages, self.source, r.stop, self.backend, r.start)
+                   for r in page_ranges(len(self), pages_per_task)
+                   if any(i not in self._texts for i in r)]
+        for future in futures:
+            for page in future.result():
+                self._texts.setdefault(page["page"] - 1, page["text"])
+        self._dirty = True
+        self.close()
+
+    def extracted_pages(self) -> Dict[int, str]:
+        """Texts extracted so far, keyed by 0-based page index."""
+        return dict(self._texts)
+
+    def unsaved_pages(self) -> Optional[Dict[int, str]]:
+        """
+        Return all extracted texts if any page was extracted since the last call, else None.
+        Used to write newly parsed pages back to the result cache only when needed.
+        """
+        if not self._dirty:
+            return None
+        self._dirty = False
+        return self.extracted_pages()
+
+    def close(self):
+        if self._pdf is not None:
+            self._pdf.close()
+            self._pdf = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
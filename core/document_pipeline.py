@@ -1,82 +1,834 @@
-from core.document_classification import RunnableGPTLogprobClassifier
-from core.metadata_extraction import RunnableMetadataExtractor
-from typing import List
-from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_exception_type
-import pdfplumber
+from __future__ import annotations
+from core.document_loader import extract_pages, count_pages, page_ranges, import_backend, LazyPDFPages, PDFSource
+from core.content_selection import get_encoding
+from core.metadata_schemas import METADATA_MODELS
+from core.result_cache import ResultCache
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+from concurrent.futures import ProcessPoolExecutor, wait
+from tenacity import retry, stop_after_attempt, wait_exponential_jitter, retry_if_exception_type
+from core.metrics import (timed, count_retry, token_cost, CACHE_LOOKUPS, LLM_CALLS, LLM_TOKENS, LLM_COST,
+                          DOCUMENT_TOKENS, DOCUMENT_COST, RETRIES, STAGE_SECONDS, NEAR_DUPLICATE_LOOKUPS,
+                          NEAR_DUPLICATE_REUSES, NEAR_DUPLICATE_TOKENS_SAVED, TEMPLATE_EXTRACTIONS,
+                          TEMPLATE_UPDATES, CLASSIFICATION_EXITS)
+import asyncio
+import hashlib
+import math
+import threading
+import time
+from pydantic import BaseModel
+
+# The LLM stages import langchain and the OpenAI SDK, which takes seconds: they are only
+# imported when the pipeline first needs them (see `DocumentPipelineManager.warm_up`)
+if TYPE_CHECKING:
+    import numpy as np
+    from core.document_classification import RunnableGPTLogprobClassifier
+    from core.metadata_extraction import RunnableMetadataExtractor
+    from core.fused_analysis import RunnableFusedAnalyzer
+    from core.local_classifier import LocalNgramClassifier
+    from core.near_duplicates import NearDuplicate, NearDuplicateIndex
+    from core.invoice_templates import InvoiceTemplateStore
+    from core.llm_transport import LLMTransport
+
+LABEL_DESCRIPTIONS = {
+    "Invoice": "A bill for goods or services, typically including vendor, amount, due date, and line items.",
+    "Contract": "A legal agreement between parties, containing terms, dates, and responsibilities.",
+    "Earnings": "A financial or business report summarizing revenue, profits, expenses, and other key metrics.",
+    "Other": "Any other type of document that does not fit the above categories."
+}
+# Incremental classification windows, (max pages, max prompt tokens): most documents are
+# clear from their first page, the others get a wider and keyword-ranked look
+DEFAULT_CLASSIFICATION_WINDOWS = ((1, 400), (3, 1200), (10, 4000))
+
+
+def parse_classification_windows(spec: str) -> List[Tuple[int, int]]:
+    """Parse windows written as "pages:tokens,..." (e.g. "1:400,3:1200,10:4000")."""
+    windows = []
+    for part in spec.split(","):
+        pages, _, tokens = part.strip().partition(":")
+        windows.append((int(pages), int(tokens)))
+    return windows
+
+
+# Answers that fail to parse (ValueError) are asked again, up to 3 attempts with jittered
+# exponential backoff (0.5 s, 1 s, ... capped at 8 s); transport errors are retried by LLMTransport
+retry_unparsable = retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential_jitter(multiplier=0.5, max=8),
+    retry=retry_if_exception_type(ValueError),
+    before_sleep=count_retry,
+)
+
 
 class DocumentPipelineManager:
     def __init__(self, model_name: str = "gpt-4o-mini",
-                 max_pages_classification: int = 10, max_pages_extraction: int = None):
-        self.label_descriptions = {
-            "Invoice": "A bill for goods or services, typically including vendor, amount, due date, and line items.",
-            "Contract": "A legal agreement between parties, containing terms, dates, and responsibilities.",
-            "Earnings": "A financial or business report summarizing revenue, profits, expenses, and other key metrics.",
-            "Other": "Any other type of document that does not fit the above categories."
-        }
-        self.classifier = RunnableGPTLogprobClassifier(
-            label_descs=self.label_descriptions,
-            model=model_name,
-            max_pages=max_pages_classification,
-        )
-        self.extractors = {
-            doc_type: RunnableMetadataExtractor(doc_type=doc_type,
-                                                model=model_name,
-                                                max_pages=max_pages_extraction)
-            for doc_type in self.label_descriptions.keys()
-        }
+                 max_pages_classification: int = 10, max_pages_extraction: int = None,
+                 max_tokens_classification: Optional[int] = 1200, max_tokens_extraction: Optional[int] = 4000,
+                 cache: Optional[ResultCache] = None, loader_workers: int = 2,
+                 pdf_backend: str = "pdfplumber", parallel_min_pages: Optional[int] = None,
+                 pages_per_task: int = 16, transport: Optional[LLMTransport] = None,
+                 local_classifier: Optional[LocalNgramClassifier] = None,
+                 local_confidence_threshold: float = 0.8, fused: bool = False,
+                 extraction_chunk_tokens: Optional[int] = None,
+                 near_duplicates: Optional[NearDuplicateIndex] = None,
+                 near_duplicate_min_confidence: float = 0.9,
+                 invoice_templates: Optional[InvoiceTemplateStore] = None,
+                 classification_windows: Optional[Sequence[Tuple[int, int]]] = None,
+                 classification_min_margin: float = 0.5,
+                 structured_extraction: bool = True):
+        self.model_name = model_name
+        self.cache = cache
+        # Cheap local model answering first; GPT is only called below the threshold
+        self.local_classifier = local_classifier
+        self.local_confidence_threshold = local_confidence_threshold
+        self.local_hits = 0
+        self.local_misses = 0
+        # Templated documents: reuse the classification of a near-duplicate seen before (when
+        # it was at least this confident) and show its metadata to the extraction prompt
+        self.near_duplicates = near_duplicates
+        self.near_duplicate_min_confidence = near_duplicate_min_confidence
+        # Recurring invoice layouts: extracted from word positions without an LLM call once
+        # learned, and learned from the LLM extractions of invoices they could not handle
+        self.invoice_templates = invoice_templates
+        # Connection pool, concurrency cap, rate limiter and retries shared by every LLM call
+        # (sync and async); a default one is created with the first LLM component
+        self._transport = transport
+        self.loader_workers = loader_workers
+        # PDF text extraction engine, see core.document_loader.PDF_BACKENDS
+        self.pdf_backend = pdf_backend
+        # Documents with at least this many pages are parsed in parallel page ranges
+        # of `pages_per_task` pages across the loader process pool (None disables it)
+        self.parallel_min_pages = parallel_min_pages
+        self.pages_per_task = pages_per_task
+        self._loader_pool: Optional[ProcessPoolExecutor] = None
+        self.label_descriptions = dict(LABEL_DESCRIPTIONS)
+        # The classifier, extractors and fused analyzer are built on first use (one extractor
+        # per document type actually seen), so constructing a pipeline imports no LLM library
+        self.max_pages_classification = max_pages_classification
+        self.max_pages_extraction = max_pages_extraction
+        self.max_tokens_classification = max_tokens_classification
+        # Incremental classification: start from the first window and widen it only while
+        # the label margin is below `classification_min_margin`. The last window is the cap
+        # and replaces max_pages_classification / max_tokens_classification.
+        self.classification_windows = list(classification_windows) if classification_windows else None
+        self.classification_min_margin = classification_min_margin
+        if self.classification_windows:
+            self.max_pages_classification, self.max_tokens_classification = self.classification_windows[-1]
+        self.max_tokens_extraction = max_tokens_extraction
+        # Map-reduce extraction over the whole document
+        self.extraction_chunk_tokens = extraction_chunk_tokens
+        # Extraction answers constrained to the metadata JSON schema by the API (structured outputs)
+        self.structured_extraction = structured_extraction
+        # Fused mode: `analyze` classifies and extracts metadata in a single LLM call
+        self.fused = fused
+        self._classifier: Optional[RunnableGPTLogprobClassifier] = None
+        self._fused_analyzer: Optional[RunnableFusedAnalyzer] = None
+        self.extractors: Dict[str, RunnableMetadataExtractor] = {}
+        self._build_lock = threading.Lock()
+        self._transport_lock = threading.Lock()
         self.total_input_tokens = 0
         self.total_output_tokens = 0
 
-    def load_document(self, path: str) -> List[dict]:
-        pages = []
-        with pdfplumber.open(path) as pdf:
-            for i, page in enumerate(pdf.pages):
-                text = page.extract_text() or ""
-                pages.append({
-                    "page": i + 1,
-                    "text": text,
-                })
+    @property
+    def transport(self) -> LLMTransport:
+        if self._transport is None:
+            with self._transport_lock:
+                if self._transport is None:
+                    from core.llm_transport import LLMTransport
+                    self._transport = LLMTransport()
+        return self._transport
+
+    @property
+    def classifier(self) -> RunnableGPTLogprobClassifier:
+        if self._classifier is None:
+            with self._build_lock:
+                if self._classifier is None:
+                    from core.document_classification import RunnableGPTLogprobClassifier
+                    self._classifier = RunnableGPTLogprobClassifier(
+                        label_descs=self.label_descriptions,
+                        model=self.model_name,
+                        max_pages=self.max_pages_classification,
+                        max_prompt_tokens=self.max_tokens_classification,
+                        transport=self.transport,
+                        windows=self.classification_windows,
+                        min_margin=self.classification_min_margin,
+                    )
+        return self._classifier
+
+    @property
+    def fused_analyzer(self) -> Optional[RunnableFusedAnalyzer]:
+        """The single-call analyzer in fused mode, else None."""
+        if self.fused and self._fused_analyzer is None:
+            with self._build_lock:
+                if self._fused_analyzer is None:
+                    from core.fused_analysis import RunnableFusedAnalyzer
+                    self._fused_analyzer = RunnableFusedAnalyzer(
+                        label_descs=self.label_descriptions,
+                        model=self.model_name,
+                        max_pages=self.max_pages_extraction,
+                        max_prompt_tokens=self.max_tokens_extraction,
+                        transport=self.transport,
+                    )
+        return self._fused_analyzer
+
+    def get_extractor(self, doc_type: str) -> RunnableMetadataExtractor:
+        """The metadata extractor of a document type, built the first time the type is seen."""
+        extractor = self.extractors.get(doc_type)
+        if extractor is not None:
+            return extractor
+        if doc_type not in self.label_descriptions:
+            raise ValueError(f"Unsupported document type: {doc_type}")
+        with self._build_lock:
+            if doc_type not in self.extractors:
+                from core.metadata_extraction import RunnableMetadataExtractor
+                self.extractors[doc_type] = RunnableMetadataExtractor(doc_type=doc_type,
+                                                                      model=self.model_name,
+                                                                      max_pages=self.max_pages_extraction,
+                                                                      max_prompt_tokens=self.max_tokens_extraction,
+                                                                      chunk_tokens=self.extraction_chunk_tokens,
+                                                                      transport=self.transport,
+                                                                      structured_output=self.structured_extraction)
+            return self.extractors[doc_type]
+
+    def warm_up(self, doc_types: Optional[Sequence[str]] = None):
+        """
+        Do up front what the first documents would otherwise wait for: import the LLM
+        libraries and build the classifier (or fused analyzer) and the extractors of
+        `doc_types` (default: all), load the tokenizer, and start the loader processes with
+        the PDF library imported.
+        """
+        if self.fused:
+            self.fused_analyzer
+        else:
+            self.classifier
+        for doc_type in self.get_supported_doc_types() if doc_types is None else doc_types:
+            self.get_extractor(doc_type)
+        get_encoding(self.model_name)
+        import_backend(self.pdf_backend)
+        pool = self._get_loader_pool()
+        wait([pool.submit(import_backend, self.pdf_backend) for _ in range(self.loader_workers)])
+
+    def load_document(self, source: PDFSource, file_hash: Optional[str] = None) -> LazyPDFPages:
+        """
+        Open a PDF (path or bytes) as a lazy page sequence: page text is only extracted when a
+        stage reads that page, so classification touches just its first `max_pages_classification`
+        pages. Large documents are extracted up front in parallel when `parallel_min_pages` is
+        set and some stage reads every page. Pass the content's SHA-256 as `file_hash` when it is
+        already known (e.g. computed while receiving an upload) to skip hashing it again.
+
+        The PDF stays open until every page is read or the pages are closed: `analyze` closes
+        them when it returns, other callers use `with pipeline.load_document(...) as pages:`.
+        """
+        page_count, texts = None, None
+        if self.cache is not None:
+            # Byte-identical files reuse every page that was already parsed
+            file_hash = file_hash or self._hash_source(source)
+            cached = self.cache.get_pages(self._pages_cache_key(file_hash))
+            if cached is not None:
+                page_count, texts = cached
+        pages = LazyPDFPages(source, page_count=page_count, known_pages=texts,
+                             file_hash=file_hash, backend=self.pdf_backend)
+
+        if (self.parallel_min_pages is not None and self._pages_needed() is None
+                and len(pages) >= self.parallel_min_pages):
+            pages.prefetch(self._get_loader_pool(), self.pages_per_task)
+        return pages
+
+    @staticmethod
+    def _hash_source(source: PDFSource) -> str:
+        return hashlib.sha256(source).hexdigest() if isinstance(source, bytes) else ResultCache.hash_file(source)
+
+    def _pages_cache_key(self, file_hash: str) -> str:
+        # Backends produce slightly different text for the same file
+        return f"{self.pdf_backend}:{file_hash}"
+
+    def _get_loader_pool(self) -> ProcessPoolExecutor:
+        if self._loader_pool is None:
+            self._loader_pool = ProcessPoolExecutor(max_workers=self.loader_workers)
+        return self._loader_pool
 
+    def _pages_needed(self) -> Optional[int]:
+        """Number of leading pages any stage can read, or None if some stage reads them all."""
+        limits = [self.max_pages_classification, self.max_pages_extraction]
+        if any(limit is None for limit in limits):
+            return None
+        return max(limits)
+
+    async def aload_document(self, source: PDFSource, progress: Optional[Callable[[int, int], None]] = None,
+                             first_page: int = 0, last_page: Optional[int] = None,
+                             file_hash: Optional[str] = None) -> List[dict]:
+        """
+        Async variant of `load_document`. PDF text extraction is CPU-bound, so it runs in a
+        bounded process pool (`loader_workers`) instead of blocking the event loop. Only the
+        pages that the configured stages can read are extracted.
+
+        Args:
+            source: PDF file path, or its content (bytes are pickled to the loader processes).
+            progress: Called on the event loop as `progress(pages_loaded, pages_total)` as pages
+                      come in: after each page range in parallel mode, else once when loaded.
+            first_page / last_page: Only load pages [first_page, last_page) (0-based), e.g. the
+                                    classifier's window first and the rest while it runs.
+            file_hash: SHA-256 of the content, if already known (see `load_document`).
+        """
+        max_pages = self._pages_needed()
+        if last_page is not None:
+            max_pages = last_page if max_pages is None else min(max_pages, last_page)
+        if self.cache is not None and file_hash is None:
+            file_hash = await asyncio.to_thread(self._hash_source, source)
+        if self.cache is not None:
+            cached = self.cache.get_pages(self._pages_cache_key(file_hash))
+            if cached is not None:
+                page_count, texts = cached
+                wanted = range(first_page, min(page_count, max_pages or page_count))
+                if all(i in texts for i in wanted):
+                    if progress is not None:
+                        progress(len(wanted), len(wanted))
+                    return [{"page": i + 1, "text": texts[i]} for i in wanted]
+
+        parallel = False
+        if self.parallel_min_pages is not None:
+            page_count = min(await asyncio.to_thread(count_pages, source, self.pdf_backend), max_pages or math.inf)
+            parallel = page_count - first_page >= self.parallel_min_pages
+
+        # Invoice templates read the word boxes of the first page
+        layout_pages = 1 if self.invoice_templates is not None else 0
+        pool = self._get_loader_pool()
+        loop = asyncio.get_running_loop()
+        if parallel:
+            # Same split as `extract_pages_parallel`, awaited range by range for progress reports
+            futures = [loop.run_in_executor(pool, extract_pages, source, r.stop, self.pdf_backend, max(r.start, first_page),
+                                            layout_pages)
+                       for r in page_ranges(page_count, self.pages_per_task) if r.stop > first_page]
+            loaded = 0
+            for future in asyncio.as_completed(futures):
+                loaded += len(await future)
+                if progress is not None:
+                    progress(loaded, page_count - first_page)
+            pages = [page for future in futures for page in future.result()]
+        else:
+            pages = await loop.run_in_executor(pool, extract_pages, source, max_pages, self.pdf_backend, first_page,
+                                               layout_pages)
+            if progress is not None:
+                progress(len(pages), len(pages))
+
+        if self.cache is not None and max_pages is None and first_page == 0:
+            self.cache.set_pages(self._pages_cache_key(file_hash), len(pages),
+                                 {p["page"] - 1: p["text"] for p in pages})
         return pages
 
+    def classification_window(self) -> Optional[int]:
+        """
+        Number of leading pages classification reads, when it can run before the rest of the
+        document is loaded (a separate classifier that reads fewer pages than extraction), else None.
+        """
+        if self.fused or self.max_pages_classification is None:
+            return None
+        needed = self._pages_needed()
+        return self.max_pages_classification if needed is None or self.max_pages_classification < needed else None
+
+    def signature_pages(self) -> int:
+        """
+        Number of leading pages the near-duplicate signature is computed from: those classification
+        reads first (its first window), at most the index's `max_pages`. Both are loaded before
+        classification on every path, so lazy documents parse no extra page for the lookup.
+        """
+        first = self.classification_windows[0][0] if self.classification_windows else self.max_pages_classification
+        limits = [limit for limit in (first, self.near_duplicates.max_pages) if limit is not None]
+        return min(limits)
+
+    def _save_pages(self, pages: Sequence[dict]):
+        # Write pages parsed by a stage back to the cache so re-uploads skip them
+        if self.cache is None or not isinstance(pages, LazyPDFPages) or pages.file_hash is None:
+            return
+        texts = pages.unsaved_pages()
+        if texts is not None:
+            self.cache.set_pages(self._pages_cache_key(pages.file_hash), len(pages), texts)
+
+    def close(self):
+        if self._loader_pool is not None:
+            self._loader_pool.shutdown(wait=False, cancel_futures=True)
+            self._loader_pool = None
+        if self._transport is not None:
+            self._transport.close()
+
+    async def aclose(self):
+        """Async variant of `close`, which also closes the async connection pool of the async path."""
+        if self._loader_pool is not None:
+            self._loader_pool.shutdown(wait=False, cancel_futures=True)
+            self._loader_pool = None
+        if self._transport is not None:
+            await self._transport.aclose()
+
     def calculate_costs(self, input_cost: float = 0.6, output_cost: float = 2.4) -> float:
         """
-        Calculate the cost of an API call based on the number of input and output tokens.
+        Calculate the cost of all LLM calls made by this pipeline so far.
 
         Args:
-            input_tokens (int): Number of input tokens used.
-            output_tokens (int): Number of output tokens generated.
-            input_cost (float): Cost per input token (default for GPT-4o mini: $0.60 per 1M tokens).
-            output_cost (float): Cost per output token (default for GPT-4o mini: $2.4 per 1M tokens).
+            input_cost (float): Cost per 1M input tokens (default for GPT-4o mini: $0.60 per 1M tokens).
+            output_cost (float): Cost per 1M output tokens (default for GPT-4o mini: $2.4 per 1M tokens).
 
         Returns:
             float: Total cost in USD.
         """
         return (self.total_input_tokens / 1000000 )* input_cost + (self.total_output_tokens / 1000000 ) * output_cost
 
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_fixed(0.5),
-        retry=retry_if_exception_type(ValueError)
-    )
-    def classify(self, pages):
-        output = self.classifier.invoke(pages)
-        self.total_input_tokens += self.classifier.input_tokens
-        self.total_output_tokens += self.classifier.output_tokens
+    def _record_usage(self, stage: str, call_usage: dict, usage: Optional[dict]):
+        """Add the tokens of a stage's LLM call(s) to the pipeline totals, the metrics and `usage`."""
+        input_tokens, output_tokens = call_usage.get("input_tokens", 0), call_usage.get("output_tokens", 0)
+        cost = token_cost(input_tokens, output_tokens, self.model_name)
+        self.total_input_tokens += input_tokens
+        self.total_output_tokens += output_tokens
+        LLM_CALLS.inc(call_usage.get("calls", 0), stage=stage)
+        LLM_TOKENS.inc(input_tokens, stage=stage, kind="input")
+        LLM_TOKENS.inc(output_tokens, stage=stage, kind="output")
+        LLM_COST.inc(cost, stage=stage)
+        if usage is not None:
+            for key in ("calls", "input_tokens", "output_tokens"):
+                usage[key] = usage.get(key, 0) + call_usage.get(key, 0)
+            usage["cost_usd"] = usage.get("cost_usd", 0.0) + cost
+
+    def _cache_get(self, cache_key: Optional[str], stage: str):
+        if cache_key is None:
+            return None
+        cached = self.cache.get(cache_key)
+        CACHE_LOOKUPS.inc(stage=stage, result="miss" if cached is None else "hit")
+        return cached
+
+    def _classification_cache_key(self, content: str) -> Optional[str]:
+        if self.cache is None:
+            return None
+        return ResultCache.make_key(
+            "classification",
+            content,
+            model=self.classifier.model,
+            prompt_version=self.classifier.prompt_version,
+        )
+
+    def _metadata_cache_key(self, extractor: RunnableMetadataExtractor, pages) -> Optional[str]:
+        if self.cache is None:
+            return None
+        return ResultCache.make_key(
+            f"metadata:{extractor.doc_type}",
+            "\f".join(extractor.build_chunks(pages)),
+            model=extractor.model,
+            prompt_version=extractor.prompt_version,
+        )
+
+    def _fused_cache_key(self, pages) -> Optional[str]:
+        if self.cache is None:
+            return None
+        return ResultCache.make_key(
+            "fused",
+            self.fused_analyzer.build_content(pages),
+            model=self.fused_analyzer.model,
+            prompt_version=self.fused_analyzer.prompt_version,
+        )
+
+    def _classify_locally(self, pages) -> Optional[dict]:
+        if self.local_classifier is None:
+            return None
+        output = self.local_classifier.invoke(pages)
+        if output["confidence"] >= self.local_confidence_threshold:
+            self.local_hits += 1
+            return output
+        self.local_misses += 1
+        return None
+
+    def _find_near_duplicate(self, pages, timings: Optional[dict] = None) -> Tuple[Optional[np.ndarray], Optional[NearDuplicate]]:
+        """The document's MinHash signature and its closest indexed near-duplicate, if any."""
+        if self.near_duplicates is None:
+            return None, None
+        with timed(timings, "near_duplicate"):
+            signature = self.near_duplicates.signature(pages[:self.signature_pages()])
+            match = self.near_duplicates.query(signature) if signature is not None else None
+        NEAR_DUPLICATE_LOOKUPS.inc(result="miss" if match is None else "hit")
+        return signature, match
+
+    def _reuse_classification(self, match: Optional[NearDuplicate], pages) -> Optional[dict]:
+        if match is None or match.classification["confidence"] < self.near_duplicate_min_confidence:
+            return None
+        NEAR_DUPLICATE_REUSES.inc(stage="classify")
+        # At least the first window's call (the only one outside incremental mode)
+        NEAR_DUPLICATE_TOKENS_SAVED.inc(self.classifier.estimate_tokens(pages, step=0), stage="classify")
+        return dict(match.classification)
+
+    @staticmethod
+    def _metadata_hint(match: Optional[NearDuplicate], doc_type: str) -> Optional[dict]:
+        if match is None or match.classification["type"] != doc_type or not match.metadata:
+            return None
+        return match.metadata
+
+    def _count_hint(self, extractor: RunnableMetadataExtractor, pages, hint: Optional[dict]):
+        if not extractor.uses_hint(hint):
+            return
+        NEAR_DUPLICATE_REUSES.inc(stage="extract")
+        # Free-form prompts save the schema's tokens; with structured outputs the hint is an extra example
+        savings = extractor.hint_savings(hint)
+        if savings:
+            calls = len(extractor.build_chunks(pages)) if extractor.chunk_tokens is not None else 1
+            NEAR_DUPLICATE_TOKENS_SAVED.inc(savings * calls, stage="extract")
+
+    def _index_document(self, signature: Optional[np.ndarray], match: Optional[NearDuplicate],
+                        classification: dict, metadata):
+        # Documents that closely match an indexed one are not added, which keeps buckets small
+        if signature is None or (match is not None and match.similarity >= self.near_duplicates.insert_threshold):
+            return
+        self.near_duplicates.add(signature, classification,
+                                 metadata.model_dump() if hasattr(metadata, "model_dump") else metadata)
+
+    def _layout_words(self, pages, doc_type: str) -> Optional[List[dict]]:
+        """Word boxes of the first page, when invoice templates apply to the document."""
+        if self.invoice_templates is None or doc_type != "Invoice" or len(pages) == 0:
+            return None
+        if isinstance(pages, LazyPDFPages):
+            return pages.words(0)
+        # Pages loaded by `aload_document` (not from the page cache, which keeps text only)
+        return pages[0].get("words")
+
+    def _extract_with_template(self, words: Optional[List[dict]]):
+        if words is None:
+            return None
+        template = self.invoice_templates.match(words)
+        if template is None or template["status"] != "active":
+            TEMPLATE_EXTRACTIONS.inc(result="none")
+            return None
+        metadata = self.invoice_templates.extract(words, template)
+        TEMPLATE_EXTRACTIONS.inc(result="fallback" if metadata is None else "hit")
+        return metadata
+
+    def _learn_template(self, words: Optional[List[dict]], metadata: BaseModel):
+        if words is not None:
+            TEMPLATE_UPDATES.inc(event=self.invoice_templates.observe(words, metadata.model_dump()))
+
+    @retry_unparsable
+    def classify(self, pages, usage: Optional[dict] = None):
+        local_output = self._classify_locally(pages)
+        if local_output is not None:
+            return local_output
+
+        # Each window is one call (cached on its own text); the next is only read while the answer is unclear
+        for step, content in self.classifier.window_contents(pages):
+            output = self._classify_window(pages, step, content, usage)
+            if self.classifier.is_final(output):
+                break
+        self._count_exit(step)
+        # The margin only decides whether to read on: results keep the {"type", "confidence"} shape
+        return self.classifier.result(output)
+
+    def _classify_window(self, pages, step: int, content: str, usage: Optional[dict]) -> dict:
+        # `content` is the window's text, built once for both the cache key and the request
+        cache_key = self._classification_cache_key(content)
+        self._save_pages(pages)
+        cached = self._cache_get(cache_key, "classify")
+        if cached is not None:
+            return cached
+
+        call_usage = {}
+        try:
+            output = self.classifier.invoke(pages, usage=call_usage, step=step, content=content)
+        finally:
+            # Calls whose answer fails to parse are retried but still paid for
+            self._record_usage("classify", call_usage, usage)
+        if cache_key is not None:
+            self.cache.set(cache_key, output)
         return output
 
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_fixed(0.5),
-        retry=retry_if_exception_type(ValueError)
-    )
-    def extract_metadata(self, pages, doc_type: str):
-        extractor = self.extractors.get(doc_type)
-        self.total_input_tokens += self.extractors.get(doc_type).input_tokens
-        self.total_output_tokens += self.extractors.get(doc_type).input_tokens
-        if extractor is None:
-            raise ValueError(f"Unsupported document type: {doc_type}")
-        return extractor.invoke(pages)
+    def _count_exit(self, step: int):
+        if self.classifier.incremental:
+            CLASSIFICATION_EXITS.inc(step=str(step + 1))
+
+    @retry_unparsable
+    async def aclassify(self, pages, usage: Optional[dict] = None):
+        local_output = self._classify_locally(pages)
+        if local_output is not None:
+            return local_output
+
+        if self._classifier is None:
+            # The first build imports the LLM libraries: keep it off the event loop
+            await asyncio.to_thread(getattr, self, "classifier")
+        for step, content in self.classifier.window_contents(pages):
+            output = await self._aclassify_window(pages, step, content, usage)
+            if self.classifier.is_final(output):
+                break
+        self._count_exit(step)
+        return self.classifier.result(output)
+
+    async def _aclassify_window(self, pages, step: int, content: str, usage: Optional[dict]) -> dict:
+        cache_key = self._classification_cache_key(content)
+        self._save_pages(pages)
+        cached = self._cache_get(cache_key, "classify")
+        if cached is not None:
+            return cached
+
+        call_usage = {}
+        try:
+            output = await self.classifier.ainvoke(pages, usage=call_usage, step=step, content=content)
+        finally:
+            self._record_usage("classify", call_usage, usage)
+        if cache_key is not None:
+            self.cache.set(cache_key, output)
+        return output
+
+    @retry_unparsable
+    def extract_metadata(self, pages, doc_type: str, usage: Optional[dict] = None, hint: Optional[dict] = None):
+        extractor = self.get_extractor(doc_type)
+        cache_key = self._metadata_cache_key(extractor, pages)
+        self._save_pages(pages)
+        cached = self._cache_get(cache_key, "extract")
+        if cached is not None:
+            return extractor.parser.pydantic_object.model_validate(cached)
+
+        words = self._layout_words(pages, doc_type)
+        metadata = self._extract_with_template(words)
+        if metadata is not None:
+            return metadata
+        self._count_hint(extractor, pages, hint)
+        call_usage = {}
+        try:
+            metadata = extractor.invoke(pages, usage=call_usage, hint=hint)
+        finally:
+            self._record_usage("extract", call_usage, usage)
+        self._learn_template(words, metadata)
+        if cache_key is not None:
+            self.cache.set(cache_key, metadata.model_dump())
+        return metadata
+
+    @retry_unparsable
+    async def aextract_metadata(self, pages, doc_type: str, usage: Optional[dict] = None, hint: Optional[dict] = None):
+        extractor = self.extractors.get(doc_type) or await asyncio.to_thread(self.get_extractor, doc_type)
+        cache_key = self._metadata_cache_key(extractor, pages)
+        self._save_pages(pages)
+        cached = self._cache_get(cache_key, "extract")
+        if cached is not None:
+            return extractor.parser.pydantic_object.model_validate(cached)
+
+        words = self._layout_words(pages, doc_type)
+        metadata = self._extract_with_template(words)
+        if metadata is not None:
+            return metadata
+        self._count_hint(extractor, pages, hint)
+        call_usage = {}
+        try:
+            metadata = await extractor.ainvoke(pages, usage=call_usage, hint=hint)
+        finally:
+            self._record_usage("extract", call_usage, usage)
+        self._learn_template(words, metadata)
+        if cache_key is not None:
+            self.cache.set(cache_key, metadata.model_dump())
+        return metadata
+
+    def analyze(self, pages, timings: Optional[dict] = None, usage: Optional[dict] = None) -> Tuple[dict, BaseModel]:
+        """
+        Classify the document and extract its metadata. In fused mode a single LLM call does
+        both, unless the local classifier is confident, in which case only extraction is called.
+
+        With a near-duplicate index, a confident near-duplicate's classification is reused
+        without any call, its metadata is shown to the extraction prompt as an example, and
+        documents without a close match are added to the index. With invoice templates,
+        invoices of a learned layout are extracted from their word positions instead of by the LLM.
+
+        Args:
+            pages: Document pages.
+            timings: Optional dict that receives the seconds spent per stage ("near_duplicate",
+                     "classify", "extract", or "analyze" for the fused call).
+            usage: Optional dict that receives this document's LLM calls, input / output
+                   tokens and estimated cost ("calls", "input_tokens", "output_tokens", "cost_usd").
+
+        Returns:
+            Tuple[dict, BaseModel]: The classification ({"type", "confidence"}) and the metadata.
+        """
+        usage = self._new_usage(usage)
+        try:
+            signature, match = self._find_near_duplicate(pages, timings)
+            with timed(timings, "classify"):
+                classification = self._reuse_classification(match, pages)
+                if classification is None and not self.fused:
+                    classification = self.classify(pages, usage)
+                elif classification is None:
+                    classification = self._classify_locally(pages)
+            if classification is None:
+                with timed(timings, "analyze"):
+                    classification, metadata = self._analyze_fused(pages, usage)
+            else:
+                with timed(timings, "extract"):
+                    metadata = self.extract_metadata(pages, classification["type"], usage,
+                                                     hint=self._metadata_hint(match, classification["type"]))
+            self._index_document(signature, match, classification, metadata)
+            return classification, metadata
+        finally:
+            self._observe_document(usage)
+            if isinstance(pages, LazyPDFPages):
+                # Release the PDF handle; pages read later reopen it
+                pages.close()
+
+    async def aanalyze(self, pages, timings: Optional[dict] = None, usage: Optional[dict] = None) -> Tuple[dict, BaseModel]:
+        """Async variant of `analyze`."""
+        usage = self._new_usage(usage)
+        try:
+            signature, match = self._find_near_duplicate(pages, timings)
+            with timed(timings, "classify"):
+                classification = self._reuse_classification(match, pages)
+                if classification is None and not self.fused:
+                    classification = await self.aclassify(pages, usage)
+                elif classification is None:
+                    classification = self._classify_locally(pages)
+            if classification is None:
+                with timed(timings, "analyze"):
+                    classification, metadata = await self._aanalyze_fused(pages, usage)
+            else:
+                with timed(timings, "extract"):
+                    metadata = await self.aextract_metadata(pages, classification["type"], usage,
+                                                            hint=self._metadata_hint(match, classification["type"]))
+            self._index_document(signature, match, classification, metadata)
+            return classification, metadata
+        finally:
+            self._observe_document(usage)
+
+    async def aanalyze_events(self, pages, timings: Optional[dict] = None, usage: Optional[dict] = None,
+                              more_pages: Optional[Awaitable[List[dict]]] = None) -> AsyncIterator[Tuple[str, object]]:
+        """
+        Streaming variant of `aanalyze`: yield ("classification", dict) as soon as the type is
+        known, then ("metadata_partial", dict) while the extraction answer is being written,
+        then ("metadata", BaseModel). Fused mode yields classification and metadata together,
+        after its single call.
+
+        `more_pages` are the pages still being loaded after `pages` (see `classification_window`):
+        classification only reads `pages`, and they are awaited before extraction.
+        """
+        usage = self._new_usage(usage)
+        try:
+            signature, match = self._find_near_duplicate(pages, timings)
+            with timed(timings, "classify"):
+                classification = self._reuse_classification(match, pages)
+                if classification is None and not self.fused:
+                    classification = await self.aclassify(pages, usage)
+                elif classification is None:
+                    classification = self._classify_locally(pages)
+            if classification is None:
+                if more_pages is not None:
+                    pages = list(pages) + await more_pages
+                with timed(timings, "analyze"):
+                    classification, metadata = await self._aanalyze_fused(pages, usage)
+                self._index_document(signature, match, classification, metadata)
+                yield "classification", classification
+                yield "metadata", metadata
+                return
+            yield "classification", classification
+            if more_pages is not None:
+                pages = list(pages) + await more_pages
+
+            start = time.perf_counter()
+            try:
+                async for part in self.astream_metadata(pages, classification["type"], usage,
+                                                        hint=self._metadata_hint(match, classification["type"])):
+                    if isinstance(part, BaseModel):
+                        self._index_document(signature, match, classification, part)
+                    yield ("metadata", part) if isinstance(part, BaseModel) else ("metadata_partial", part)
+            finally:
+                # Not `timed`: the consumer's time between partial results is not extraction time
+                elapsed = time.perf_counter() - start
+                STAGE_SECONDS.observe(elapsed, stage="extract")
+                if timings is not None:
+                    timings["extract"] = timings.get("extract", 0.0) + elapsed
+        finally:
+            self._observe_document(usage)
+
+    async def astream_metadata(self, pages, doc_type: str, usage: Optional[dict] = None,
+                               hint: Optional[dict] = None) -> AsyncIterator[object]:
+        """
+        Yield partial metadata dicts while the model writes its answer, then the validated
+        metadata. Cache hits yield the cached metadata only. If the streamed answer does not
+        parse, extraction falls back to `aextract_metadata` (with its retries). Invoices that
+        match an active layout template yield the template's metadata only.
+        """
+        extractor = self.extractors.get(doc_type) or await asyncio.to_thread(self.get_extractor, doc_type)
+        cache_key = self._metadata_cache_key(extractor, pages)
+        self._save_pages(pages)
+        cached = self._cache_get(cache_key, "extract")
+        if cached is not None:
+            yield extractor.parser.pydantic_object.model_validate(cached)
+            return
+        words = self._layout_words(pages, doc_type)
+        metadata = self._extract_with_template(words)
+        if metadata is not None:
+            yield metadata
+            return
+
+        self._count_hint(extractor, pages, hint)
+        call_usage, metadata = {}, None
+        try:
+            async for part in extractor.astream_partial(pages, usage=call_usage, hint=hint):
+                if isinstance(part, BaseModel):
+                    metadata = part
+                else:
+                    yield part
+        except ValueError:
+            RETRIES.inc(operation="astream_metadata")
+        finally:
+            self._record_usage("extract", call_usage, usage)
+        if metadata is None:
+            metadata = await self.aextract_metadata(pages, doc_type, usage, hint)
+        else:
+            self._learn_template(words, metadata)
+            if cache_key is not None:
+                self.cache.set(cache_key, metadata.model_dump())
+        yield metadata
+
+    @staticmethod
+    def _new_usage(usage: Optional[dict]) -> dict:
+        usage = {} if usage is None else usage
+        for key in ("calls", "input_tokens", "output_tokens"):
+            usage.setdefault(key, 0)
+        usage.setdefault("cost_usd", 0.0)
+        return usage
+
+    @staticmethod
+    def _observe_document(usage: dict):
+        DOCUMENT_TOKENS.observe(usage.get("input_tokens", 0), kind="input")
+        DOCUMENT_TOKENS.observe(usage.get("output_tokens", 0), kind="output")
+        DOCUMENT_COST.observe(usage.get("cost_usd", 0.0))
+
+    @staticmethod
+    def _fused_result(output: dict) -> Tuple[dict, BaseModel]:
+        return {"type": output["type"], "confidence": output["confidence"]}, output["metadata"]
+
+    def _cached_fused_result(self, cached: dict) -> Tuple[dict, BaseModel]:
+        return cached["classification"], METADATA_MODELS[cached["classification"]["type"]].model_validate(cached["metadata"])
+
+    @retry_unparsable
+    def _analyze_fused(self, pages, usage: Optional[dict] = None) -> Tuple[dict, BaseModel]:
+        cache_key = self._fused_cache_key(pages)
+        self._save_pages(pages)
+        cached = self._cache_get(cache_key, "analyze")
+        if cached is not None:
+            return self._cached_fused_result(cached)
+
+        call_usage = {}
+        try:
+            classification, metadata = self._fused_result(self.fused_analyzer.invoke(pages, usage=call_usage))
+        finally:
+            self._record_usage("analyze", call_usage, usage)
+        if cache_key is not None:
+            self.cache.set(cache_key, {"classification": classification, "metadata": metadata.model_dump()})
+        return classification, metadata
+
+    @retry_unparsable
+    async def _aanalyze_fused(self, pages, usage: Optional[dict] = None) -> Tuple[dict, BaseModel]:
+        if self._fused_analyzer is None:
+            await asyncio.to_thread(getattr, self, "fused_analyzer")
+        cache_key = self._fused_cache_key(pages)
+        self._save_pages(pages)
+        cached = self._cache_get(cache_key, "analyze")
+        if cached is not None:
+            return self._cached_fused_result(cached)
+
+        call_usage = {}
+        try:
+            classification, metadata = self._fused_result(await self.fused_analyzer.ainvoke(pages, usage=call_usage))
+        finally:
+            self._record_usage("analyze", call_usage, usage)
+        if cache_key is not None:
+            self.cache.set(cache_key, {"classification": classification, "metadata": metadata.model_dump()})
+        return classification, metadata
 
     def get_supported_doc_types(self):
         return list(self.label_descriptions.keys())
@@ -0,0 +1,437 @@
+import base64
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from core.action_generator import PRIORITIES, generate_actions, parse_deadline
+
+
+# Metadata date fields that get their own indexed column
+DATE_FIELDS = ("due_date", "effective_date", "termination_date")
+# Stored deadline of actions without one, so that a single index order lists them last
+NO_DEADLINE = "9999-12-31"
+# Bumped when stored data needs a migration on open (1: action index)
+SCHEMA_VERSION = 1
+
+
+def encode_cursor(values: Tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple:
+    try:
+        return tuple(json.loads(base64.urlsafe_b64decode(cursor.encode("ascii"))))
+    except (ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+class DocumentStore:
+    """
+    Persistent store for analysed documents (`DocumentEntry` dicts: id, classification, metadata).
+
+    Documents live in a local SQLite file in WAL mode, so every uvicorn worker process sees the
+    same documents and they survive restarts. Besides the JSON payload, each row keeps the
+    document type, confidence, creation time and the extracted dates (`DATE_FIELDS`) in
+    indexed columns, which `list` uses for filtering and keyset pagination without scanning.
+
+    The actions of every document (`core.action_generator`) are generated when it is stored
+    and kept in a deadline-ordered table in the same transaction, so `list_actions` answers
+    cross-document queries ("high priority, due this week") with an index range scan, and a
+    re-analysed document replaces its actions along with its metadata.
+
+    A bounded per-process LRU of recently read documents sits in front of SQLite. Documents
+    only change when re-analysed; those replacements are logged so that every process drops
+    its stale copy.
+    """
+
+    def __init__(self, path: str = "data/documents.sqlite", max_memory_entries: int = 10000):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, doc_type TEXT NOT NULL, "
+            "confidence REAL NOT NULL, created_at REAL NOT NULL, due_date TEXT, effective_date TEXT, "
+            "termination_date TEXT, classification TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        # One index per supported listing order, with and without a type filter (see `list`)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_created ON documents (created_at, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_confidence ON documents (confidence, id)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_documents_type_created ON documents (doc_type, created_at, id)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_documents_type_confidence ON documents (doc_type, confidence, id)"
+        )
+        for field in DATE_FIELDS:
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_documents_{field} ON documents ({field}, id) "
+                f"WHERE {field} IS NOT NULL"
+            )
+        # Status of background analysis jobs (see core.job_queue), readable by every worker
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, "
+            "updated_at REAL NOT NULL, job TEXT NOT NULL)"
+        )
+        # Actions in deadline order; `priority` is the position in PRIORITIES (0 = high)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS actions (document_id TEXT NOT NULL, seq INTEGER NOT NULL, "
+            "doc_type TEXT NOT NULL, type TEXT NOT NULL, priority INTEGER NOT NULL, deadline TEXT NOT NULL, "
+            "description TEXT NOT NULL, PRIMARY KEY (document_id, seq)) WITHOUT ROWID"
+        )
+        # One index per filter of `list_actions`, each in the order it returns actions
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_actions_deadline ON actions (deadline, document_id, seq)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_actions_priority ON actions (priority, deadline, document_id, seq)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_actions_type ON actions (type, deadline, document_id, seq)")
+        # Ids of re-analysed (replaced) documents, read by the other processes to evict them;
+        # rows of documents that are gone have nothing left to evict
+        self._conn.execute("CREATE TABLE IF NOT EXISTS replacements (seq INTEGER PRIMARY KEY, id TEXT NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_replacements_id ON replacements (id)")
+        self._conn.execute("DELETE FROM replacements WHERE id NOT IN (SELECT id FROM documents) "
+                           "AND seq < (SELECT MAX(seq) FROM replacements)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        self._replacement_seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM replacements").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self._migrate()
+
+    def _migrate(self):
+        """Build the action index of documents stored before it existed (once per file)."""
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
+        with self._lock:
+            # Another process may be migrating: re-check inside the write transaction
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self._conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                    self._conn.execute("DELETE FROM actions")
+                    rows = self._conn.execute("SELECT id, classification, metadata FROM documents")
+                    while True:
+                        batch = [self._entry(row) for row in rows.fetchmany(10000)]
+                        if not batch:
+                            break
+                        self._conn.executemany(
+                            "INSERT INTO actions (document_id, seq, doc_type, type, priority, deadline, description) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?)", [row for entry in batch for row in self._action_rows(entry)])
+                    self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+
+    @staticmethod
+    def _row(entry: Dict[str, Any], created_at: float) -> Tuple:
+        classification, metadata = entry["classification"], entry["metadata"] or {}
+        return (
+            entry["id"], classification["type"], float(classification["confidence"]), created_at,
+            *(parse_deadline(metadata.get(field)) for field in DATE_FIELDS),
+            json.dumps(classification, ensure_ascii=False), json.dumps(metadata, ensure_ascii=False),
+        )
+
+    @staticmethod
+    def _action_rows(entry: Dict[str, Any]) -> List[Tuple]:
+        doc_type = entry["classification"]["type"]
+        return [
+            (entry["id"], seq, doc_type, action["type"], PRIORITIES.index(action["priority"]),
+             action["deadline"] or NO_DEADLINE, action["description"])
+            for seq, action in enumerate(generate_actions(doc_type, entry["metadata"]))
+        ]
+
+    @staticmethod
+    def _action(row: Tuple) -> Dict[str, Any]:
+        document_id, doc_type, type, priority, deadline, description = row
+        return {"document_id": document_id, "doc_type": doc_type, "type": type, "description": description,
+                "deadline": None if deadline == NO_DEADLINE else deadline, "priority": PRIORITIES[priority]}
+
+    @staticmethod
+    def _entry(row: Tuple) -> Dict[str, Any]:
+        return {"id": row[0], "classification": json.loads(row[1]), "metadata": json.loads(row[2])}
+
+    def _remember(self, entry: Dict[str, Any]):
+        # Caller holds the lock
+        self._memory[entry["id"]] = entry
+        self._memory.move_to_end(entry["id"])
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def put(self, entry: Dict[str, Any]):
+        self.put_many([entry])
+
+    def put_many(self, entries: Iterable[Dict[str, Any]]):
+        """
+        Store documents and their actions in a single transaction (much faster than one `put`
+        per document). A document stored again under the same id (re-analysed) keeps its
+        creation time, and its actions are replaced.
+        """
+        entries = list(entries)
+        action_rows = [row for entry in entries for row in self._action_rows(entry)]
+        now = time.time()
+        with self._lock:
+            try:
+                ids = [entry["id"] for entry in entries]
+                created = {}
+                for offset in range(0, len(ids), 500):
+                    chunk = ids[offset:offset + 500]
+                    created.update(self._conn.execute(
+                        f"SELECT id, created_at FROM documents WHERE id IN ({','.join('?' * len(chunk))})", chunk))
+                rows = [self._row(entry, created.get(entry["id"], now)) for entry in entries]
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO documents (id, doc_type, confidence, created_at, due_date, effective_date, "
+                    "termination_date, classification, metadata) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                if created:
+                    self._conn.executemany("DELETE FROM actions WHERE document_id = ?", [(id,) for id in created])
+                    self._conn.executemany("INSERT INTO replacements (id) VALUES (?)", [(id,) for id in created])
+                    # One row per replaced document: its latest replacement is all other processes need
+                    # (deleted after the insert, so that sequence numbers never go back)
+                    self._conn.executemany(
+                        "DELETE FROM replacements WHERE id = ? AND seq < (SELECT MAX(seq) FROM replacements WHERE id = ?)",
+                        [(id, id) for id in created])
+                self._conn.executemany(
+                    "INSERT INTO actions (document_id, seq, doc_type, type, priority, deadline, description) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", action_rows)
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+            for id in ids:
+                self._memory.pop(id, None)
+
+    def _evict_replaced(self):
+        # Caller holds the lock; data_version only changes when another connection commits
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return
+        self._data_version = version
+        for seq, id in self._conn.execute("SELECT seq, id FROM replacements WHERE seq > ?", (self._replacement_seq,)):
+            self._memory.pop(id, None)
+            self._replacement_seq = seq
+
+    def get(self, id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._evict_replaced()
+            entry = self._memory.get(id)
+            if entry is not None:
+                self._memory.move_to_end(id)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            row = self._conn.execute(
+                "SELECT id, classification, metadata FROM documents WHERE id = ?", (id,)
+            ).fetchone()
+            if row is None:
+                return None
+            entry = self._entry(row)
+            self._remember(entry)
+            return entry
+
+    def list(self, doc_type: Optional[str] = None, min_confidence: Optional[float] = None,
+             max_confidence: Optional[float] = None, date_field: Optional[str] = None,
+             date_from: Optional[str] = None, date_before: Optional[str] = None,
+             limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Return one page of documents matching the filters, and the cursor of the next page.
+
+        Args:
+            doc_type: Only documents of this type.
+            min_confidence / max_confidence: Inclusive bounds on the classification confidence.
+            date_field: One of `DATE_FIELDS`. Documents without this date are excluded and the
+                        results are ordered by it (earliest first), e.g. invoices by due date.
+            date_from / date_before: Inclusive lower / exclusive upper bound on `date_field`
+                                     (YYYY-MM-DD).
+            limit: Page size.
+            cursor: `next_cursor` of the previous page.
+
+        Results are ordered by `date_field` when given, else by confidence (lowest first) when
+        a confidence bound is given, else newest first; each order has an index. Pagination is
+        keyset based (the cursor holds the sort key of the last row), so every page is an index
+        range scan regardless of how deep it is.
+
+        Returns:
+            (documents, next_cursor), where next_cursor is None on the last page.
+        """
+        sql, params = self._list_query(doc_type, min_confidence, max_confidence, date_field,
+                                       date_from, date_before, limit, cursor)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor((rows[-1][3], rows[-1][0]))
+        return [self._entry(row) for row in rows], next_cursor
+
+    def _list_query(self, doc_type, min_confidence, max_confidence, date_field, date_from, date_before,
+                    limit, cursor) -> Tuple[str, List[Any]]:
+        where, params = [], []
+        if date_field is not None:
+            if date_field not in DATE_FIELDS:
+                raise ValueError(f"Unsupported date field: {date_field}")
+            where.append(f"{date_field} IS NOT NULL")
+            for value, operator in ((date_from, ">="), (date_before, "<")):
+                if value is not None:
+                    if parse_deadline(value) is None:
+                        raise ValueError(f"Invalid date: {value!r}")
+                    where.append(f"{date_field} {operator} ?")
+                    params.append(parse_deadline(value))
+            sort_column, order, comparison = date_field, "ASC", ">"
+        elif min_confidence is not None or max_confidence is not None:
+            # Confidence ranges are listed least confident first (review queues)
+            sort_column, order, comparison = "confidence", "ASC", ">"
+        else:
+            sort_column, order, comparison = "created_at", "DESC", "<"
+
+        if doc_type is not None:
+            # Each date belongs to a single type: when listing by date, the unary "+" keeps
+            # SQLite on the date index instead of reading every document of the type and sorting
+            where.append("+doc_type = ?" if date_field is not None else "doc_type = ?")
+            params.append(doc_type)
+        if min_confidence is not None:
+            where.append("confidence >= ?")
+            params.append(min_confidence)
+        if max_confidence is not None:
+            where.append("confidence <= ?")
+            params.append(max_confidence)
+
+        if cursor is not None:
+            last_value, last_id = decode_cursor(cursor)
+            where.append(f"({sort_column}, id) {comparison} (?, ?)")
+            params.extend([last_value, last_id])
+
+        sql = f"SELECT id, classification, metadata, {sort_column} FROM documents"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        # One extra row tells whether there is a next page
+        sql += f" ORDER BY {sort_column} {order}, id {order} LIMIT ?"
+        params.append(limit + 1)
+        return sql, params
+
+    def explain(self, doc_type=None, min_confidence=None, max_confidence=None, date_field=None,
+                date_from=None, date_before=None, limit=50, cursor=None) -> List[str]:
+        """SQLite query plan of the matching `list` call (to check that listings use an index)."""
+        sql, params = self._list_query(doc_type, min_confidence, max_confidence, date_field,
+                                       date_from, date_before, limit, cursor)
+        with self._lock:
+            return [row[3] for row in self._conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()]
+
+    def get_actions(self, document_id: str) -> List[Dict[str, Any]]:
+        """The stored actions of a document, in the order they were generated."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT document_id, doc_type, type, priority, deadline, description FROM actions "
+                "WHERE document_id = ? ORDER BY seq", (document_id,)).fetchall()
+        return [self._action(row) for row in rows]
+
+    def list_actions(self, deadline_from: Optional[str] = None, deadline_before: Optional[str] = None,
+                     priority: Optional[str] = None, action_type: Optional[str] = None,
+                     limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Return one page of actions across all documents, earliest deadline first (actions
+        without a deadline last), and the cursor of the next page.
+
+        Args:
+            deadline_from / deadline_before: Inclusive lower / exclusive upper bound on the
+                                             deadline (YYYY-MM-DD). Either one excludes actions
+                                             without a deadline.
+            priority: Only actions of this priority (one of `PRIORITIES`).
+            action_type: Only actions of this type (e.g. "payment_due").
+            limit: Page size.
+            cursor: `next_cursor` of the previous page.
+
+        Each filter has an index in deadline order, so every page is an index range scan
+        however many actions are stored and however deep the page is.
+
+        Returns:
+            (actions, next_cursor), where next_cursor is None on the last page.
+        """
+        sql, params = self._actions_query(deadline_from, deadline_before, priority, action_type, limit, cursor)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor((rows[-1][4], rows[-1][0], rows[-1][6]))
+        return [self._action(row[:6]) for row in rows], next_cursor
+
+    def _actions_query(self, deadline_from, deadline_before, priority, action_type, limit, cursor) -> Tuple[str, List[Any]]:
+        where, params = [], []
+        if priority is not None:
+            if priority not in PRIORITIES:
+                raise ValueError(f"Unsupported priority: {priority}")
+            # With a type filter too, the unary "+" keeps SQLite on the type index
+            where.append("+priority = ?" if action_type is not None else "priority = ?")
+            params.append(PRIORITIES.index(priority))
+        if action_type is not None:
+            where.append("type = ?")
+            params.append(action_type)
+        if deadline_from is not None or deadline_before is not None:
+            where.append("deadline < ?")
+            params.append(NO_DEADLINE)
+        for value, operator in ((deadline_from, ">="), (deadline_before, "<")):
+            if value is not None:
+                if parse_deadline(value) is None:
+                    raise ValueError(f"Invalid date: {value!r}")
+                # A cursor is past deadline_from already, and SQLite must seek to the cursor
+                # rather than to deadline_from for deep pages to stay cheap
+                if operator == "<" or cursor is None:
+                    where.append(f"deadline {operator} ?")
+                    params.append(parse_deadline(value))
+        if cursor is not None:
+            last_deadline, last_id, last_seq = decode_cursor(cursor)
+            where.append("(deadline, document_id, seq) > (?, ?, ?)")
+            params.extend([last_deadline, last_id, last_seq])
+
+        sql = "SELECT document_id, doc_type, type, priority, deadline, description, seq FROM actions"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        # One extra row tells whether there is a next page
+        sql += " ORDER BY deadline, document_id, seq LIMIT ?"
+        params.append(limit + 1)
+        return sql, params
+
+    def explain_actions(self, deadline_from=None, deadline_before=None, priority=None, action_type=None,
+                        limit=50, cursor=None) -> List[str]:
+        """SQLite query plan of the matching `list_actions` call."""
+        sql, params = self._actions_query(deadline_from, deadline_before, priority, action_type, limit, cursor)
+        with self._lock:
+            return [row[3] for row in self._conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()]
+
+    def count_actions(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM actions").fetchone()[0]
+
+    def put_job(self, job: Dict[str, Any]):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, status, updated_at, job) VALUES (?, ?, ?, ?)",
+                (job["id"], job["status"], time.time(), json.dumps(job, ensure_ascii=False)),
+            )
+            self._conn.commit()
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT job FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "memory_entries": len(self._memory)}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
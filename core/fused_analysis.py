@@ -0,0 +1,159 @@
+"""
+Single-call document analysis: classification and metadata extraction in one structured
+JSON completion.
+
+The two-call pipeline sends the document text twice (once to `RunnableGPTLogprobClassifier`,
+once to the type-specific `RunnableMetadataExtractor`) in two sequential round-trips.
+`RunnableFusedAnalyzer` sends it once and asks for the label, per-label scores and the
+metadata of the chosen type together. The confidence is still taken from the logprobs of
+the label token when the API returns them, so it is comparable with the two-call path.
+"""
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
+import numpy as np
+from langchain.prompts import PromptTemplate
+from langchain_core.runnables import Runnable
+from openai import OpenAI, AsyncOpenAI
+from openai.types.chat import ChatCompletion
+from pydantic import BaseModel
+from core.content_selection import TYPE_KEYWORDS, select_content, count_tokens
+from core.metadata_schemas import METADATA_MODELS
+from core.metrics import add_usage
+from core.llm_transport import LLMTransport
+
+# Same fields and instructions as the type-specific extraction prompts, in compact form
+METADATA_FIELDS = {
+    "Invoice": 'vendor (name of the company issuing the invoice), amount (total amount, number), '
+               'due_date (YYYY-MM-DD, only if explicitly mentioned), line_items (list of {"description", '
+               '"quantity", "amount"}; include every item in the text, even if some values are missing or 0)',
+    "Contract": 'parties (list of strings), effective_date (YYYY-MM-DD), termination_date (YYYY-MM-DD), '
+                'key_terms (list of strings)',
+    "Earnings": 'reporting_period, key_metrics (list of {"name", "value"}, value as text such as "$1.2B" '
+                'or "15%"), executive_summary (a short paragraph)',
+    "Other": 'summary (a concise 3-5 sentence overview of the document)',
+}
+
+
+class RunnableFusedAnalyzer(Runnable):
+    def __init__(self, label_descs: dict, model: str = "gpt-4o-mini", max_pages=None,
+                 max_prompt_tokens=4000, max_completion_tokens: int = 1000,
+                 transport: Optional[LLMTransport] = None):
+        self.model = model
+        self.labels_descriptions = label_descs
+        self.labels = list(label_descs.keys())
+        self.max_pages = max_pages
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_completion_tokens = max_completion_tokens
+        self.client = transport.client if transport is not None else OpenAI()
+        self.async_client = transport.async_client if transport is not None else AsyncOpenAI()
+        # The SDK imports its chat resources on first access: do it now rather than in the first call
+        self.async_client.chat.completions
+        self.prompt_template = self.build_prompt_template()
+        self.prompt_version = hashlib.sha256(self.prompt_template.template.encode("utf-8")).hexdigest()[:12]
+        # The type is not known before the call: rank segments by the keywords of every type
+        self.keywords = sorted({k for label in self.labels for k in TYPE_KEYWORDS.get(label, [])})
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def build_prompt_template(self) -> PromptTemplate:
+        label_lines = "\n".join(f"- {label}: {desc}" for label, desc in self.labels_descriptions.items())
+        field_lines = "\n".join(f"- {label}: {METADATA_FIELDS[label]}" for label in self.labels)
+        label_list = ", ".join(self.labels)
+        instructions = (
+            "You are a document intelligence system for business documents parsed as text from PDF.\n\n"
+            "1. Classify the document into one of the following types:\n\n"
+            f"{label_lines}\n\n"
+            "2. Extract the metadata fields of the type you chose:\n\n"
+            f"{field_lines}\n\n"
+            "Use null for fields that are not present. Do not infer values, only extract what is in the text.\n\n"
+            "Respond with a JSON object with exactly these keys, in this order:\n"
+            f'{{"type": <one of {label_list}>, "scores": {{<type>: <probability between 0 and 1>, ...}}, '
+            '"metadata": {<fields of the chosen type>}}\n\n'
+        )
+        # Escape the literal JSON braces; {content} is the only template variable
+        template = instructions.replace("{", "{{").replace("}", "}}") + "Document content:\n{content}"
+        return PromptTemplate.from_template(template)
+
+    def build_content(self, pages: List[Dict[str, Any]]) -> str:
+        """Return the document text that is sent to the model for the given pages."""
+        if self.max_pages is not None:
+            pages = pages[:self.max_pages]
+        return select_content(pages, self.max_prompt_tokens, model=self.model, keywords=self.keywords)
+
+    def build_request(self, pages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Return the chat completion arguments for analysing the given pages."""
+        prompt = self.prompt_template.format(content=self.build_content(pages))
+        return dict(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=self.max_completion_tokens,
+            temperature=0,
+            response_format={"type": "json_object"},
+            # Logprobs of the label token give the same confidence as the two-call classifier
+            logprobs=True,
+            top_logprobs=10,
+        )
+
+    def estimate_tokens(self, pages: List[Dict[str, Any]]) -> int:
+        """Tokens one call will use at most: the prompt plus the maximum completion length."""
+        request = self.build_request(pages)
+        return count_tokens(request["messages"][0]["content"], self.model) + request["max_tokens"]
+
+    def _confidence_from_logprobs(self, response: ChatCompletion, label: str, scores: Dict[str, float]) -> float:
+        logprobs = getattr(response.choices[0], "logprobs", None)
+        for entry in (logprobs.content or []) if logprobs is not None else []:
+            if entry.token.strip().strip('"') != label:
+                continue
+            label_logprobs = {}
+            for top in entry.top_logprobs:
+                token = top.token.strip().strip('"')
+                if token in self.labels and token not in label_logprobs:
+                    label_logprobs[token] = top.logprob
+            if label in label_logprobs:
+                logits = np.array(list(label_logprobs.values()))
+                probs = np.exp(logits - logits.max())
+                return float(probs[list(label_logprobs).index(label)] / probs.sum())
+        # No usable logprobs: fall back to the scores the model reported
+        total = sum(scores.values())
+        return scores.get(label, 0.0) / total if total > 0 else 0.0
+
+    def parse_response(self, response: ChatCompletion, usage: Optional[dict] = None) -> Dict[str, Any]:
+        call_usage = {"input_tokens": 0, "output_tokens": 0}
+        if response.usage is not None:
+            call_usage = {"input_tokens": response.usage.prompt_tokens, "output_tokens": response.usage.completion_tokens}
+            self.input_tokens += call_usage["input_tokens"]
+            self.output_tokens += call_usage["output_tokens"]
+            # Recorded before parsing, so calls with an invalid answer are counted too
+            add_usage(usage, call_usage["input_tokens"], call_usage["output_tokens"])
+
+        try:
+            data = json.loads(response.choices[0].message.content)
+        except (AttributeError, IndexError, TypeError, json.JSONDecodeError) as e:
+            raise ValueError(f"Unexpected fused analysis response: {e}\n Response: {response}") from e
+
+        label = data.get("type")
+        if label not in self.labels:
+            raise ValueError(f"Invalid document type in fused analysis response: {label!r}")
+        scores = {k: float(v) for k, v in (data.get("scores") or {}).items()
+                  if k in self.labels and isinstance(v, (int, float))}
+        metadata_model = METADATA_MODELS[label]
+        # Omitted fields count as null; pydantic's ValidationError is a ValueError, so the pipeline retries it
+        fields = {name: None for name in metadata_model.model_fields}
+        metadata: BaseModel = metadata_model.model_validate({**fields, **(data.get("metadata") or {})})
+
+        return {
+            "type": label,
+            "confidence": self._confidence_from_logprobs(response, label, scores),
+            "scores": scores,
+            "metadata": metadata,
+            "usage": call_usage,
+        }
+
+    def invoke(self, input: List[Dict[str, Any]], config=None, usage: Optional[dict] = None, **kwargs) -> Dict[str, Any]:
+        response: ChatCompletion = self.client.chat.completions.create(**self.build_request(input))
+        return self.parse_response(response, usage)
+
+    async def ainvoke(self, input: List[Dict[str, Any]], config=None, usage: Optional[dict] = None, **kwargs) -> Dict[str, Any]:
+        response: ChatCompletion = await self.async_client.chat.completions.create(**self.build_request(input))
+        return self.parse_response(response, usage)
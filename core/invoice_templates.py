@@ -0,0 +1,562 @@
+"""
+Layout templates for invoices of recurring vendors.
+
+A vendor's invoices put the vendor, total, due date and line items in the same places. Once
+an LLM extraction of such a layout is confirmed, `InvoiceTemplateStore` learns where each
+field sits on the first page (from pdfplumber word boxes) and extracts later invoices of
+that layout deterministically, in milliseconds and without a network call:
+
+- Fingerprint: the positioned words of the page header and footer (the top and bottom 30%
+  of the text area). Invoices match a template when these anchors overlap enough (Jaccard).
+- Rules: the total and the due date are read at a fixed offset from a label word found
+  near its learned position ("Totaal" -> the amount 87 pt to its right), so totals that move
+  down with longer item tables are still found; line items are the rows between the
+  table header and footer with a number in the learned amount column; the vendor is constant.
+- Confirmation: a template learned from an LLM extraction starts as a candidate and becomes
+  active once `min_confirmations` later LLM extractions of the layout agree with what it
+  would have produced. Templates learned from reviewed metadata (`confirmed=True`, e.g. the
+  recorded outputs, see `main`) are active straight away. A disagreement relearns the rules.
+- Validation: an extraction is rejected (and the caller falls back to the LLM) when a field
+  the template knows is not found, the vendor no longer appears on the page, or the line
+  items stop adding up to the total like they did on the learned invoice.
+
+Learn templates from the recorded outputs of the bundled invoices with:
+    python -m core.invoice_templates --output data/invoice_templates.sqlite
+"""
+import argparse
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from datetime import date
+from pathlib import Path
+from statistics import median
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.metadata_schemas import InvoiceMetadata
+
+# Label words that usually precede an invoice total or due date (lowercase substrings)
+TOTAL_LABELS = ("total", "totaal", "amount due", "balance", "betalen", "gesamt", "summe", "montant")
+DUE_LABELS = ("due", "verval", "fällig", "faellig", "payment", "betaal", "pay by")
+
+MONTHS = {
+    "jan": 1, "january": 1, "januari": 1, "januar": 1, "janvier": 1,
+    "feb": 2, "february": 2, "februari": 2, "februar": 2, "février": 2,
+    "mar": 3, "march": 3, "maart": 3, "mrt": 3, "märz": 3, "maerz": 3, "mars": 3,
+    "apr": 4, "april": 4, "avril": 4,
+    "may": 5, "mei": 5, "mai": 5,
+    "jun": 6, "june": 6, "juni": 6, "juin": 6,
+    "jul": 7, "july": 7, "juli": 7, "juillet": 7,
+    "aug": 8, "august": 8, "augustus": 8, "août": 8,
+    "sep": 9, "sept": 9, "september": 9, "septembre": 9,
+    "oct": 10, "october": 10, "oktober": 10, "okt": 10, "octobre": 10,
+    "nov": 11, "november": 11, "novembre": 11,
+    "dec": 12, "december": 12, "dezember": 12, "dez": 12, "décembre": 12,
+}
+NUMERIC_DATE = re.compile(r"(\d{1,4})[./-](\d{1,2})[./-](\d{2,4})")
+TEXT_DATE = re.compile(r"(\d{1,2})\.?\s*[-\s]?([^\W\d_]+)\.?[-\s,]*(\d{4})|([^\W\d_]+)\.?\s+(\d{1,2})\s*,?\s+(\d{4})")
+
+# Points: word positions are matched within these distances of their learned position
+LINE_TOLERANCE = 3.0
+COLUMN_TOLERANCE = 12.0
+
+
+def parse_number(token: str, decimal: str = ".") -> Optional[float]:
+    """Parse an amount such as "€ 4.904,94" (decimal=",") or "$1,234.56" (decimal=".")."""
+    text = re.sub(r"^(EUR|USD|GBP)|[€$£\s]", "", token.strip(), flags=re.IGNORECASE)
+    if not re.fullmatch(r"-?[\d.,]*\d", text):
+        return None
+    text = text.replace("," if decimal == "." else ".", "")
+    if text.count(decimal) > 1:
+        return None
+    try:
+        return float(text.replace(decimal, "."))
+    except ValueError:
+        return None
+
+
+def decimal_separator(words: List[dict]) -> str:
+    """"," if the page writes amounts like 399,00, else "."."""
+    comma = sum(bool(re.search(r"\d,\d{2}$", w["text"])) for w in words)
+    dot = sum(bool(re.search(r"\d\.\d{2}$", w["text"])) for w in words)
+    return "," if comma > dot else "."
+
+
+def parse_date(text: str, order: Optional[str] = None) -> List[Tuple[str, str]]:
+    """
+    ISO dates the text can stand for, as (YYYY-MM-DD, order) pairs, where order is "ymd",
+    "dmy", "mdy" (numeric dates) or "text" (month names). Pass `order` to keep one reading.
+    """
+    readings = []
+    text = text.strip().lower()
+    match = NUMERIC_DATE.fullmatch(text)
+    if match:
+        a, b, c = match.groups()
+        if len(a) == 4:
+            candidates = [("ymd", int(a), int(b), int(c))]
+        else:
+            year = int(c) + 2000 if len(c) == 2 else int(c)
+            candidates = [("dmy", year, int(b), int(a)), ("mdy", year, int(a), int(b))]
+    else:
+        match = TEXT_DATE.fullmatch(text)
+        if not match:
+            return []
+        if match.group(1):
+            day, month, year = match.group(1), match.group(2), match.group(3)
+        else:
+            month, day, year = match.group(4), match.group(5), match.group(6)
+        if month not in MONTHS:
+            return []
+        candidates = [("text", int(year), MONTHS[month], int(day))]
+    for reading, year, month, day in candidates:
+        if order is not None and reading != order:
+            continue
+        try:
+            readings.append((date(year, month, day).isoformat(), reading))
+        except ValueError:
+            continue
+    return readings
+
+
+def page_lines(words: List[dict]) -> List[List[dict]]:
+    """Words grouped into lines (similar `top`), each sorted left to right."""
+    lines: List[List[dict]] = []
+    for word in sorted(words, key=lambda w: (w["top"], w["x0"])):
+        if lines and abs(lines[-1][0]["top"] - word["top"]) <= LINE_TOLERANCE:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+    return [sorted(line, key=lambda w: w["x0"]) for line in lines]
+
+
+def layout_anchors(words: List[dict]) -> List[str]:
+    """Positioned words of the header and footer zones, the template fingerprint."""
+    if not words:
+        return []
+    first, last = min(w["top"] for w in words), max(w["top"] for w in words)
+    height = max(last - first, 1.0)
+    return sorted({f"{w['text'].lower()}@{round(w['x0'] / 10)},{round(w['top'] / 10)}" for w in words
+                   if w["text"].isalpha() and len(w["text"]) >= 3
+                   and (w["top"] - first < 0.3 * height or last - w["top"] < 0.3 * height)})
+
+
+def _has_letters(word: dict) -> bool:
+    return any(c.isalpha() for c in word["text"])
+
+
+def _label_left(line: List[dict], word: dict) -> Optional[dict]:
+    """Nearest word with letters left of `word` on its line."""
+    left = [w for w in line if w["x1"] <= word["x0"] + 0.5 and _has_letters(w)]
+    return left[-1] if left else None
+
+
+def _label_above(words: List[dict], word: dict) -> Optional[dict]:
+    """Nearest word with letters above `word` in its column (labels of stacked fields)."""
+    above = [w for w in words if w["bottom"] <= word["top"] + 0.5 and _has_letters(w)
+             and w["x0"] < word["x1"] and word["x0"] < w["x1"]]
+    return max(above, key=lambda w: w["top"], default=None)
+
+
+def _anchor_rule(label: dict, value: dict, ref: str) -> dict:
+    return {"label": label["text"], "x": label["x0"], "top": label["top"],
+            "dx": value[ref] - label["x0"], "dy": value["top"] - label["top"], "ref": ref}
+
+
+def _find_label(words: List[dict], text: str, x: float, top: float, below: float = -1.0) -> Optional[dict]:
+    candidates = [w for w in words if w["text"] == text and w["top"] > below]
+    return min(candidates, key=lambda w: abs(w["x0"] - x) + abs(w["top"] - top), default=None)
+
+
+def _at_offset(words: List[dict], rule: dict) -> List[dict]:
+    """Words at the rule's offset from its label, closest first ([] if the label is missing)."""
+    label = _find_label(words, rule["label"], rule["x"], rule["top"])
+    if label is None:
+        return []
+    top, ref = label["top"] + rule["dy"], label["x0"] + rule["dx"]
+    return sorted((w for w in words if abs(w["top"] - top) <= LINE_TOLERANCE
+                   and abs(w[rule["ref"]] - ref) <= COLUMN_TOLERANCE), key=lambda w: abs(w[rule["ref"]] - ref))
+
+
+def _line_after(words: List[dict], word: dict) -> List[dict]:
+    line = next(line for line in page_lines(words) if word in line)
+    return [w for w in line if w["x0"] >= word["x0"]]
+
+
+def _learn_amount(lines: List[List[dict]], amount: float, decimal: str) -> Optional[dict]:
+    candidates = []
+    for line in lines:
+        for word in line:
+            value = parse_number(word["text"], decimal)
+            label = _label_left(line, word)
+            if value is not None and abs(value - amount) < 0.005 and label is not None:
+                is_total = any(key in label["text"].lower() for key in TOTAL_LABELS)
+                candidates.append((is_total, word["top"], label, word))
+    if not candidates:
+        return None
+    # A "Total"-like label first, then the lowest occurrence on the page
+    _, _, label, word = max(candidates, key=lambda c: (c[0], c[1]))
+    return _anchor_rule(label, word, "x1")
+
+
+def _learn_date(lines: List[List[dict]], value: str) -> Optional[dict]:
+    words, candidates = [w for line in lines for w in line], []
+    for line in lines:
+        for i, word in enumerate(line):
+            for n in (1, 2, 3, 4):
+                if i + n > len(line):
+                    break
+                text = " ".join(w["text"] for w in line[i:i + n])
+                for iso, order in parse_date(text):
+                    label = _label_left(line, word) or _label_above(words, word)
+                    if iso == value and label is not None:
+                        is_due = any(key in " ".join(w["text"] for w in line[:i]).lower() for key in DUE_LABELS)
+                        candidates.append((is_due, -word["top"], label, word, n, order))
+    if not candidates:
+        return None
+    _, _, label, word, n, order = max(candidates, key=lambda c: (c[0], c[1]))
+    return {**_anchor_rule(label, word, "x0"), "words": n, "order": order}
+
+
+def _learn_line_items(lines: List[List[dict]], items: List[dict], decimal: str) -> Optional[dict]:
+    rows, used = [], set()
+    for item in items:
+        description = {t.lower() for t in item.get("description", "").split()}
+        found = None
+        for index, line in enumerate(lines):
+            if index in used or not description & {w["text"].lower() for w in line}:
+                continue
+            amounts = [w for w in line if parse_number(w["text"], decimal) is not None
+                       and abs(parse_number(w["text"], decimal) - item["amount"]) < 0.005]
+            if amounts:
+                found = (index, line, amounts[-1], description)
+                break
+        if found is None:
+            return None
+        used.add(found[0])
+        rows.append(found)
+
+    amount_x1 = median(amount["x1"] for _, _, amount, _ in rows)
+    quantities = []
+    for _, line, amount, description in rows:
+        # Quantity: the rightmost whole number between the description and the amount
+        end = max((w["x1"] for w in line if w["text"].lower() in description), default=line[0]["x1"])
+        numbers = [w for w in line if end < w["x0"] and w["x1"] < amount["x0"]
+                   and (parse_number(w["text"], decimal) or 0.5).is_integer()]
+        if numbers:
+            quantities.append(numbers[-1])
+    # Description: the words left of the quantity column, else of the first word after it
+    ends = [w["x0"] for w in quantities]
+    for _, line, amount, description in rows if not ends else []:
+        end = max((w["x1"] for w in line if w["text"].lower() in description), default=line[0]["x1"])
+        ends.append(min((w["x0"] for w in line if w["x0"] > end), default=amount["x0"]))
+
+    first, last = min(index for index, _, _, _ in rows), max(index for index, _, _, _ in rows)
+    header = lines[first - 1][0] if first > 0 else None
+    footer = lines[last + 1][0] if last + 1 < len(lines) else None
+    return {
+        "amount_x1": amount_x1,
+        "quantity_x1": median(w["x1"] for w in quantities) if len(quantities) * 2 >= len(rows) else None,
+        # Where item rows start (sub-rows such as per-item taxes are usually indented differently)
+        "row_starts": sorted({round(line[0]["x0"], 1) for _, line, _, _ in rows}),
+        "description_end": min(ends) - 1,
+        "header": {"label": header["text"], "x": header["x0"], "top": header["top"]} if header else None,
+        "footer": {"label": footer["text"], "x": footer["x0"], "top": footer["top"]} if footer else None,
+    }
+
+
+def learn_rules(words: List[dict], metadata: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Rules that reproduce `metadata` from this page's words, or None if a field cannot be located."""
+    lines, decimal = page_lines(words), decimal_separator(words)
+    rules: Dict[str, Any] = {"decimal": decimal}
+
+    vendor = metadata.get("vendor")
+    page_words = {w["text"].lower() for w in words}
+    check = max((t for t in re.findall(r"[^\W\d_]{3,}", vendor or "") if t.lower() in page_words), key=len, default=None)
+    rules["vendor"] = {"value": vendor, "check": check} if vendor else None
+
+    amount = metadata.get("amount")
+    rules["amount"] = _learn_amount(lines, float(amount), decimal) if amount is not None else None
+    if amount is not None and rules["amount"] is None:
+        return None
+
+    due_date = metadata.get("due_date")
+    rules["due_date"] = _learn_date(lines, due_date) if due_date else None
+    if due_date and rules["due_date"] is None:
+        return None
+
+    items = [i for i in metadata.get("line_items") or [] if i.get("amount") is not None]
+    rules["line_items"] = _learn_line_items(lines, items, decimal) if items else None
+    if items and rules["line_items"] is None:
+        return None
+    rules["empty_line_items"] = [] if metadata.get("line_items") is not None else None
+    # Whether the items add up to the total on the learned invoice (checked on later ones)
+    rules["items_sum_to_total"] = bool(items and amount and abs(sum(i["amount"] for i in items) - amount) <= 0.05 * abs(amount))
+    return rules
+
+
+def _apply_line_items(words: List[dict], rule: dict, decimal: str, amount_top: Optional[float]) -> List[dict]:
+    header = _find_label(words, rule["header"]["label"], rule["header"]["x"], rule["header"]["top"]) if rule["header"] else None
+    start = header["top"] + LINE_TOLERANCE if header else -1.0
+    footer = (_find_label(words, rule["footer"]["label"], rule["footer"]["x"], rule["footer"]["top"], below=start)
+              if rule["footer"] else None)
+    end = footer["top"] - LINE_TOLERANCE if footer else (amount_top if amount_top is not None and amount_top > start else float("inf"))
+
+    items = []
+    for line in page_lines(words):
+        if not start < line[0]["top"] < end or \
+                not any(abs(line[0]["x0"] - x) <= LINE_TOLERANCE for x in rule["row_starts"]):
+            continue
+        amount = next((w for w in reversed(line) if abs(w["x1"] - rule["amount_x1"]) <= COLUMN_TOLERANCE
+                       and parse_number(w["text"], decimal) is not None), None)
+        description = " ".join(w["text"] for w in line if w["x1"] <= rule["description_end"])
+        if amount is None or not description:
+            continue
+        quantity = None
+        if rule["quantity_x1"] is not None:
+            word = next((w for w in line if abs(w["x1"] - rule["quantity_x1"]) <= COLUMN_TOLERANCE), None)
+            quantity = parse_number(word["text"], decimal) if word is not None else None
+            if quantity is not None and quantity.is_integer():
+                quantity = int(quantity)
+        items.append({"description": description, "quantity": quantity, "amount": parse_number(amount["text"], decimal)})
+    return items
+
+
+def apply_rules(rules: Dict[str, Any], words: List[dict]) -> Optional[InvoiceMetadata]:
+    """Extract the invoice metadata with learned rules, or None if validation fails."""
+    decimal = rules["decimal"]
+    vendor = rules["vendor"]
+    if vendor and vendor["check"] and vendor["check"].lower() not in {w["text"].lower() for w in words}:
+        return None
+
+    amount, amount_top = None, None
+    if rules["amount"]:
+        values = [(parse_number(w["text"], decimal), w["top"]) for w in _at_offset(words, rules["amount"])]
+        values = [(value, top) for value, top in values if value is not None]
+        if not values:
+            return None
+        amount, amount_top = values[0]
+
+    due_date = None
+    if rules["due_date"]:
+        start = _at_offset(words, rules["due_date"])
+        if not start:
+            return None
+        span = _line_after(words, start[0])[:rules["due_date"]["words"]]
+        readings = parse_date(" ".join(w["text"] for w in span), rules["due_date"]["order"])
+        if not readings:
+            return None
+        due_date = readings[0][0]
+
+    line_items = rules["empty_line_items"]
+    if rules["line_items"]:
+        line_items = _apply_line_items(words, rules["line_items"], decimal, amount_top)
+        if not line_items:
+            return None
+        if rules["items_sum_to_total"] and amount is not None and \
+                abs(sum(i["amount"] for i in line_items) - amount) > 0.05 * abs(amount):
+            return None
+    try:
+        return InvoiceMetadata(vendor=vendor["value"] if vendor else None, amount=amount,
+                               due_date=due_date, line_items=line_items)
+    except ValueError:
+        return None
+
+
+def agrees(predicted: Optional[InvoiceMetadata], metadata: Dict[str, Any]) -> bool:
+    """Whether a template's output matches an extraction on vendor, total, due date and item amounts."""
+    if predicted is None:
+        return False
+    normalise = lambda value: " ".join(str(value or "").lower().split())
+    amounts = lambda items: sorted(round(float(i["amount"]), 2) for i in items or [] if i.get("amount") is not None)
+    predicted = predicted.model_dump()
+    return (normalise(predicted["vendor"]) == normalise(metadata.get("vendor"))
+            and (predicted["amount"] is None) == (metadata.get("amount") is None)
+            and (predicted["amount"] is None or abs(predicted["amount"] - float(metadata["amount"])) < 0.005)
+            and predicted["due_date"] == metadata.get("due_date")
+            and amounts(predicted["line_items"]) == amounts(metadata.get("line_items")))
+
+
+def _merge_row_starts(old: Dict[str, Any], new: Dict[str, Any], words: List[dict], metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Relearned rules that also accept the item rows of the old rules (rows start at slightly
+    different indents from one invoice of a layout to the next), if they still reproduce `metadata`.
+    """
+    if not old.get("line_items") or not new.get("line_items") or \
+            abs(old["line_items"]["amount_x1"] - new["line_items"]["amount_x1"]) > COLUMN_TOLERANCE:
+        return new
+    row_starts = sorted(set(old["line_items"]["row_starts"]) | set(new["line_items"]["row_starts"]))
+    merged = {**new, "line_items": {**new["line_items"], "row_starts": row_starts}}
+    return merged if agrees(apply_rules(merged, words), metadata) else new
+
+
+class InvoiceTemplateStore:
+    """
+    Learned invoice templates in a local SQLite file (shared by every uvicorn worker process),
+    with an in-memory copy that is reloaded when another connection changes the file.
+    """
+
+    def __init__(self, path: str = "data/invoice_templates.sqlite", min_confirmations: int = 1,
+                 similarity: float = 0.5):
+        self.path = path
+        self.min_confirmations = min_confirmations
+        self.similarity = similarity
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS templates (id TEXT PRIMARY KEY, anchors TEXT NOT NULL, rules TEXT NOT NULL, "
+            "status TEXT NOT NULL, confirmations INTEGER NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._templates: Dict[str, Dict[str, Any]] = {}
+        self._data_version = None
+        self.hits = 0
+        self.fallbacks = 0
+
+    def _refresh(self):
+        # Caller holds the lock; data_version changes when another connection commits
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return
+        self._data_version = version
+        self._templates = {
+            id: {"id": id, "anchors": set(json.loads(anchors)), "rules": json.loads(rules),
+                 "status": status, "confirmations": confirmations}
+            for id, anchors, rules, status, confirmations in self._conn.execute(
+                "SELECT id, anchors, rules, status, confirmations FROM templates")
+        }
+
+    def _save(self, template: Dict[str, Any]):
+        # Caller holds the lock
+        self._conn.execute(
+            "INSERT OR REPLACE INTO templates (id, anchors, rules, status, confirmations, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (template["id"], json.dumps(sorted(template["anchors"])), json.dumps(template["rules"]),
+             template["status"], template["confirmations"], time.time()))
+        self._conn.commit()
+        self._templates[template["id"]] = template
+        self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def match(self, words: List[dict]) -> Optional[Dict[str, Any]]:
+        """The template whose fingerprint overlaps the page's the most, if it reaches `similarity`."""
+        anchors = set(layout_anchors(words))
+        if not anchors:
+            return None
+        with self._lock:
+            self._refresh()
+            best, best_score = None, self.similarity
+            for template in self._templates.values():
+                score = len(anchors & template["anchors"]) / len(anchors | template["anchors"])
+                if score >= best_score:
+                    best, best_score = template, score
+            return best
+
+    def extract(self, words: List[dict], template: Optional[Dict[str, Any]] = None) -> Optional[InvoiceMetadata]:
+        """
+        Metadata from the matching active template (or the given one, from `match`), or None
+        if there is none or its validation failed.
+        """
+        template = template or self.match(words)
+        if template is None or template["status"] != "active":
+            return None
+        metadata = apply_rules(template["rules"], words)
+        with self._lock:
+            if metadata is None:
+                self.fallbacks += 1
+            else:
+                self.hits += 1
+        return metadata
+
+    def observe(self, words: List[dict], metadata: Dict[str, Any], confirmed: bool = False) -> str:
+        """
+        Learn from an extraction of this page: confirm the matching template if its rules
+        agree, else (re)learn the rules from it as a candidate (active right away when the
+        metadata is `confirmed`).
+
+        Returns:
+            str: "confirmed", "activated", "learned", "relearned" or "unlearnable".
+        """
+        template = self.match(words)
+        if template is not None and agrees(apply_rules(template["rules"], words), metadata):
+            confirmations = template["confirmations"] + 1
+            active = confirmed or confirmations >= self.min_confirmations
+            if template["status"] == "active" and confirmations > self.min_confirmations:
+                return "confirmed"
+            with self._lock:
+                self._save({**template, "confirmations": confirmations,
+                            "status": "active" if active else template["status"]})
+            return "activated" if active and template["status"] != "active" else "confirmed"
+
+        rules = learn_rules(words, metadata)
+        if rules is None or not agrees(apply_rules(rules, words), metadata):
+            return "unlearnable"
+        if template is not None:
+            rules = _merge_row_starts(template["rules"], rules, words, metadata)
+        anchors = set(layout_anchors(words))
+        id = template["id"] if template is not None else hashlib.sha256(
+            json.dumps(sorted(anchors)).encode("utf-8")).hexdigest()[:16]
+        status = "active" if confirmed or self.min_confirmations == 0 else "candidate"
+        with self._lock:
+            self._save({"id": id, "anchors": anchors, "rules": rules, "status": status, "confirmations": 0})
+        return "learned" if template is None else "relearned"
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refresh()
+            statuses = [t["status"] for t in self._templates.values()]
+            return {"templates": len(statuses), "active": statuses.count("active"),
+                    "hits": self.hits, "fallbacks": self.fallbacks}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def learn_recorded(store: InvoiceTemplateStore, pdf_folder: str, output_folder: str) -> Dict[str, str]:
+    """
+    Learn templates from the recorded outputs (`output_folder/<name>.json`, as written by
+    `core.main`) of the invoices in `pdf_folder`, as confirmed metadata.
+
+    Returns:
+        Dict[str, str]: The `observe` event of every invoice PDF, by path.
+    """
+    from core.document_loader import open_pdf
+    events = {}
+    for path in sorted(Path(pdf_folder).glob("*")):
+        recorded = Path(output_folder) / f"{path.name.split('.')[0]}.json"
+        if path.suffix.lower() != ".pdf" or not recorded.exists():
+            continue
+        with open(recorded, "r", encoding="utf-8") as f:
+            record = json.load(f)
+        if record["classification"]["type"] != "Invoice":
+            continue
+        doc = open_pdf(str(path))
+        try:
+            _, words = doc.extract_layout(0)
+        finally:
+            doc.close()
+        events[str(path)] = store.observe(words, record["metadata"], confirmed=True)
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="data/invoice_templates.sqlite")
+    parser.add_argument("--input", nargs="+", default=["documents-extra/Invoice:output-extra/Invoice", "documents:output"],
+                        help="<pdf folder>:<recorded output folder> pairs")
+    args = parser.parse_args()
+
+    store = InvoiceTemplateStore(args.output)
+    for pair in args.input:
+        for path, event in learn_recorded(store, *pair.split(":")).items():
+            print(f"{path}: {event}")
+    print(store.stats())
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
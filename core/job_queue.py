@@ -0,0 +1,182 @@
+"""
+Bounded, in-process background job queue for document analysis.
+
+`JobQueue.submit` only records the job and returns its id; a fixed pool of asyncio worker
+tasks (`workers`) runs the handler. The queue is bounded (`max_queued` jobs waiting across
+all lanes) and `submit` raises `QueueFullError` beyond that, so callers can answer 429
+instead of piling up requests. Lanes are served by weighted round robin (by default 4
+interactive jobs for every bulk job), so bulk uploads cannot starve interactive ones and
+vice versa.
+
+Job status (queued / running / done / failed, per-stage timings) is written to a
+`DocumentStore`, so it can be read from any process sharing the store.
+"""
+import asyncio
+import itertools
+import math
+import time
+from collections import deque
+from dataclasses import dataclass, field, asdict
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+from uuid import uuid4
+
+LANE_WEIGHTS = {"interactive": 4, "bulk": 1}
+
+
+class QueueFullError(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Job queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+@dataclass
+class Job:
+    id: str
+    lane: str
+    payload: Any = field(repr=False)
+    status: str = "queued"
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    usage: Dict[str, float] = field(default_factory=dict)
+    document_id: Optional[str] = None
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data.pop("payload")
+        return data
+
+
+class JobQueue:
+    def __init__(self, handler: Callable[[Any, Dict[str, float], Dict[str, float]], Awaitable[str]], workers: int = 4,
+                 max_queued: int = 1000, lane_weights: Optional[Dict[str, int]] = None, store=None,
+                 max_finished: int = 10000, discard: Optional[Callable[[Any], Any]] = None):
+        """
+        Args:
+            handler: `await handler(payload, timings, usage)` runs one job, records the seconds
+                     spent in each stage into `timings` and its LLM tokens / cost into `usage`,
+                     and returns the id of the stored document.
+            workers: Number of jobs processed concurrently.
+            max_queued: Maximum number of waiting jobs (running jobs do not count).
+            lane_weights: Lane name -> share of the workers' picks (see `LANE_WEIGHTS`).
+            store: Optional `DocumentStore` that persists job status for other processes.
+            max_finished: Without a store, how many finished jobs are kept for status queries.
+            discard: Called with the payload of each job dropped at shutdown, e.g. to delete its upload.
+        """
+        self.handler = handler
+        self.workers = workers
+        self.max_queued = max_queued
+        self.lane_weights = dict(lane_weights or LANE_WEIGHTS)
+        self.store = store
+        self._lanes: Dict[str, Deque[Job]] = {lane: deque() for lane in self.lane_weights}
+        # Weighted round robin: e.g. interactive x4, bulk x1, repeated
+        self._schedule = itertools.cycle([lane for lane, w in self.lane_weights.items() for _ in range(w)])
+        self._available = asyncio.Semaphore(0)
+        self._jobs: Dict[str, Job] = {}
+        self._tasks: List[asyncio.Task] = []
+        self.max_finished = max_finished
+        self.discard = discard
+        self._finished: Deque[str] = deque()
+        self._durations: Deque[float] = deque(maxlen=100)
+        self.running = 0
+
+    def start(self):
+        """Start the worker tasks (must be called from a running event loop)."""
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Jobs that never started are dropped with the process
+        for lane in self._lanes.values():
+            while lane:
+                job = lane.popleft()
+                job.status, job.error = "failed", "Server shut down before the job started"
+                if self.discard is not None:
+                    await asyncio.to_thread(self.discard, job.payload)
+                await self._save(job)
+
+    def queued(self) -> int:
+        return sum(len(lane) for lane in self._lanes.values())
+
+    def retry_after(self) -> int:
+        """Seconds until a queue slot is likely to free up, from recent job durations."""
+        mean = sum(self._durations) / len(self._durations) if self._durations else 1.0
+        # The workers together finish a job every mean / workers seconds
+        return max(1, math.ceil(mean / self.workers))
+
+    async def submit(self, payload: Any, lane: str = "interactive") -> Job:
+        if lane not in self._lanes:
+            raise ValueError(f"Unknown lane: {lane}. Expected one of {list(self._lanes)}")
+        if self.queued() >= self.max_queued:
+            raise QueueFullError(self.retry_after())
+        job = Job(id=str(uuid4()), lane=lane, payload=payload)
+        self._jobs[job.id] = job
+        self._lanes[lane].append(job)
+        self._available.release()
+        await self._save(job)
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if self.store is not None:
+            return await asyncio.to_thread(self.store.get_job, job_id)
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "queued": {lane: len(jobs) for lane, jobs in self._lanes.items()},
+            "max_queued": self.max_queued,
+        }
+
+    def _next_job(self) -> Job:
+        # Called once per release of `_available`, so at least one lane is non-empty
+        while True:
+            lane = self._lanes[next(self._schedule)]
+            if lane:
+                return lane.popleft()
+
+    async def _save(self, job: Job):
+        if self.store is not None:
+            await asyncio.to_thread(self.store.put_job, job.to_dict())
+
+    async def _worker(self):
+        while True:
+            await self._available.acquire()
+            job = self._next_job()
+            job.status, job.started_at = "running", time.time()
+            job.timings["queued"] = job.started_at - job.submitted_at
+            self.running += 1
+            await self._save(job)
+            try:
+                job.document_id = await self.handler(job.payload, job.timings, job.usage)
+                job.status = "done"
+            except asyncio.CancelledError:
+                job.status, job.error = "failed", "Server shut down while the job was running"
+                raise
+            except Exception as e:
+                job.status, job.error = "failed", str(e)
+            finally:
+                job.finished_at = time.time()
+                self._durations.append(job.finished_at - job.started_at)
+                self.running -= 1
+                await asyncio.shield(self._save(job))
+                self._forget(job)
+
+    def _forget(self, job: Job):
+        # With a store, finished jobs are read from it; without one, keep the most recent ones
+        if self.store is not None:
+            self._jobs.pop(job.id, None)
+            return
+        self._finished.append(job.id)
+        while len(self._finished) > self.max_finished:
+            self._jobs.pop(self._finished.popleft(), None)
@@ -0,0 +1,339 @@
+"""
+Shared HTTP transport of the LLM calls: one connection pool, a global concurrency cap, an
+adaptive rate limiter and retries.
+
+Every runnable of a pipeline (classifier, extractors, fused analyzer) sends its requests
+through the same `LLMTransport`, whether it uses the OpenAI SDK or langchain, sync or async:
+
+- Pooling: one sync and one async httpx client with keep-alive connections, instead of a
+  client (and pool) per runnable.
+- Concurrency: at most `max_concurrency` requests in flight; a request holds its slot until
+  its response is read or closed, so streamed answers count too.
+- Rate limit: an `AdaptiveRateLimiter` (requests and tokens per minute) that follows the
+  API's rate-limit headers, so traffic stays just below the quota.
+- Retries: 408, 409, 429, 5xx, timeouts and connection errors are retried up to
+  `max_attempts` times, after the server's `Retry-After` when it sends one, else after a
+  full-jitter exponential backoff. A 429 pauses the limiter, so every caller waits for the
+  quota instead of only the one that was refused.
+
+The SDK clients are created with `max_retries=0`: retries happen here only, once per request.
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional
+
+import httpx
+
+from core.metrics import LLM_HTTP_REQUESTS, LLM_HTTP_RETRIES, LLM_IN_FLIGHT, LLM_RATE_LIMIT_WAIT
+from core.rate_limit import AdaptiveRateLimiter
+
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+RETRY_ERRORS = (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)
+# Completion length assumed for requests that do not set one
+DEFAULT_COMPLETION_TOKENS = 1000
+
+
+def estimate_request_tokens(request: httpx.Request) -> int:
+    """Tokens a chat completion request counts against the quota: ~4 characters per prompt token plus its max completion."""
+    try:
+        body = json.loads(request.content)
+    except (ValueError, httpx.RequestNotRead):
+        return DEFAULT_COMPLETION_TOKENS
+    prompt_chars = sum(len(str(m.get("content", ""))) for m in body.get("messages", []))
+    completion = body.get("max_completion_tokens") or body.get("max_tokens") or DEFAULT_COMPLETION_TOKENS
+    return prompt_chars // 4 + completion
+
+
+def retry_after(headers: httpx.Headers) -> Optional[float]:
+    """Seconds to wait from `retry-after-ms` or `retry-after` (seconds or an HTTP date), if sent."""
+    if "retry-after-ms" in headers:
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _Slots:
+    """
+    Counting semaphore usable from threads and from any event loop. Slots are handed to
+    waiters in arrival order.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.used = 0
+        self._waiters: deque = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.used < self.size and not self._waiters:
+                self.used += 1
+                return
+            event = threading.Event()
+            self._waiters.append(event.set)
+        event.wait()
+
+    async def aacquire(self):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(self._hand_over, future)
+
+        with self._lock:
+            if self.used < self.size and not self._waiters:
+                self.used += 1
+                return
+            self._waiters.append(wake)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if wake in self._waiters:
+                    self._waiters.remove(wake)
+            # Otherwise the slot was already handed over: `_hand_over` gives it back
+            raise
+
+    def _hand_over(self, future: asyncio.Future):
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                # The slot goes straight to the next waiter
+                self._waiters.popleft()()
+            else:
+                self.used -= 1
+
+
+class _SlotStream(httpx.SyncByteStream):
+    """Response body that gives the concurrency slot back when it is closed."""
+
+    def __init__(self, stream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if self._release is not None:
+                self._release()
+                self._release = None
+
+
+class _AsyncSlotStream(httpx.AsyncByteStream):
+    def __init__(self, stream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._release is not None:
+                self._release()
+                self._release = None
+
+
+class _Transport(httpx.BaseTransport):
+    def __init__(self, owner: "LLMTransport", transport: httpx.BaseTransport):
+        self.owner = owner
+        self.transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        return self.owner._send(request, self.transport)
+
+    def close(self):
+        self.transport.close()
+
+
+class _AsyncTransport(httpx.AsyncBaseTransport):
+    def __init__(self, owner: "LLMTransport", transport: httpx.AsyncBaseTransport):
+        self.owner = owner
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self.owner._asend(request, self.transport)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class LLMTransport:
+    def __init__(self, max_concurrency: int = 64, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None, headroom: float = 0.95, adaptive: bool = True,
+                 max_attempts: int = 6, backoff_base: float = 0.5, backoff_max: float = 20.0,
+                 max_retry_after: float = 60.0, timeout: float = 120.0):
+        """
+        Args:
+            max_concurrency: Requests in flight at most (also the size of the connection pool).
+            requests_per_minute / tokens_per_minute: Budgets to start from (None: unlimited
+                                                     until the API reports its quota).
+            headroom: Fraction of the API-reported quota the budgets are sized at.
+            adaptive: Follow the API's rate-limit headers.
+            max_attempts: Attempts per request, the first one included.
+            backoff_base / backoff_max: Exponential backoff of retries without `Retry-After`:
+                                        a random delay up to min(backoff_max, backoff_base * 2**retry).
+            max_retry_after: A `Retry-After` longer than this is not waited for: the response
+                             (e.g. an exhausted daily quota) is returned to the caller.
+            timeout: Seconds per attempt.
+        """
+        self.max_concurrency = max_concurrency
+        self.limiter = AdaptiveRateLimiter(requests_per_minute, tokens_per_minute, headroom, adaptive)
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self._slots = _Slots(max_concurrency)
+        limits = httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency,
+                              keepalive_expiry=60)
+        timeout = httpx.Timeout(timeout, connect=10.0)
+        self.http_client = httpx.Client(
+            transport=_Transport(self, httpx.HTTPTransport(limits=limits)), timeout=timeout)
+        self.http_async_client = httpx.AsyncClient(
+            transport=_AsyncTransport(self, httpx.AsyncHTTPTransport(limits=limits)), timeout=timeout)
+        self._client = None
+        self._async_client = None
+
+    @property
+    def client(self):
+        """OpenAI SDK client on the shared pool."""
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(http_client=self.http_client, max_retries=0)
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            from openai import AsyncOpenAI
+            self._async_client = AsyncOpenAI(http_client=self.http_async_client, max_retries=0)
+        return self._async_client
+
+    def _backoff(self, retry: int) -> float:
+        # Full jitter: retries of requests that failed together spread out instead of colliding again
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** retry))
+
+    def _retry_delay(self, response: httpx.Response, attempt: int) -> Optional[float]:
+        """Seconds before retrying a response, or None to return it."""
+        if response.status_code not in RETRY_STATUSES or attempt + 1 >= self.max_attempts:
+            return None
+        delay = retry_after(response.headers)
+        if delay is None:
+            delay = self._backoff(attempt)
+        elif delay > self.max_retry_after:
+            return None
+        if response.status_code == 429:
+            self.limiter.pause(delay)
+        return delay
+
+    def _track(self, response: httpx.Response):
+        LLM_HTTP_REQUESTS.inc(status=str(response.status_code))
+        self.limiter.observe(response.headers)
+
+    def _released(self):
+        LLM_IN_FLIGHT.dec()
+        self._slots.release()
+
+    def _send(self, request: httpx.Request, transport: httpx.BaseTransport) -> httpx.Response:
+        tokens = estimate_request_tokens(request)
+        for attempt in range(self.max_attempts):
+            wait = self.limiter.reserve(tokens)
+            LLM_RATE_LIMIT_WAIT.observe(wait)
+            time.sleep(wait)
+            self._slots.acquire()
+            LLM_IN_FLIGHT.inc()
+            try:
+                response = transport.handle_request(request)
+            except RETRY_ERRORS as e:
+                self._released()
+                if attempt + 1 >= self.max_attempts:
+                    raise
+                LLM_HTTP_RETRIES.inc(reason="timeout" if isinstance(e, httpx.TimeoutException) else "connection")
+                time.sleep(self._backoff(attempt))
+                continue
+            except BaseException:
+                self._released()
+                raise
+            self._track(response)
+            delay = self._retry_delay(response, attempt)
+            if delay is None:
+                response.stream = _SlotStream(response.stream, self._released)
+                return response
+            response.close()
+            self._released()
+            LLM_HTTP_RETRIES.inc(reason=str(response.status_code))
+            # After a 429 the limiter makes every caller wait, this one included
+            if response.status_code != 429:
+                time.sleep(delay)
+
+    async def _asend(self, request: httpx.Request, transport: httpx.AsyncBaseTransport) -> httpx.Response:
+        tokens = estimate_request_tokens(request)
+        for attempt in range(self.max_attempts):
+            wait = self.limiter.reserve(tokens)
+            LLM_RATE_LIMIT_WAIT.observe(wait)
+            await asyncio.sleep(wait)
+            await self._slots.aacquire()
+            LLM_IN_FLIGHT.inc()
+            try:
+                response = await transport.handle_async_request(request)
+            except RETRY_ERRORS as e:
+                self._released()
+                if attempt + 1 >= self.max_attempts:
+                    raise
+                LLM_HTTP_RETRIES.inc(reason="timeout" if isinstance(e, httpx.TimeoutException) else "connection")
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            except BaseException:
+                self._released()
+                raise
+            self._track(response)
+            delay = self._retry_delay(response, attempt)
+            if delay is None:
+                response.stream = _AsyncSlotStream(response.stream, self._released)
+                return response
+            await response.aclose()
+            self._released()
+            LLM_HTTP_RETRIES.inc(reason=str(response.status_code))
+            if response.status_code != 429:
+                await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {"in_flight": self._slots.used, "max_concurrency": self.max_concurrency,
+                "budgets": {kind: bucket.capacity for kind, bucket in self.limiter.buckets.items()}}
+
+    def close(self):
+        self.http_client.close()
+
+    async def aclose(self):
+        """Close both connection pools (the async one on the event loop that used it)."""
+        self.http_client.close()
+        await self.http_async_client.aclose()
@@ -0,0 +1,158 @@
+"""
+Local fast-path document classifier.
+
+`LocalNgramClassifier` is a multinomial logistic regression over hashed word uni/bi-gram
+features of the first pages of a document. It answers in about a millisecond with the same
+{"type", "confidence"} output as `RunnableGPTLogprobClassifier`, so the pipeline can skip
+the GPT call whenever the local confidence is above a threshold.
+
+Train it on the bundled, labelled corpus with:
+    python -m core.local_classifier --output models/local_classifier.npz
+"""
+import argparse
+import json
+import re
+import zlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from langchain_core.runnables import Runnable
+
+TOKEN_PATTERN = re.compile(r"[a-z][a-z0-9]+")
+
+# documents-extra/ sub-folders and the label they hold
+FOLDER_LABELS = {
+    "Invoice": "Invoice",
+    "Contract": "Contract",
+    "Earning Report": "Earnings",
+}
+
+
+class LocalNgramClassifier(Runnable):
+    def __init__(self, labels: List[str], n_features: int = 2 ** 14, max_pages: int = 3,
+                 max_chars: Optional[int] = 5500):
+        self.labels = list(labels)
+        self.n_features = n_features
+        self.max_pages = max_pages
+        self.max_chars = max_chars
+        self.weights = np.zeros((n_features, len(self.labels)))
+        self.bias = np.zeros(len(self.labels))
+
+    def featurize(self, pages: List[Dict[str, Any]]) -> np.ndarray:
+        """Hashed, log-scaled, L2-normalised word unigram + bigram counts."""
+        if self.max_pages is not None:
+            pages = pages[:self.max_pages]
+        text = "\n\n".join(p["text"] for p in pages)
+        if self.max_chars is not None:
+            text = text[:self.max_chars]
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+        features = np.zeros(self.n_features)
+        for gram in grams:
+            # crc32 is stable across processes, unlike hash()
+            features[zlib.crc32(gram.encode("utf-8")) % self.n_features] += 1
+        features = np.log1p(features)
+        norm = np.linalg.norm(features)
+        return features / norm if norm else features
+
+    def _probabilities(self, X: np.ndarray) -> np.ndarray:
+        logits = X @ self.weights + self.bias
+        exp_logits = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return exp_logits / exp_logits.sum(axis=1, keepdims=True)
+
+    def fit(self, documents: List[List[Dict[str, Any]]], labels: List[str],
+            epochs: int = 300, learning_rate: float = 2.0, l2: float = 1e-3) -> "LocalNgramClassifier":
+        """Full-batch gradient descent on the L2-regularised cross-entropy."""
+        X = np.stack([self.featurize(pages) for pages in documents])
+        y = np.zeros((len(labels), len(self.labels)))
+        y[np.arange(len(labels)), [self.labels.index(label) for label in labels]] = 1.0
+
+        self.weights = np.zeros((self.n_features, len(self.labels)))
+        self.bias = np.zeros(len(self.labels))
+        for _ in range(epochs):
+            error = (self._probabilities(X) - y) / len(labels)
+            self.weights -= learning_rate * (X.T @ error + l2 * self.weights)
+            self.bias -= learning_rate * error.sum(axis=0)
+        return self
+
+    def predict_proba(self, pages: List[Dict[str, Any]]) -> Dict[str, float]:
+        probs = self._probabilities(self.featurize(pages)[None, :])[0]
+        return dict(zip(self.labels, map(float, probs)))
+
+    def invoke(self, input: List[Dict[str, Any]], config=None, **kwargs) -> Dict[str, Any]:
+        probs = self.predict_proba(input)
+        top_label = max(probs, key=probs.get)
+        return {
+            "type": top_label,
+            "confidence": probs[top_label],
+        }
+
+    def save(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(
+            path, weights=self.weights, bias=self.bias, labels=np.array(self.labels),
+            config=np.array(json.dumps({"n_features": self.n_features, "max_pages": self.max_pages,
+                                        "max_chars": self.max_chars})),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "LocalNgramClassifier":
+        data = np.load(path)
+        config = json.loads(str(data["config"]))
+        model = cls(labels=[str(label) for label in data["labels"]], **config)
+        model.weights = data["weights"]
+        model.bias = data["bias"]
+        return model
+
+
+def load_labelled_corpus(repo_root: str = ".", max_pages: int = 3) -> List[Tuple[str, List[dict], str]]:
+    """
+    Return (key, pages, label) for every bundled PDF with a known label.
+
+    Labels come from the recorded pipeline output (`output-extra/all_results.json`,
+    `output/<name>.json`) when available, otherwise from the `documents-extra/` folder name.
+    """
+    # Imported here so inference does not depend on the PDF stack
+    from core.document_loader import extract_pages
+
+    root = Path(repo_root)
+    all_results_path = root / "output-extra" / "all_results.json"
+    recorded = {}
+    if all_results_path.exists():
+        with open(all_results_path, "r", encoding="utf-8") as f:
+            recorded = {key: r["classification"]["type"] for key, r in json.load(f).items()}
+
+    corpus = []
+    for folder, folder_label in FOLDER_LABELS.items():
+        for path in sorted((root / "documents-extra" / folder).glob("*")):
+            if path.suffix.lower() != ".pdf":
+                continue
+            key = f"{folder}_{path.name.split('.')[0]}"
+            corpus.append((key, extract_pages(str(path), max_pages), recorded.get(key, folder_label)))
+
+    for path in sorted((root / "documents").glob("*")):
+        golden = root / "output" / f"{path.stem}.json"
+        if path.suffix.lower() == ".pdf" and golden.exists():
+            with open(golden, "r", encoding="utf-8") as f:
+                label = json.load(f)["classification"]["type"]
+            corpus.append((path.stem, extract_pages(str(path), max_pages), label))
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="models/local_classifier.npz")
+    parser.add_argument("--max-pages", type=int, default=3)
+    args = parser.parse_args()
+
+    from core.document_pipeline import LABEL_DESCRIPTIONS
+    corpus = load_labelled_corpus(max_pages=args.max_pages)
+    model = LocalNgramClassifier(labels=LABEL_DESCRIPTIONS.keys(), max_pages=args.max_pages)
+    model.fit([pages for _, pages, _ in corpus], [label for _, _, label in corpus])
+    model.save(args.output)
+    print(f"Trained on {len(corpus)} documents, saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
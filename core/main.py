@@ -1,62 +1,197 @@
+"""
+Batch runner: classify and extract metadata for every PDF under an input folder.
+
+Documents are processed concurrently (bounded by --concurrency) while LLM calls share one
+connection pool (at most --max-llm-concurrency in flight), stay within the --rpm / --tpm
+budgets (lowered to the API's reported quota) and are retried after 429s and server errors.
+Each finished document is appended as one line to a JSONL checkpoint, so an interrupted run
+resumes by skipping keys already in the checkpoint.
+
+Example (from the project root):
+    python -m core.main --input documents-extra --output output-extra --concurrency 16 --rpm 500 --tpm 200000
+"""
+import argparse
+import asyncio
 import json
 import os
+from pathlib import Path
+from typing import Dict, Iterator, Tuple
 from uuid import uuid4
-from core.document_pipeline import DocumentPipelineManager
+from core.document_pipeline import DocumentPipelineManager, parse_classification_windows
+from core.metrics import timed
+from core.llm_transport import LLMTransport
+from core.result_cache import ResultCache
+from core.local_classifier import LocalNgramClassifier
+from core.near_duplicates import NearDuplicateIndex
+from core.invoice_templates import InvoiceTemplateStore
+
+
+def iter_documents(input_folder: Path) -> Iterator[Tuple[str, Path]]:
+    """
+    Yield (key, path) for every PDF under `input_folder`. The key is the relative folder
+    path and the file name up to its first dot, joined by "_" (e.g. "Invoice_coolblue1").
+    """
+    for path in sorted(input_folder.rglob("*")):
+        if path.is_file() and path.suffix.lower() == ".pdf":
+            relative = path.relative_to(input_folder)
+            key = "_".join(relative.parent.parts + (relative.name.split(".")[0],))
+            yield key, path
+
+
+def load_checkpoint(checkpoint_path: Path) -> Dict[str, dict]:
+    """Return the latest checkpoint record per key (later lines override earlier ones)."""
+    records = {}
+    if checkpoint_path.exists():
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn final line from an interrupted run
+                    continue
+                records[record["key"]] = record
+    return records
+
+
+async def process_document(pipeline: DocumentPipelineManager, key: str, path: Path) -> dict:
+    timings, usage = {}, {}
+    with timed(timings, "load"):
+        pages = await pipeline.aload_document(str(path))
+    classification_result, metadata_result = await pipeline.aanalyze(pages, timings, usage)
+    return {
+        "key": key,
+        "path": str(path),
+        "status": "success",
+        "id": str(uuid4()),
+        "classification": classification_result,
+        "metadata": metadata_result.model_dump() if hasattr(metadata_result, "model_dump") else metadata_result,
+        "timings": timings,
+        "usage": usage,
+    }
+
+
+async def run_batch(args: argparse.Namespace):
+    input_folder = Path(args.input)
+    output_folder = Path(args.output)
+    output_folder.mkdir(parents=True, exist_ok=True)
+    checkpoint_path = Path(args.checkpoint) if args.checkpoint else output_folder / "results.jsonl"
+
+    # 👇 Resume: skip every document that already succeeded
+    done = {key for key, record in load_checkpoint(checkpoint_path).items() if record.get("status") == "success"}
+    todo = [(key, path) for key, path in iter_documents(input_folder) if key not in done]
+    print(f"{len(done)} documents already processed, {len(todo)} to go.")
+
+    pipeline = DocumentPipelineManager(
+        max_pages_classification=args.max_pages_classification,
+        max_pages_extraction=args.max_pages_extraction,
+        max_tokens_classification=args.max_tokens_classification,
+        max_tokens_extraction=args.max_tokens_extraction,
+        cache=ResultCache() if args.cache else None,
+        loader_workers=args.loader_workers,
+        pdf_backend=args.pdf_backend,
+        transport=LLMTransport(max_concurrency=args.max_llm_concurrency,
+                               requests_per_minute=args.rpm, tokens_per_minute=args.tpm),
+        local_classifier=LocalNgramClassifier.load(args.local_classifier) if args.local_classifier else None,
+        local_confidence_threshold=args.local_threshold,
+        fused=args.fused,
+        extraction_chunk_tokens=args.extraction_chunk_tokens,
+        near_duplicates=NearDuplicateIndex(args.near_duplicate_index) if args.near_duplicate_index else None,
+        invoice_templates=InvoiceTemplateStore(args.invoice_templates) if args.invoice_templates else None,
+        classification_windows=parse_classification_windows(args.classification_windows)
+        if args.classification_windows else None,
+        classification_min_margin=args.classification_min_margin,
+        structured_extraction=args.structured_extraction,
+    )
+    completed = 0
+
+    async def worker(queue: Iterator[Tuple[str, Path]], checkpoint):
+        nonlocal completed
+        # Workers share one iterator, so at most `concurrency` documents are in flight
+        for key, path in queue:
+            try:
+                record = await process_document(pipeline, key, path)
+            except Exception as e:
+                record = {"key": key, "path": str(path), "status": "error", "error": str(e)}
+
+            # 👇 Append-only checkpoint: one line per document, never rewritten
+            checkpoint.write(json.dumps(record, ensure_ascii=False) + "\n")
+            checkpoint.flush()
+            if args.per_document_output and record["status"] == "success":
+                relative = path.relative_to(input_folder)
+                output_file = output_folder / relative.parent / f"{relative.name.split('.')[0]}.json"
+                output_file.parent.mkdir(parents=True, exist_ok=True)
+                output = {k: record[k] for k in ("id", "classification", "metadata")}
+                with open(output_file, "w", encoding="utf-8") as f:
+                    json.dump(output, f, ensure_ascii=False, indent=4)
+
+            completed += 1
+            summary = record["classification"] if record["status"] == "success" else f"ERROR: {record['error']}"
+            print(f"[{completed}/{len(todo)}] {key}: {summary}")
+
+    queue = iter(todo)
+    try:
+        with open(checkpoint_path, "a", encoding="utf-8") as checkpoint:
+            await asyncio.gather(*(worker(queue, checkpoint) for _ in range(args.concurrency)))
+    finally:
+        await pipeline.aclose()
+
+    if pipeline.local_classifier is not None:
+        print(f"Classified locally: {pipeline.local_hits}, sent to GPT: {pipeline.local_misses}")
+    if pipeline.near_duplicates is not None:
+        print(f"Near-duplicate index: {pipeline.near_duplicates.stats()}")
+        pipeline.near_duplicates.close()
+    if pipeline.invoice_templates is not None:
+        print(f"Invoice templates: {pipeline.invoice_templates.stats()}")
+        pipeline.invoice_templates.close()
+    print(f"#Input tokens: {pipeline.total_input_tokens}, #Output tokens: {pipeline.total_output_tokens} "
+          f"-> Total cost: ${pipeline.calculate_costs():.6f}")
+    if pipeline.cache is not None:
+        print(f"Cache stats: {pipeline.cache.stats()}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", default="documents-extra", help="Folder to scan recursively for PDFs")
+    parser.add_argument("--output", default="output-extra", help="Folder for the checkpoint and optional per-document JSON")
+    parser.add_argument("--checkpoint", help="JSONL checkpoint path (default: <output>/results.jsonl)")
+    parser.add_argument("--per-document-output", action="store_true",
+                        help="Also write <output>/<relative folder>/<name>.json for every document")
+    parser.add_argument("--concurrency", type=int, default=8, help="Documents processed at the same time")
+    parser.add_argument("--rpm", type=float, default=None, help="Max LLM requests per minute")
+    parser.add_argument("--tpm", type=float, default=None, help="Max LLM tokens per minute (prompt + completion)")
+    parser.add_argument("--max-llm-concurrency", type=int, default=64, help="Max LLM requests in flight")
+    parser.add_argument("--loader-workers", type=int, default=os.cpu_count() or 2, help="PDF parsing processes")
+    parser.add_argument("--pdf-backend", default="pdfplumber")
+    parser.add_argument("--max-pages-classification", type=int, default=3)
+    parser.add_argument("--max-pages-extraction", type=int, default=None)
+    parser.add_argument("--max-tokens-classification", type=int, default=1200,
+                        help="Token budget for the document text in the classification prompt")
+    parser.add_argument("--max-tokens-extraction", type=int, default=4000,
+                        help="Token budget for the document text in the extraction prompt")
+    parser.add_argument("--classification-windows",
+                        help='Incremental classification windows "pages:tokens,...", e.g. "1:400,3:1200,10:4000" '
+                             "(replaces --max-pages/--max-tokens-classification)")
+    parser.add_argument("--classification-min-margin", type=float, default=0.5,
+                        help="Label margin (top minus runner-up probability) at which classification stops widening")
+    parser.add_argument("--local-classifier", help="Path of a trained local classifier (python -m core.local_classifier)")
+    parser.add_argument("--local-threshold", type=float, default=0.8,
+                        help="Minimum local confidence to skip the GPT classification call")
+    parser.add_argument("--extraction-chunk-tokens", type=int, default=None,
+                        help="Extract from the whole document in chunks of this many tokens, in parallel, and merge")
+    parser.add_argument("--fused", action="store_true",
+                        help="Classify and extract metadata with a single LLM call per document")
+    parser.add_argument("--near-duplicate-index",
+                        help="SQLite path of a near-duplicate index: reuse results of templated documents")
+    parser.add_argument("--invoice-templates",
+                        help="SQLite path of an invoice template store: extract recurring invoice layouts without the LLM")
+    parser.add_argument("--no-structured-extraction", dest="structured_extraction", action="store_false",
+                        help="Ask for JSON in the prompt instead of constraining answers to the metadata schema")
+    parser.add_argument("--no-cache", dest="cache", action="store_false", help="Disable the result cache")
+    return parser.parse_args()
+
 
 if __name__ == "__main__":
-    input_folder = r"C:\Users\ilanit\PycharmProjects\factify\documents-extra"
-    output_folder = r"C:\Users\ilanit\PycharmProjects\factify\output-extra"
-    os.makedirs(output_folder, exist_ok=True)
-
-    # 👇 Load existing results if they exist
-    all_results_path = os.path.join(output_folder, "all_results.json")
-    if os.path.exists(all_results_path):
-        with open(all_results_path, "r", encoding="utf-8") as f:
-            all_results = json.load(f)
-    else:
-        all_results = {}
-    pipeline = DocumentPipelineManager(max_pages_classification=3)
-
-    for doc_type_folder in os.listdir(input_folder):
-        curr_input_folder = os.path.join(input_folder, doc_type_folder)
-        curr_output_folder = os.path.join(output_folder, doc_type_folder)
-        os.makedirs(curr_output_folder, exist_ok=True)
-        for file_name in os.listdir(curr_input_folder):
-            print(f"Processing {file_name}")
-            file_name_clean = file_name.split(".")[0]
-            output_file = os.path.join(curr_output_folder, f"{file_name_clean}.json")
-            key = f"{doc_type_folder}_{file_name_clean}"
-
-            # 👇 Skip if file was processed already
-            if os.path.exists(output_file) or key in all_results:
-                print(f"Output for {key} already exists, skipping.")
-                continue
-
-            pages = pipeline.load_document(os.path.join(curr_input_folder, file_name))
-            classification_result = pipeline.classify(pages)
-            metadata_result = pipeline.extract_metadata(pages, classification_result["type"])
-
-            doc_id = str(uuid4())
-            input_tokens = pipeline.total_input_tokens
-            output_tokens = pipeline.total_output_tokens
-            total_cost = pipeline.calculate_costs()
-
-            print(f"#Input tokens: {input_tokens}, #Output tokens: {output_tokens} -> Total cost: ${total_cost:.6f}")
-
-            output = {
-                "id": doc_id,
-                "classification": classification_result,
-                "metadata": metadata_result.model_dump() if hasattr(metadata_result, "model_dump") else metadata_result,
-            }
-
-            all_results[key] = output
-
-            with open(output_file, "w", encoding="utf-8") as f:
-                json.dump(output, f, ensure_ascii=False, indent=4)
-
-            print(f"Classification: {classification_result}")
-            print(f"Metadata: {metadata_result}\n")
-
-            # 👇 Save cumulative results after each doc
-            with open(all_results_path, "w", encoding="utf-8") as f:
-                json.dump(all_results, f, ensure_ascii=False, indent=4)
+    asyncio.run(run_batch(parse_args()))
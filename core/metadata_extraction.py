@@ -1,38 +1,23 @@
-from langchain_core.runnables import Runnable
+from langchain_core.runnables import Runnable, RunnableLambda
+from langchain_core.messages import AIMessage
+import ast
+import hashlib
+import json
+import re
+import typing
+from datetime import date
+from core.content_selection import select_content, chunk_content, count_tokens
+from core.metrics import add_usage, METADATA_PARSES
+from core.llm_transport import LLMTransport
 from langchain_openai import ChatOpenAI
-from typing import List, Dict, Any, Optional, Union
-from pydantic import BaseModel
+from openai import BadRequestError, LengthFinishReasonError
+from typing import List, Dict, Any, AsyncIterator, Optional, Type, Union
+from pydantic import BaseModel, ValidationError
 from langchain.prompts import PromptTemplate
 from langchain.output_parsers import PydanticOutputParser
+from langchain_core.utils.json import parse_json_markdown, parse_partial_json
+from core.metadata_schemas import LineItem, InvoiceMetadata, ContractMetadata, KeyMetric, ReportMetadata, OtherMetadata
 
-class LineItem(BaseModel):
-    description: str
-    quantity: Optional[Union[int, float]]
-    amount: Optional[Union[int, float]]
-
-class InvoiceMetadata(BaseModel):
-    vendor: Optional[str]
-    amount: Optional[Union[int, float]]
-    due_date: Optional[str]
-    line_items: Optional[List[LineItem]]
-
-class ContractMetadata(BaseModel):
-    parties: Optional[List[str]]
-    effective_date: Optional[str]
-    termination_date: Optional[str]
-    key_terms: Optional[List[str]]
-
-class KeyMetric(BaseModel):
-    name: str
-    value: Optional[str]  # Keep as str to support values like "$1.2B", "15%", "N/A"
-
-class ReportMetadata(BaseModel):
-    reporting_period: Optional[str]
-    key_metrics: Optional[List[KeyMetric]]
-    executive_summary: Optional[str]
-
-class OtherMetadata(BaseModel):
-    summary: Optional[str]
 
 def get_invoice_prompt():
     parser = PydanticOutputParser(pydantic_object=InvoiceMetadata)
@@ -123,18 +108,207 @@ Document content:
     return template, parser
 
 
+###### Structured outputs and local repair ######
+
+def _strict_schema(node):
+    # OpenAI strict mode: every object lists all its keys as required and allows no others
+    if isinstance(node, list):
+        return [_strict_schema(n) for n in node]
+    if not isinstance(node, dict):
+        return node
+    strict = {}
+    for key, value in node.items():
+        if key in ("title", "default"):
+            continue
+        if key in ("properties", "$defs"):
+            strict[key] = {name: _strict_schema(schema) for name, schema in value.items()}
+        else:
+            strict[key] = _strict_schema(value)
+    if strict.get("type") == "object":
+        strict["required"] = list(strict.get("properties", {}))
+        strict["additionalProperties"] = False
+    return strict
+
+
+def json_schema_format(model: Type[BaseModel]) -> Dict[str, Any]:
+    """`response_format` that constrains the model's answer to the JSON schema of `model`."""
+    return {"type": "json_schema",
+            "json_schema": {"name": model.__name__, "strict": True, "schema": _strict_schema(model.model_json_schema())}}
+
+
+def schema_rejected(error: Exception) -> bool:
+    """Whether the API refused the request because of its `response_format` (e.g. a model without structured outputs)."""
+    return isinstance(error, BadRequestError) and (
+        getattr(error, "param", None) == "response_format"
+        or "response_format" in str(error) or "json_schema" in str(error))
+
+
+TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+def repair_json(content: str) -> Optional[dict]:
+    """
+    Best-effort parse of a near-valid JSON answer: prose or code fences around the object,
+    trailing commas, an answer cut off before its end, Python literals (single quotes, None).
+    """
+    start, end = content.find("{"), content.rfind("}")
+    if start < 0:
+        return None
+    candidates = [content[start:end + 1]] if end > start else []
+    candidates.append(content[start:])
+    for text in candidates:
+        text = TRAILING_COMMA.sub(r"\1", text)
+        for parse in (lambda t: json.loads(t, strict=False), parse_partial_json, ast.literal_eval):
+            try:
+                data = parse(text)
+            except (ValueError, SyntaxError, MemoryError, RecursionError):
+                continue
+            if isinstance(data, dict):
+                return data
+    return None
+
+
+def _submodel(annotation) -> Optional[Type[BaseModel]]:
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+    return next(filter(None, map(_submodel, typing.get_args(annotation))), None)
+
+
+def complete_metadata(data: dict, model: Type[BaseModel]) -> dict:
+    """The keys of `model` only: missing ones set to None, unknown ones dropped, invalid list items skipped."""
+    completed = {}
+    for name, field in model.model_fields.items():
+        value = data.get(name)
+        item_model = _submodel(field.annotation)
+        if item_model is not None and isinstance(value, list):
+            items = []
+            for item in value:
+                try:
+                    items.append(item_model.model_validate(complete_metadata(item, item_model)))
+                except (AttributeError, ValidationError):
+                    continue
+            value = items
+        completed[name] = value
+    return completed
+
+
+###### Merging partial metadata from document chunks ######
+# Every merge is deterministic: it only depends on the partial results and their chunk order.
+
+def _first(values):
+    return next((v for v in values if v not in (None, "", [])), None)
+
+
+def _last(values):
+    return _first(list(values)[::-1])
+
+
+def _normalized(value) -> str:
+    return " ".join(str(value).lower().split())
+
+
+def _union(lists, key=_normalized) -> Optional[list]:
+    """Concatenate lists in chunk order, keeping the first occurrence of each item."""
+    seen, merged = set(), []
+    for items in lists:
+        for item in items or []:
+            k = key(item)
+            if k not in seen:
+                seen.add(k)
+                merged.append(item)
+    return merged or None
+
+
+def _pick_date(values, pick=min) -> Optional[str]:
+    """Earliest/latest ISO date among the values; the first value if none parses."""
+    parsed = []
+    for value in values:
+        try:
+            parsed.append((date.fromisoformat(value), value))
+        except (TypeError, ValueError):
+            continue
+    return pick(parsed)[1] if parsed else _first(values)
+
+
+def merge_invoice_metadata(parts: List[InvoiceMetadata]) -> InvoiceMetadata:
+    return InvoiceMetadata(
+        vendor=_first(p.vendor for p in parts),
+        # The invoice total comes after the line items
+        amount=_last(p.amount for p in parts),
+        due_date=_first(p.due_date for p in parts),
+        line_items=_union([p.line_items for p in parts],
+                          key=lambda i: (_normalized(i.description), i.quantity, i.amount)),
+    )
+
+
+def merge_contract_metadata(parts: List[ContractMetadata]) -> ContractMetadata:
+    return ContractMetadata(
+        parties=_union(p.parties for p in parts),
+        effective_date=_pick_date([p.effective_date for p in parts], pick=min),
+        termination_date=_pick_date([p.termination_date for p in parts], pick=max),
+        key_terms=_union(p.key_terms for p in parts),
+    )
+
+
+def merge_report_metadata(parts: List[ReportMetadata]) -> ReportMetadata:
+    return ReportMetadata(
+        reporting_period=_first(p.reporting_period for p in parts),
+        key_metrics=_union([p.key_metrics for p in parts], key=lambda m: _normalized(m.name)),
+        # The opening of a report holds its highlights
+        executive_summary=_first(p.executive_summary for p in parts),
+    )
+
+
+def merge_other_metadata(parts: List[OtherMetadata]) -> OtherMetadata:
+    return OtherMetadata(summary=_first(p.summary for p in parts))
+
+
+METADATA_MERGERS = {
+    "Invoice": merge_invoice_metadata,
+    "Contract": merge_contract_metadata,
+    "Earnings": merge_report_metadata,
+    "Report": merge_report_metadata,
+    "Other": merge_other_metadata,
+}
+
 
 class RunnableMetadataExtractor(Runnable):
     def __init__(self, doc_type: str, model: str = "gpt-4o-mini",
                  max_chars: Union[int, None] = None,
-                 max_pages: Union[int, None] = None):
+                 max_pages: Union[int, None] = None,
+                 max_prompt_tokens: Union[int, None] = None,
+                 chunk_tokens: Union[int, None] = None,
+                 max_chunk_concurrency: Union[int, None] = None,
+                 transport: Union[LLMTransport, None] = None,
+                 structured_output: bool = True):
         self.doc_type = doc_type
         self.max_prompt_chars = max_chars
+        # Token budget for the document text; replaces the character cut when set
+        self.max_prompt_tokens = max_prompt_tokens
         self.max_pages = max_pages
+        # Map-reduce mode: read the whole document in chunks of this many tokens, extract
+        # from the chunks in parallel and merge the partial results (replaces the budget).
+        # All chunks are in flight at once unless `max_chunk_concurrency` is set
+        self.chunk_tokens = chunk_tokens
+        self.max_chunk_concurrency = max_chunk_concurrency
         self.model = model
-        self.llm = ChatOpenAI(model_name=model, temperature=0.0, max_tokens=1000)
+        # On the pipeline's shared transport, which does the retries
+        clients = {} if transport is None else dict(http_client=transport.http_client,
+                                                    http_async_client=transport.http_async_client, max_retries=0)
+        self.llm = ChatOpenAI(model_name=model, temperature=0.0, max_tokens=1000, **clients)
         # Get prompt + parser at initialization
         self.prompt, self.parser = self.get_prompt_and_parser_for_type(doc_type)
+        # Structured outputs: the API constrains the answer to the metadata model's JSON schema,
+        # which replaces the (longer) format instructions of the prompt
+        self.structured_output = structured_output
+        self.format_instructions = self.prompt.partial_variables["format_instructions"]
+        self.response_format = json_schema_format(self.parser.pydantic_object) if structured_output else None
+        self.chat = self.llm.bind(response_format=self.response_format) if structured_output else self.llm
+        if structured_output:
+            self.prompt = self.prompt.partial(format_instructions="")
+        # Calls that hit the completion limit are parsed (and repaired) rather than raised
+        self.runner = RunnableLambda(self._call, afunc=self._acall)
+        self.prompt_version = hashlib.sha256(self.prompt.format(content="").encode("utf-8")).hexdigest()[:12]
         self.input_tokens = 0
         self.output_tokens = 0
 
@@ -150,26 +324,258 @@ class RunnableMetadataExtractor(Runnable):
         else:
             raise ValueError(f"Unsupported document type: {doc_type}")
     
-    def invoke(self, pages: List[Dict[str, Any]]) -> Optional[BaseModel]:
-        # Combine text from first 3 pages
+    def build_content(self, pages: List[Dict[str, Any]]) -> str:
+        """Return the document text that is sent to the model for the given pages."""
         if self.max_pages is not None:
             pages = pages[:self.max_pages]
+        if self.max_prompt_tokens is not None:
+            # Highest-value segments for this document type that fit the budget
+            return select_content(pages, self.max_prompt_tokens, doc_type=self.doc_type, model=self.model)
         content = "\n\n".join(p["text"] for p in pages)
         # Truncate to max characters
         if self.max_prompt_chars is not None:
             content = content[:self.max_prompt_chars]
-        # Format prompt
+        return content
+
+    def build_chunks(self, pages: List[Dict[str, Any]]) -> List[str]:
+        """Return the document text of each call: one chunk per call in map-reduce mode, else a single text."""
+        if self.chunk_tokens is None:
+            return [self.build_content(pages)]
+        if self.max_pages is not None:
+            pages = pages[:self.max_pages]
+        return chunk_content(pages, self.chunk_tokens, model=self.model)
+
+    def build_messages(self, pages: List[Dict[str, Any]], hint: Optional[dict] = None) -> List[Dict[str, str]]:
+        return self.messages_for_content(self.build_content(pages), hint)
+
+    def hint_instructions(self, hint: dict) -> str:
+        """Compact replacement of the format instructions: the metadata of a near-duplicate document."""
+        return ("Respond with a JSON object with the same keys as this metadata of a very similar document "
+                "(same template). Take every value from the document text below, not from this example:\n"
+                + json.dumps(hint, ensure_ascii=False, separators=(",", ":")))
+
+    def hint_example(self, hint: dict) -> List[Dict[str, str]]:
+        """
+        Example exchange of the structured-output prompt (a user turn and the assistant's
+        answer): the metadata of a near-duplicate document.
+        """
+        return [
+            {"role": "user", "content": "Example: extract the metadata of a very similar document (same template). "
+                                        "For the next document, take every value from its own text, not from this example."},
+            {"role": "assistant", "content": json.dumps(hint, ensure_ascii=False, separators=(",", ":"))},
+        ]
+
+    def uses_hint(self, hint: Optional[dict]) -> bool:
+        """
+        Whether `hint` goes into the prompt: as an example exchange before the document with
+        structured outputs, else in place of the JSON schema when it is shorter.
+        """
+        if hint is None:
+            return False
+        if self.structured_output:
+            return True
+        return len(self.hint_instructions(hint)) < len(self.prompt.partial_variables["format_instructions"])
+
+    def hint_savings(self, hint: dict) -> int:
+        """
+        Prompt tokens saved per call by the hint. Free-form prompts show it in place of the JSON
+        schema; with structured outputs it is an extra example exchange, which saves none.
+        """
+        if self.structured_output:
+            return 0
+        schema = count_tokens(self.prompt.partial_variables["format_instructions"], self.model)
+        return max(0, schema - count_tokens(self.hint_instructions(hint), self.model))
+
+    def messages_for_content(self, content: str, hint: Optional[dict] = None) -> List[Dict[str, str]]:
+        # Format prompt; a near-duplicate's metadata replaces the (longer) JSON schema when given,
+        # or, with structured outputs, comes as an example user / assistant exchange before the document
+        prompt = self.prompt.format(content=content)
         messages = [
             {"role": "system", "content": "You extract structured metadata from business documents parsed as text from PDF. Focus only on the information present in the text."}
-            , {"role": "user", "content": self.prompt.format(content=content)}
         ]
-        # Call LLM
-        response = self.llm.invoke(messages)
+        if self.uses_hint(hint):
+            if self.structured_output:
+                messages.extend(self.hint_example(hint))
+            else:
+                prompt = self.prompt.format(content=content, format_instructions=self.hint_instructions(hint))
+        messages.append({"role": "user", "content": prompt})
+        return messages
+
+    def estimate_tokens(self, pages: List[Dict[str, Any]], hint: Optional[dict] = None) -> int:
+        """Tokens the call(s) will use at most: the prompts plus the maximum completion lengths."""
+        # The API counts the response schema as prompt tokens
+        schema = count_tokens(json.dumps(self.response_format), self.model) if self.structured_output else 0
+        return sum(
+            sum(count_tokens(m["content"], self.model) for m in self.messages_for_content(chunk, hint))
+            + schema + self.llm.max_tokens
+            for chunk in self.build_chunks(pages)
+        )
+
+    def build_request(self, pages: List[Dict[str, Any]], content: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Return the raw chat completion arguments equivalent to `invoke` (used by the Batch API mode),
+        or to its call on one chunk `content` (see `build_chunks`).
+        """
+        request = {
+            "model": self.model,
+            "messages": self.build_messages(pages) if content is None else self.messages_for_content(content),
+            "temperature": self.llm.temperature,
+            "max_tokens": self.llm.max_tokens,
+        }
+        if self.structured_output:
+            request["response_format"] = self.response_format
+        return request
+
+    def repair(self, content: str) -> Optional[BaseModel]:
+        """Metadata from a near-valid answer (see `repair_json`), or None if it cannot be read."""
+        data = repair_json(content)
+        if data is None:
+            return None
+        model = self.parser.pydantic_object
+        try:
+            return model.model_validate(complete_metadata(data, model))
+        except ValidationError:
+            return None
+
+    def parse_content(self, content: str) -> Optional[BaseModel]:
+        # Parse response into structured metadata; near-valid answers are repaired locally, so
+        # only unreadable ones raise and cost a new call
+        try:
+            metadata = self.parser.parse(content)
+        except Exception as e:
+            metadata = self.repair(content)
+            if metadata is None:
+                METADATA_PARSES.inc(result="failed")
+                raise ValueError(f"Failed to parse metadata for {self.doc_type}: {e}") from e
+            METADATA_PARSES.inc(result="repaired")
+            return metadata
+        METADATA_PARSES.inc(result="valid")
+        return metadata
+
+    @staticmethod
+    def _truncated_message(error: LengthFinishReasonError) -> AIMessage:
+        # Structured outputs raise when the answer reached the completion limit: keep what was written
+        completion, usage = error.completion, error.completion.usage
+        return AIMessage(content=completion.choices[0].message.content or "",
+                         usage_metadata={"input_tokens": usage.prompt_tokens, "output_tokens": usage.completion_tokens,
+                                         "total_tokens": usage.total_tokens} if usage else None)
+
+    def disable_structured_output(self):
+        """Switch to free-form prompts: the format instructions go back into the prompt and answers are repaired locally."""
+        self.structured_output = False
+        self.response_format = None
+        self.chat = self.llm
+        self.prompt = self.prompt.partial(format_instructions=self.format_instructions)
+
+    def free_form_messages(self, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        # The structured prompt is the template with empty format instructions: put them back in
+        head = self.prompt.template.split("{format_instructions}")[0]
+        prompt = messages[-1]["content"]
+        return messages[:-1] + [{"role": "user", "content": head + self.format_instructions + prompt[len(head):]}]
+
+    def _call(self, messages: List[Dict[str, str]]) -> AIMessage:
+        try:
+            return self.chat.invoke(messages)
+        except LengthFinishReasonError as e:
+            return self._truncated_message(e)
+        except BadRequestError as e:
+            # The model does not take the schema: resend (and keep sending) free-form prompts.
+            # Concurrent chunks may be rejected after the switch, so only the first one switches
+            if not schema_rejected(e):
+                raise
+            if self.structured_output:
+                self.disable_structured_output()
+            return self._call(self.free_form_messages(messages))
+
+    async def _acall(self, messages: List[Dict[str, str]]) -> AIMessage:
+        try:
+            return await self.chat.ainvoke(messages)
+        except LengthFinishReasonError as e:
+            return self._truncated_message(e)
+        except BadRequestError as e:
+            if not schema_rejected(e):
+                raise
+            if self.structured_output:
+                self.disable_structured_output()
+            return await self._acall(self.free_form_messages(messages))
+
+    def record_usage(self, response, usage: Optional[dict] = None):
         if hasattr(response, 'usage_metadata') and response.usage_metadata:
             self.input_tokens += response.usage_metadata['input_tokens']
             self.output_tokens += response.usage_metadata['output_tokens']
-        # Parse response into structured metadata
+            add_usage(usage, response.usage_metadata['input_tokens'], response.usage_metadata['output_tokens'])
+
+    def parse_response(self, response, usage: Optional[dict] = None) -> Optional[BaseModel]:
+        self.record_usage(response, usage)
+        return self.parse_content(response.content)
+
+    def merge(self, parts: List[BaseModel]) -> BaseModel:
+        """Combine the partial metadata of each chunk (see `METADATA_MERGERS`)."""
+        return parts[0] if len(parts) == 1 else METADATA_MERGERS[self.doc_type](parts)
+
+    def invoke(self, pages: List[Dict[str, Any]], config=None, usage: Optional[dict] = None,
+               hint: Optional[dict] = None, **kwargs) -> Optional[BaseModel]:
+        """
+        Extract metadata; the tokens of every call are added to `usage` when given. `hint` is
+        the metadata of a near-duplicate document, sent as an example (see `messages_for_content`).
+        """
+        chunks = self.build_chunks(pages)
+        if len(chunks) == 1:
+            # Call LLM
+            return self.parse_response(self._call(self.messages_for_content(chunks[0], hint)), usage)
+        # Map: one call per chunk, run concurrently; reduce: deterministic merge
+        responses = self.runner.batch([self.messages_for_content(c, hint) for c in chunks],
+                                   config={"max_concurrency": self.max_chunk_concurrency or len(chunks)})
+        return self.merge_responses(responses, usage)
+
+    async def ainvoke(self, pages: List[Dict[str, Any]], config=None, usage: Optional[dict] = None,
+                      hint: Optional[dict] = None, **kwargs) -> Optional[BaseModel]:
+        chunks = self.build_chunks(pages)
+        if len(chunks) == 1:
+            return self.parse_response(await self._acall(self.messages_for_content(chunks[0], hint)), usage)
+        responses = await self.runner.abatch([self.messages_for_content(c, hint) for c in chunks],
+                                          config={"max_concurrency": self.max_chunk_concurrency or len(chunks)})
+        return self.merge_responses(responses, usage)
+
+    async def astream_partial(self, pages: List[Dict[str, Any]], usage: Optional[dict] = None,
+                              hint: Optional[dict] = None) -> AsyncIterator[Union[dict, BaseModel]]:
+        """
+        Stream the extraction: yield the partially parsed JSON answer (a dict) every time it
+        grows while the model writes it, then the validated metadata (a BaseModel) last.
+        Map-reduce extraction has no single answer to stream, so it only yields the merged result.
+        """
+        chunks = self.build_chunks(pages)
+        if len(chunks) > 1:
+            yield await self.ainvoke(pages, usage=usage, hint=hint)
+            return
+        message, last = None, None
         try:
-            return self.parser.parse(response.content)
-        except Exception as e:
-            raise ValueError(f"Failed to parse metadata for {self.doc_type}: {e}") from e
\ No newline at end of file
+            async for chunk in self.chat.astream(self.messages_for_content(chunks[0], hint), stream_usage=True):
+                message = chunk if message is None else message + chunk
+                try:
+                    partial = parse_json_markdown(message.content, parser=parse_partial_json)
+                except ValueError:
+                    # Nothing parseable yet (e.g. only the opening of a code fence)
+                    continue
+                if isinstance(partial, dict) and partial != last:
+                    last = partial
+                    yield partial
+        except LengthFinishReasonError:
+            # Cut off at the completion limit: what was streamed is repaired below
+            pass
+        except BadRequestError as e:
+            if message is not None or not (self.structured_output and schema_rejected(e)):
+                raise
+            self.disable_structured_output()
+            async for item in self.astream_partial(pages, usage, hint):
+                yield item
+            return
+        if message is None:
+            raise ValueError(f"Empty streamed response for {self.doc_type}")
+        yield self.parse_response(message, usage)
+
+    def merge_responses(self, responses, usage: Optional[dict] = None) -> BaseModel:
+        # Count every chunk's tokens before parsing, so one bad chunk does not hide the others
+        for response in responses:
+            self.record_usage(response, usage)
+        return self.merge([self.parse_content(r.content) for r in responses])
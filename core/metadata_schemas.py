@@ -0,0 +1,44 @@
+"""
+Metadata schemas of each document type.
+
+Kept apart from `core.metadata_extraction` so that code which only reads or builds metadata
+(invoice templates, the API) does not import langchain and the OpenAI SDK.
+"""
+from typing import List, Optional, Union
+from pydantic import BaseModel
+
+class LineItem(BaseModel):
+    description: str
+    quantity: Optional[Union[int, float]]
+    amount: Optional[Union[int, float]]
+
+class InvoiceMetadata(BaseModel):
+    vendor: Optional[str]
+    amount: Optional[Union[int, float]]
+    due_date: Optional[str]
+    line_items: Optional[List[LineItem]]
+
+class ContractMetadata(BaseModel):
+    parties: Optional[List[str]]
+    effective_date: Optional[str]
+    termination_date: Optional[str]
+    key_terms: Optional[List[str]]
+
+class KeyMetric(BaseModel):
+    name: str
+    value: Optional[str]  # Keep as str to support values like "$1.2B", "15%", "N/A"
+
+class ReportMetadata(BaseModel):
+    reporting_period: Optional[str]
+    key_metrics: Optional[List[KeyMetric]]
+    executive_summary: Optional[str]
+
+class OtherMetadata(BaseModel):
+    summary: Optional[str]
+
+METADATA_MODELS = {
+    "Invoice": InvoiceMetadata,
+    "Contract": ContractMetadata,
+    "Earnings": ReportMetadata,
+    "Other": OtherMetadata,
+}
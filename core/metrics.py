@@ -0,0 +1,262 @@
+"""
+In-process metrics: counters, gauges and histograms rendered in the Prometheus text format.
+
+The pipeline and the API record into the module-level metrics below; `GET /metrics` serves
+`REGISTRY.render()`. Values are per process: with several uvicorn workers, each worker
+reports its own series (scrape them individually or run one worker per container).
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Seconds: from a cache hit to a long chunked extraction
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+COST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05)
+
+# USD per 1M input / output tokens
+MODEL_PRICES = {"gpt-4o-mini": (0.6, 2.4), "gpt-4o": (2.5, 10.0)}
+
+
+def token_cost(input_tokens: int, output_tokens: int, model: str = "gpt-4o-mini") -> float:
+    """Cost in USD of the given tokens (models missing from `MODEL_PRICES` use gpt-4o-mini prices)."""
+    input_cost, output_cost = MODEL_PRICES.get(model, MODEL_PRICES["gpt-4o-mini"])
+    return input_tokens / 1_000_000 * input_cost + output_tokens / 1_000_000 * output_cost
+
+
+def add_usage(usage: Optional[dict], input_tokens: int, output_tokens: int):
+    """Add one LLM call's tokens to a usage dict (no-op when usage is None)."""
+    if usage is None:
+        return
+    usage["calls"] = usage.get("calls", 0) + 1
+    usage["input_tokens"] = usage.get("input_tokens", 0) + input_tokens
+    usage["output_tokens"] = usage.get("output_tokens", 0) + output_tokens
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+    def samples(self) -> List[Tuple[str, Tuple[Tuple[str, str], ...], float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines += [f"{name}{_format_labels(labels)} {_format_value(value)}" for name, labels, value in self.samples()]
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set_total(self, value: float, **labels):
+        """Mirror a count kept elsewhere (e.g. a component's own hit counter), read at scrape time."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        self.set_total(value, **labels)
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels) -> Iterator[None]:
+        """Count the block as in progress while it runs."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # labels -> (count per bucket, sum)
+        self._values: Dict[Tuple, Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * len(self.buckets), 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", key + (("le", _format_value(bound)),), cumulative))
+                samples.append((f"{self.name}_sum", key, total))
+                samples.append((f"{self.name}_count", key, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def add_collector(self, collect: Callable[[], None]):
+        """Call `collect` before every render, e.g. to copy counters kept elsewhere into gauges."""
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        for collect in self._collectors:
+            collect()
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "pdf_analyzer_stage_seconds", "Time spent per document in each stage (upload, load, classify, extract, ...)",
+    ["stage"])
+STAGE_IN_PROGRESS = REGISTRY.gauge(
+    "pdf_analyzer_stage_in_progress", "Documents currently in each stage", ["stage"])
+LLM_CALLS = REGISTRY.counter(
+    "pdf_analyzer_llm_calls_total", "LLM API calls that returned a response", ["stage"])
+LLM_TOKENS = REGISTRY.counter(
+    "pdf_analyzer_llm_tokens_total", "Tokens reported by the LLM API", ["stage", "kind"])
+LLM_COST = REGISTRY.counter(
+    "pdf_analyzer_llm_cost_usd_total", "Estimated LLM cost in USD", ["stage"])
+DOCUMENT_TOKENS = REGISTRY.histogram(
+    "pdf_analyzer_document_tokens", "LLM tokens spent per analysed document", ["kind"], buckets=TOKEN_BUCKETS)
+DOCUMENT_COST = REGISTRY.histogram(
+    "pdf_analyzer_document_cost_usd", "Estimated LLM cost per analysed document", buckets=COST_BUCKETS)
+CACHE_LOOKUPS = REGISTRY.counter(
+    "pdf_analyzer_cache_lookups_total", "Result cache lookups by stage", ["stage", "result"])
+UPLOADS = REGISTRY.counter(
+    "pdf_analyzer_uploads_total", "Uploaded files kept in memory, spilled to disk or rejected as too large",
+    ["storage"])
+RETRIES = REGISTRY.counter(
+    "pdf_analyzer_retries_total", "Retried pipeline calls (after a parsing or API error)", ["operation"])
+METADATA_PARSES = REGISTRY.counter(
+    "pdf_analyzer_metadata_parses_total",
+    "Metadata extraction answers by parse result (valid, repaired locally, failed and sent again)", ["result"])
+CLASSIFICATION_EXITS = REGISTRY.counter(
+    "pdf_analyzer_classification_exits_total",
+    "Incremental classifications by the window (1-based) whose answer was kept", ["step"])
+LLM_HTTP_REQUESTS = REGISTRY.counter(
+    "pdf_analyzer_llm_http_requests_total", "LLM HTTP requests sent by the shared transport, by response status",
+    ["status"])
+LLM_HTTP_RETRIES = REGISTRY.counter(
+    "pdf_analyzer_llm_http_retries_total",
+    "LLM HTTP requests retried by the shared transport, by cause (status code, timeout, connection)", ["reason"])
+LLM_RATE_LIMIT_WAIT = REGISTRY.histogram(
+    "pdf_analyzer_llm_rate_limit_wait_seconds", "Time LLM HTTP requests waited for the rate limiter")
+LLM_IN_FLIGHT = REGISTRY.gauge(
+    "pdf_analyzer_llm_requests_in_flight", "LLM HTTP requests holding a slot of the shared transport")
+
+NEAR_DUPLICATE_LOOKUPS = REGISTRY.counter(
+    "pdf_analyzer_near_duplicate_lookups_total", "Near-duplicate index lookups", ["result"])
+NEAR_DUPLICATE_REUSES = REGISTRY.counter(
+    "pdf_analyzer_near_duplicate_reuses_total",
+    "Classifications reused from a near-duplicate (classify) and extraction prompts hinted with its metadata (extract)",
+    ["stage"])
+NEAR_DUPLICATE_TOKENS_SAVED = REGISTRY.counter(
+    "pdf_analyzer_near_duplicate_tokens_saved_total", "Estimated prompt tokens saved by near-duplicate reuse", ["stage"])
+TEMPLATE_EXTRACTIONS = REGISTRY.counter(
+    "pdf_analyzer_template_extractions_total",
+    "Invoice extractions answered by a layout template (hit), rejected by its validation (fallback) or without one (none)",
+    ["result"])
+TEMPLATE_UPDATES = REGISTRY.counter(
+    "pdf_analyzer_template_updates_total", "Invoice templates learned, confirmed or activated", ["event"])
+
+
+@contextmanager
+def timed(timings: Optional[dict], stage: str):
+    """
+    Record the seconds spent in the block in `STAGE_SECONDS` and, when a dict is given, add
+    them to `timings[stage]`; the stage counts as in progress while the block runs.
+    """
+    start = time.perf_counter()
+    STAGE_IN_PROGRESS.inc(stage=stage)
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_IN_PROGRESS.dec(stage=stage)
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+def count_retry(retry_state):
+    """tenacity `before_sleep` hook: count the retry under the name of the retried function."""
+    RETRIES.inc(operation=retry_state.fn.__name__ if retry_state.fn else "unknown")
@@ -0,0 +1,173 @@
+"""
+Near-duplicate document index: MinHash signatures with LSH buckets, stored in SQLite.
+
+Recurring invoices and boilerplate contracts differ only in a few fields, so their page text
+never hashes the same but shares almost all of its word shingles. `NearDuplicateIndex`
+keeps a MinHash signature of every indexed document, with its classification and metadata,
+and finds the most similar indexed document in a handful of index lookups:
+
+- Signature: MinHash over word 3-shingles of the first `max_pages` pages, with digits masked
+  (amounts, dates and invoice numbers are what templated documents differ in).
+- LSH: the signature is cut into `bands` bands of `rows` values; documents sharing any band
+  are candidates, and their signatures give the estimated Jaccard similarity.
+- Only documents without a close match (`insert_threshold`) are added, so a template seen a
+  million times stays a single row and buckets stay small.
+
+Like the document store, the index is a local SQLite file in WAL mode, shared by every
+uvicorn worker process.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+# Largest prime below 2**32: a * x + b stays below 2**64 for 32-bit a, b and x
+_PRIME = np.uint64(4294967291)
+
+
+@dataclass
+class NearDuplicate:
+    id: int
+    similarity: float
+    classification: Dict[str, Any]
+    metadata: Optional[Dict[str, Any]]
+
+
+class NearDuplicateIndex:
+    def __init__(self, path: str = "data/near_duplicates.sqlite", bands: int = 16, rows: int = 4,
+                 threshold: float = 0.8, insert_threshold: float = 0.95, max_pages: int = 2,
+                 shingle_size: int = 3, min_tokens: int = 20, max_candidates: int = 8, seed: int = 1):
+        """
+        Args:
+            path: SQLite file.
+            bands / rows: LSH layout; the signature has bands * rows hashes. Documents become
+                          candidates with probability 1 - (1 - s**rows)**bands at similarity s
+                          (16 x 4: 64% at s=0.5, >99.9% at s=0.8).
+            threshold: Minimum estimated similarity of a match returned by `query`.
+            insert_threshold: Documents with a match at least this similar are not indexed.
+            max_pages: Leading pages the signature is computed from at most (the pipeline
+                       also stops at the first classification window).
+            shingle_size: Words per shingle.
+            min_tokens: Documents with fewer words (e.g. scanned pages) get no signature: they
+                        would all look alike.
+            max_candidates: Documents read per band bucket, which bounds the lookup cost.
+            seed: Seed of the hash permutations (an index must always use the same one).
+        """
+        self.path = path
+        self.bands = bands
+        self.rows = rows
+        self.threshold = threshold
+        self.insert_threshold = insert_threshold
+        self.max_pages = max_pages
+        self.shingle_size = shingle_size
+        self.min_tokens = min_tokens
+        self.max_candidates = max_candidates
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, int(_PRIME), size=bands * rows, dtype=np.uint64)
+        self._b = rng.integers(0, int(_PRIME), size=bands * rows, dtype=np.uint64)
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents (id INTEGER PRIMARY KEY, signature BLOB NOT NULL, "
+            "classification TEXT NOT NULL, metadata TEXT)"
+        )
+        # One row per (band bucket, document); the key mixes the band number and its values
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (key INTEGER NOT NULL, id INTEGER NOT NULL, "
+            "PRIMARY KEY (key, id)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+
+    def signature(self, pages: List[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """
+        MinHash signature (bands * rows uint32 values) of the document's leading pages, or None
+        if they hold fewer than `min_tokens` words.
+        """
+        text = "\n".join(p["text"] for p in pages[:self.max_pages]).lower()
+        tokens = TOKEN_PATTERN.findall(re.sub(r"\d", "0", text))
+        if len(tokens) < self.min_tokens:
+            return None
+        n = self.shingle_size
+        shingles = {" ".join(tokens[i:i + n]) for i in range(max(1, len(tokens) - n + 1))}
+        # crc32 is stable across processes, unlike hash()
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64,
+                             count=len(shingles)) % _PRIME
+        values = (hashes[:, None] * self._a[None, :] + self._b[None, :]) % _PRIME
+        return values.min(axis=0).astype(np.uint32)
+
+    def _bucket_keys(self, signature: np.ndarray) -> List[int]:
+        keys = []
+        for band in range(self.bands):
+            values = band.to_bytes(2, "big") + signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            # Signed 64-bit, as SQLite integers are
+            keys.append(int.from_bytes(hashlib.blake2b(values, digest_size=8).digest(), "big", signed=True))
+        return keys
+
+    def query(self, signature: np.ndarray) -> Optional[NearDuplicate]:
+        """The most similar indexed document, if its estimated similarity reaches `threshold`."""
+        with self._lock:
+            candidates = set()
+            for key in self._bucket_keys(signature):
+                candidates.update(row[0] for row in self._conn.execute(
+                    "SELECT id FROM buckets WHERE key = ? LIMIT ?", (key, self.max_candidates)))
+            best = None
+            if candidates:
+                rows = self._conn.execute(
+                    f"SELECT id, signature, classification, metadata FROM documents "
+                    f"WHERE id IN ({','.join('?' * len(candidates))})", list(candidates)).fetchall()
+                for id, blob, classification, metadata in rows:
+                    similarity = float(np.mean(np.frombuffer(blob, dtype=np.uint32) == signature))
+                    if similarity >= self.threshold and (best is None or similarity > best[1]):
+                        best = (id, similarity, classification, metadata)
+            self.lookups += 1
+            if best is None:
+                return None
+            self.hits += 1
+        id, similarity, classification, metadata = best
+        return NearDuplicate(id, similarity, json.loads(classification), json.loads(metadata) if metadata else None)
+
+    def add(self, signature: np.ndarray, classification: Dict[str, Any],
+            metadata: Optional[Dict[str, Any]] = None) -> int:
+        """Index a document and return its id."""
+        return self.add_many([(signature, classification, metadata)])[0]
+
+    def add_many(self, documents: Iterable[Tuple[np.ndarray, Dict[str, Any], Optional[Dict[str, Any]]]]) -> List[int]:
+        """Index documents in a single transaction."""
+        ids = []
+        with self._lock:
+            for signature, classification, metadata in documents:
+                cursor = self._conn.execute(
+                    "INSERT INTO documents (signature, classification, metadata) VALUES (?, ?, ?)",
+                    (signature.astype(np.uint32).tobytes(), json.dumps(classification, ensure_ascii=False),
+                     json.dumps(metadata, ensure_ascii=False) if metadata is not None else None))
+                ids.append(cursor.lastrowid)
+                self._conn.executemany("INSERT OR IGNORE INTO buckets (key, id) VALUES (?, ?)",
+                                       [(key, cursor.lastrowid) for key in self._bucket_keys(signature)])
+            self._conn.commit()
+        return ids
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"lookups": self.lookups, "hits": self.hits,
+                    "hit_rate": self.hits / self.lookups if self.lookups else 0.0}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
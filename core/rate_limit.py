@@ -0,0 +1,128 @@
+import random
+import threading
+import time
+from typing import Dict, Mapping, Optional
+
+
+class TokenBucket:
+    """
+    Classic token bucket: holds up to `capacity` units and refills at `capacity` per minute.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.available = per_minute
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available (0 if they are available now)."""
+        self._refill()
+        # Requests larger than the whole bucket are let through once it is full
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.rate
+
+    def reserve(self, amount: float) -> float:
+        """
+        Take `amount` units now, going into debt when the bucket holds fewer, and return the
+        seconds until the debt is repaid: later reservations queue up behind this one.
+        """
+        wait = self.wait_time(amount)
+        self.available -= min(amount, self.capacity)
+        return wait
+
+    def resize(self, per_minute: float):
+        self._refill()
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.available = min(self.available, per_minute)
+
+    def limit_available(self, amount: float):
+        """Hold no more than `amount` units (may be negative: a debt that delays the next reservations)."""
+        self._refill()
+        self.available = min(self.available, amount)
+
+
+def _header_number(headers: Mapping[str, str], name: str) -> Optional[float]:
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class AdaptiveRateLimiter:
+    """
+    Requests- and tokens-per-minute budget of the LLM calls, shared by threads and event loops.
+
+    `reserve(tokens)` books one call and returns how long the caller must wait before sending
+    it. Bookings are served in order, so waiting callers leave one by one at the budgeted rate
+    instead of all at once. The budgets start at the configured values (unlimited if not set)
+    and follow the API's rate-limit headers (`observe`):
+
+    - `x-ratelimit-limit-requests` / `-tokens` size the buckets at `headroom` times the quota
+      (never above the configured budget);
+    - `x-ratelimit-remaining-requests` / `-tokens` cap what is left in them, so quota used by
+      other processes sharing the API key is accounted for.
+
+    `pause(seconds)` holds every caller back, e.g. for the `Retry-After` of a 429.
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None,
+                 headroom: float = 0.95, adaptive: bool = True):
+        self.configured = {"requests": requests_per_minute, "tokens": tokens_per_minute}
+        self.headroom = headroom
+        self.adaptive = adaptive
+        self.buckets: Dict[str, TokenBucket] = {
+            kind: TokenBucket(per_minute) for kind, per_minute in self.configured.items() if per_minute
+        }
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: float = 0, requests: int = 1) -> float:
+        """Book a call of about `tokens` tokens (prompt + completion); returns the seconds to wait before sending it."""
+        with self._lock:
+            wait = self._paused_until - time.monotonic()
+            if wait > 0:
+                # Without a budget to space them out, paused callers restart over 10% of the pause
+                wait *= 1 + 0.1 * random.random()
+            if "requests" in self.buckets:
+                wait = max(wait, self.buckets["requests"].reserve(requests))
+            if "tokens" in self.buckets:
+                wait = max(wait, self.buckets["tokens"].reserve(tokens))
+            return max(0.0, wait)
+
+    def observe(self, headers: Mapping[str, str]):
+        """Adapt the budgets to the rate-limit headers of an API response."""
+        if not self.adaptive:
+            return
+        with self._lock:
+            for kind in ("requests", "tokens"):
+                limit = _header_number(headers, f"x-ratelimit-limit-{kind}")
+                if not limit:
+                    continue
+                budget = min(limit * self.headroom, self.configured[kind] or float("inf"))
+                bucket = self.buckets.get(kind)
+                if bucket is None:
+                    bucket = self.buckets[kind] = TokenBucket(budget)
+                elif bucket.capacity != budget:
+                    bucket.resize(budget)
+                remaining = _header_number(headers, f"x-ratelimit-remaining-{kind}")
+                if remaining is not None:
+                    # Keep the same headroom below the server's count
+                    bucket.limit_available(remaining - limit * (1 - self.headroom))
+
+    def pause(self, seconds: float):
+        """Send nothing for `seconds`; queued callers then resume at the budgeted rate."""
+        with self._lock:
+            if self.buckets:
+                for bucket in self.buckets.values():
+                    bucket.limit_available(-seconds * bucket.rate)
+            else:
+                self._paused_until = max(self._paused_until, time.monotonic() + seconds)
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+
+class ResultCache:
+    """
+    Content-addressed cache for pipeline results.
+
+    Two kinds of entries are stored in a local SQLite file:
+    - extracted page texts (possibly only some pages), keyed by the SHA-256 of the raw
+      PDF bytes, so a byte-identical upload skips parsing of those pages;
+    - classification / metadata results, keyed by a hash of the exact text sent to the
+      model plus the model name and prompt version, so a hit never touches the network.
+
+    A size-bounded in-memory LRU sits in front of SQLite for hot entries.
+    """
+
+    def __init__(self, path: str = "cache/results.sqlite", max_memory_bytes: int = 32 * 1024 * 1024):
+        self.path = path
+        self.max_memory_bytes = max_memory_bytes
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files (file_hash TEXT PRIMARY KEY, page_count INTEGER NOT NULL, "
+            "pages BLOB NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.file_hits = 0
+        self.file_misses = 0
+
+    @staticmethod
+    def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def make_key(stage: str, content: str, **params: Any) -> str:
+        """
+        Build a result key from the stage name, the text sent to the model and any
+        parameters that change the output (model name, prompt version, ...).
+        """
+        digest = hashlib.sha256()
+        digest.update(json.dumps({"stage": stage, **params}, sort_keys=True).encode("utf-8"))
+        digest.update(b"\x00")
+        digest.update(content.encode("utf-8"))
+        return f"{stage}:{digest.hexdigest()}"
+
+    def _remember(self, key: str, value: str):
+        # Caller holds the lock
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        if len(value) > self.max_memory_bytes:
+            return
+        self._memory[key] = value
+        self._memory_bytes += len(value)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+            else:
+                row = self._conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value = row[0]
+                    self._remember(key, value)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(value)
+
+    def set(self, key: str, value: Any):
+        serialized = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, created_at) VALUES (?, ?, ?)",
+                (key, serialized, time.time()),
+            )
+            self._conn.commit()
+            self._remember(key, serialized)
+
+    def get_pages(self, file_hash: str) -> Optional[Tuple[int, Dict[int, str]]]:
+        """
+        Returns:
+            (page_count, texts) where texts maps 0-based page index to the extracted text
+            of every page parsed so far, or None if the file was never seen.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT page_count, pages FROM files WHERE file_hash = ?", (file_hash,)
+            ).fetchone()
+            if row is None:
+                self.file_misses += 1
+                return None
+            self.file_hits += 1
+        texts = json.loads(zlib.decompress(row[1]).decode("utf-8"))
+        return row[0], {int(i): text for i, text in texts.items()}
+
+    def set_pages(self, file_hash: str, page_count: int, texts: Dict[int, str]):
+        blob = zlib.compress(json.dumps(texts, ensure_ascii=False).encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (file_hash, page_count, pages, created_at) VALUES (?, ?, ?, ?)",
+                (file_hash, page_count, blob, time.time()),
+            )
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "file_hits": self.file_hits,
+                "file_misses": self.file_misses,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
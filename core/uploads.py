@@ -0,0 +1,145 @@
+"""
+Uploaded files held in memory or spilled to disk, hashed while they are read.
+
+`read_upload` turns a received file into an `Upload`, computing its SHA-256 and enforcing a
+maximum size (`UploadTooLargeError`). Uploads up to `spill_bytes` are handed to the PDF loader
+as bytes: no disk write and read back per request. When the file is already an in-memory
+buffer (Starlette's `SpooledTemporaryFile` below its spool size, or a `BytesIO`), those bytes
+are the buffer's own, not a copy. Other sources are read chunk by chunk; larger uploads are
+written to a uniquely named file under `spill_dir` (the loader processes need a path, which
+Starlette's anonymous spool file does not have), so concurrent uploads of the same file name
+never share a path. `Upload.close()` (or the `with` block) deletes the spilled file.
+"""
+import hashlib
+import io
+from pathlib import Path
+from tempfile import SpooledTemporaryFile
+from typing import BinaryIO, List, Optional, Union
+from uuid import uuid4
+
+from core.metrics import UPLOADS
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLargeError(ValueError):
+    def __init__(self, max_bytes: int):
+        super().__init__(f"Upload exceeds the maximum size of {max_bytes} bytes")
+        self.max_bytes = max_bytes
+
+
+class Upload:
+    """
+    One received file: its bytes (`data`) or the file it was spilled to (`path`), its size and SHA-256.
+
+    Args:
+        filename (str): Name given by the client (for display only, never used as a path).
+        sha256 (str): Hex digest of the content, computed while reading it.
+        size (int): Size in bytes.
+        data (bytes, optional): Content of an upload kept in memory.
+        path (Path, optional): File holding the content of a spilled upload.
+    """
+
+    def __init__(self, filename: str, sha256: str, size: int, data: Optional[bytes] = None,
+                 path: Optional[Path] = None):
+        self.filename = filename
+        self.sha256 = sha256
+        self.size = size
+        self.data = data
+        self.path = path
+
+    @property
+    def source(self) -> Union[bytes, str]:
+        """What the PDF loader opens: the bytes of an in-memory upload, else the spilled file's path."""
+        return self.data if self.data is not None else str(self.path)
+
+    def close(self):
+        if self.path is not None:
+            self.path.unlink(missing_ok=True)
+            self.path = None
+        self.data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _memory_buffer(source: BinaryIO) -> Optional[io.BytesIO]:
+    """The `BytesIO` holding the whole content of `source`, if it is one or an in-memory spooled file."""
+    if isinstance(source, SpooledTemporaryFile):
+        # Not rolled over to disk yet: the content is in its BytesIO
+        source = source._file
+    return source if isinstance(source, io.BytesIO) else None
+
+
+def _spooled_size(source: BinaryIO) -> Optional[int]:
+    """Size of a spooled or in-memory file, known before reading it (None for other sources, e.g. zip members)."""
+    if not isinstance(source, (SpooledTemporaryFile, io.BytesIO)):
+        return None
+    position = source.tell()
+    size = source.seek(0, io.SEEK_END)
+    source.seek(position)
+    return size - position
+
+
+def read_upload(source: BinaryIO, filename: str, max_bytes: Optional[int] = None, spill_bytes: int = 8 * 1024 * 1024,
+                spill_dir: Union[str, Path] = "tmp/uploads", suffix: str = ".pdf") -> Upload:
+    """
+    Read a file object to its end into an `Upload`.
+
+    Args:
+        source: File object to read (e.g. an `UploadFile.file` or a zip member).
+        filename: Client file name, kept for display.
+        max_bytes: Larger uploads raise `UploadTooLargeError` (None: no limit). Spooled files are
+                   refused before reading, others at the first chunk over the limit, and any
+                   spilled part is deleted.
+        spill_bytes: Uploads larger than this are written to a file under `spill_dir` (0: always).
+        spill_dir: Folder of the spilled files, named `<uuid><suffix>`.
+    """
+    known_size = _spooled_size(source)
+    if known_size is not None and max_bytes is not None and known_size > max_bytes:
+        UPLOADS.inc(storage="rejected")
+        raise UploadTooLargeError(max_bytes)
+    buffer = _memory_buffer(source)
+    if buffer is not None and buffer.tell() == 0 and known_size <= spill_bytes:
+        # getvalue() shares the buffer's bytes object instead of copying it
+        data = buffer.getvalue()
+        UPLOADS.inc(storage="memory")
+        return Upload(filename, hashlib.sha256(data).hexdigest(), known_size, data=data)
+    # Files known to go to disk are spilled from the first chunk instead of buffered up to spill_bytes
+    spill_now = known_size is not None and known_size > spill_bytes
+    digest = hashlib.sha256()
+    chunks: List[bytes] = []
+    size = 0
+    path, spill = None, None
+    try:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+            size += len(chunk)
+            if max_bytes is not None and size > max_bytes:
+                UPLOADS.inc(storage="rejected")
+                raise UploadTooLargeError(max_bytes)
+            digest.update(chunk)
+            if spill is None and (spill_now or size > spill_bytes):
+                path = Path(spill_dir) / f"{uuid4().hex}{suffix}"
+                path.parent.mkdir(parents=True, exist_ok=True)
+                spill = open(path, "xb")
+                for buffered in chunks:
+                    spill.write(buffered)
+                chunks = []
+            if spill is not None:
+                spill.write(chunk)
+            else:
+                chunks.append(chunk)
+    except BaseException:
+        if spill is not None:
+            spill.close()
+            path.unlink(missing_ok=True)
+        raise
+    if spill is not None:
+        spill.close()
+        UPLOADS.inc(storage="disk")
+        return Upload(filename, digest.hexdigest(), size, path=path)
+    UPLOADS.inc(storage="memory")
+    return Upload(filename, digest.hexdigest(), size, data=b"".join(chunks))
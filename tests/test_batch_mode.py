@@ -0,0 +1,76 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from core.batch_mode import BatchPipeline
+from core.document_pipeline import DocumentPipelineManager
+
+CONTRACT = Path(__file__).resolve().parent.parent / "documents" / "Contract.PDF"
+
+
+@pytest.fixture(autouse=True)
+def api_key(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+
+
+def completion(content: str) -> dict:
+    return {"status_code": 200, "body": {"choices": [{"message": {"content": content}}],
+                                         "usage": {"prompt_tokens": 100, "completion_tokens": 10}}}
+
+
+def answer(custom_id: str) -> str:
+    chunk = int(custom_id.rsplit("#", 1)[1])
+    return json.dumps({"parties": ["ACME", f"Party {chunk}"], "effective_date": f"2024-0{1 + chunk % 9}-01",
+                       "termination_date": None, "key_terms": ["Net 30"]})
+
+
+def batch_with_contract(tmp_path, **pipeline_args) -> BatchPipeline:
+    batch = BatchPipeline(DocumentPipelineManager(**pipeline_args), str(tmp_path), client=object())
+    batch.render_classification([("contract", CONTRACT)])
+    return batch
+
+
+def test_chunked_extraction_sends_one_request_per_chunk_and_merges_them(tmp_path):
+    batch = batch_with_contract(tmp_path, extraction_chunk_tokens=300)
+    classifications = {"contract": {"type": "Contract", "confidence": 1.0}}
+    requests = [json.loads(line) for line in open(batch.render_extraction(classifications), encoding="utf-8")]
+
+    extractor = batch.pipeline.get_extractor("Contract")
+    with batch.pipeline.load_document(str(CONTRACT)) as pages:
+        chunks = extractor.build_chunks(pages)
+    assert len(chunks) > 1
+    assert [r["custom_id"] for r in requests] == [f"contract#{i}" for i in range(len(chunks))]
+    assert [r["body"]["messages"][-1]["content"] for r in requests] == \
+        [extractor.messages_for_content(c)[-1]["content"] for c in chunks]
+
+    output = tmp_path / "extraction_output.jsonl"
+    output.write_text("".join(json.dumps({"custom_id": r["custom_id"], "response": completion(answer(r["custom_id"]))}) + "\n"
+                              for r in requests), encoding="utf-8")
+    results = [json.loads(line) for line in open(batch.ingest_extraction(output, classifications), encoding="utf-8")]
+    assert [r["status"] for r in results] == ["success"]
+    metadata = results[0]["metadata"]
+    assert metadata["parties"] == ["ACME"] + [f"Party {i}" for i in range(len(chunks))]
+    assert metadata["effective_date"] == "2024-01-01" and metadata["key_terms"] == ["Net 30"]
+    assert batch.input_tokens == 100 * len(chunks)
+
+
+def test_a_failed_chunk_fails_its_document(tmp_path):
+    batch = batch_with_contract(tmp_path, extraction_chunk_tokens=300)
+    classifications = {"contract": {"type": "Contract", "confidence": 1.0}}
+    requests = [json.loads(line) for line in open(batch.render_extraction(classifications), encoding="utf-8")]
+    lines = [{"custom_id": r["custom_id"], "response": completion(answer(r["custom_id"]))} for r in requests]
+    lines[-1] = {"custom_id": requests[-1]["custom_id"], "response": None, "error": {"message": "Injected failure"}}
+    output = tmp_path / "extraction_output.jsonl"
+    output.write_text("".join(json.dumps(line) + "\n" for line in lines), encoding="utf-8")
+    results = [json.loads(line) for line in open(batch.ingest_extraction(output, classifications), encoding="utf-8")]
+    assert results[0]["status"] == "error" and "Injected failure" in results[0]["error"]
+    # The chunks that did come back still count
+    assert batch.input_tokens == 100 * (len(requests) - 1)
+
+
+def test_unchunked_extraction_keeps_the_document_key_as_custom_id(tmp_path):
+    batch = batch_with_contract(tmp_path)
+    requests = [json.loads(line) for line in
+                open(batch.render_extraction({"contract": {"type": "Contract", "confidence": 1.0}}), encoding="utf-8")]
+    assert [r["custom_id"] for r in requests] == ["contract"]
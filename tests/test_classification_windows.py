@@ -0,0 +1,83 @@
+import asyncio
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from core.document_classification import RunnableGPTLogprobClassifier
+from core.document_pipeline import DEFAULT_CLASSIFICATION_WINDOWS, DocumentPipelineManager
+from core.result_cache import ResultCache
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def completion(label: str, logprob: float = -0.01) -> SimpleNamespace:
+    # Unclear answers (two labels close together) make the classifier widen its window
+    top = [SimpleNamespace(token=label, logprob=logprob), SimpleNamespace(token="Other", logprob=-0.7)]
+    return SimpleNamespace(usage=SimpleNamespace(prompt_tokens=10, completion_tokens=1),
+                           choices=[SimpleNamespace(logprobs=SimpleNamespace(content=[SimpleNamespace(top_logprobs=top)]))])
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    pipeline = DocumentPipelineManager(cache=ResultCache(str(tmp_path / "results.sqlite")),
+                                       classification_windows=DEFAULT_CLASSIFICATION_WINDOWS)
+    requests = []
+
+    def create(**request):
+        requests.append(request)
+        return completion("Contract", logprob=-0.6)
+
+    async def acreate(**request):
+        return create(**request)
+
+    classifier = pipeline.classifier
+    classifier.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    classifier.async_client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=acreate)))
+    pipeline.requests = requests
+    yield pipeline
+    pipeline.close()
+
+
+def count_builds(monkeypatch) -> list:
+    steps = []
+    build_content = RunnableGPTLogprobClassifier.build_content
+
+    def counted(self, pages, step=-1):
+        steps.append(step)
+        return build_content(self, pages, step)
+
+    monkeypatch.setattr(RunnableGPTLogprobClassifier, "build_content", counted)
+    return steps
+
+
+def test_window_text_is_built_once_for_the_cache_key_and_the_request(pipeline, monkeypatch):
+    steps = count_builds(monkeypatch)
+    with pipeline.load_document(str(REPO_ROOT / "documents" / "Contract.PDF")) as pages:
+        output = pipeline.classify(pages)
+    assert output == {"type": "Contract", "confidence": output["confidence"]}
+    assert len(pipeline.requests) == len(DEFAULT_CLASSIFICATION_WINDOWS)
+    assert steps == list(range(len(DEFAULT_CLASSIFICATION_WINDOWS)))
+
+
+@pytest.mark.parametrize("run", ["sync", "async"])
+def test_both_paths_save_the_pages_they_parsed(pipeline, run):
+    path = str(REPO_ROOT / "documents" / "Contract.PDF")
+    with pipeline.load_document(path) as pages:
+        if run == "sync":
+            pipeline.classify(pages)
+        else:
+            asyncio.run(pipeline.aclassify(pages))
+    cached = pipeline.cache.get_pages(pipeline._pages_cache_key(pages.file_hash))
+    assert cached is not None and len(cached[1]) == min(len(pages), pipeline.max_pages_classification)
+
+
+def test_analyze_releases_the_pdf_handle(pipeline, monkeypatch):
+    pages = pipeline.load_document(str(REPO_ROOT / "documents" / "Contract.PDF"))
+    monkeypatch.setattr(pipeline, "extract_metadata", lambda pages, doc_type, usage=None, hint=None: {})
+    classification, _ = pipeline.analyze(pages)
+    assert classification["type"] == "Contract"
+    assert pages._pdf is None
+    # Pages the stages did not read are still available
+    assert pages[-1]["text"] is not None
@@ -0,0 +1,159 @@
+import sqlite3
+
+import pytest
+
+from core.action_generator import generate_actions
+from core.document_store import DocumentStore, decode_cursor, encode_cursor
+
+
+def invoice(id: str, confidence: float = 0.9, due_date=None) -> dict:
+    return {
+        "id": id,
+        "classification": {"type": "Invoice", "confidence": confidence},
+        "metadata": {"vendor": "Acme", "amount": 10, "due_date": due_date},
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = DocumentStore(str(tmp_path / "documents.sqlite"))
+    yield store
+    store.close()
+
+
+def pages(list_page, limit: int = 3, **filters) -> list:
+    """Every page of a listing, following the cursors."""
+    result, cursor = [], None
+    while True:
+        items, cursor = list_page(limit=limit, cursor=cursor, **filters)
+        result.append(items)
+        if cursor is None:
+            return result
+
+
+def contract(id: str, **metadata) -> dict:
+    return {
+        "id": id,
+        "classification": {"type": "Contract", "confidence": 0.9},
+        "metadata": {"parties": None, "effective_date": None, "termination_date": None, "key_terms": None, **metadata},
+    }
+
+
+def test_contract_with_null_parties_is_stored_with_its_actions(tmp_path):
+    store = DocumentStore(str(tmp_path / "documents.sqlite"))
+    try:
+        store.put(contract("c1", termination_date="2026-12-31"))
+        assert store.get("c1")["metadata"]["parties"] is None
+        actions = store.get_actions("c1")
+        assert [a["type"] for a in actions] == ["print_contract", "review_contract", "sign_contract"]
+        assert all("unknown parties" in a["description"] for a in actions)
+    finally:
+        store.close()
+
+
+def test_generate_actions_never_raises_on_malformed_metadata():
+    assert generate_actions("Contract", {"parties": [None, "Acme"]})[0]["description"] == "Print contract with Acme."
+    assert generate_actions("Invoice", {"vendor": None, "amount": None, "due_date": "not a date"})[0]["deadline"] is None
+    # A generator that cannot handle the metadata falls back to a human review
+    assert [a["type"] for a in generate_actions("Contract", {"parties": 42})] == ["human_review"]
+    assert [a["type"] for a in generate_actions("Invoice", None)] == ["talk_to_finance_team"]
+
+
+def test_cursor_round_trip():
+    for values in [(0.5, "doc-1"), ("2026-01-31", "a/b+c=", 3), (1.7e9, "")]:
+        cursor = encode_cursor(values)
+        assert cursor.isascii() and "/" not in cursor and "+" not in cursor
+        assert decode_cursor(cursor) == values
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor")
+
+
+def test_listings_page_through_every_document_once_in_order(store):
+    # Ties on the sort key (equal confidences) are ordered by id
+    store.put_many(invoice(f"inv-{i:02d}", confidence=[0.5, 0.7, 0.9][i % 3], due_date=f"2026-01-{10 + i % 5:02d}")
+                   for i in range(10))
+
+    by_confidence = [d["id"] for page in pages(store.list, min_confidence=0.0) for d in page]
+    assert by_confidence == sorted(by_confidence, key=lambda id: (store.get(id)["classification"]["confidence"], id))
+
+    by_due_date = [d["id"] for page in pages(store.list, date_field="due_date", date_from="2026-01-11") for d in page]
+    assert by_due_date == sorted((d for d in by_confidence if d[-1] not in "05"),
+                                 key=lambda id: (store.get(id)["metadata"]["due_date"], id))
+
+    newest_first = pages(store.list, limit=4)
+    assert [len(page) for page in newest_first] == [4, 4, 2]
+    assert sorted(d["id"] for page in newest_first for d in page) == sorted(by_confidence)
+
+
+def test_action_listing_pages_in_deadline_order(store):
+    store.put_many(invoice(f"inv-{i}", due_date=f"2026-02-{1 + i:02d}") for i in range(4))
+    store.put(invoice("inv-none"))
+    actions = [a for page in pages(store.list_actions, limit=2) for a in page]
+    assert len(actions) == store.count_actions()
+    deadlines = [a["deadline"] for a in actions]
+    dated = [d for d in deadlines if d is not None]
+    assert dated == sorted(dated) and deadlines[len(dated):] == [None] * (len(deadlines) - len(dated))
+
+
+def test_opening_an_old_store_builds_the_action_index(tmp_path):
+    path = str(tmp_path / "documents.sqlite")
+    store = DocumentStore(path)
+    store.put(invoice("inv-1", due_date="2026-03-01"))
+    store.close()
+    # A file written before the action index: no actions, schema version 0
+    conn = sqlite3.connect(path)
+    conn.execute("DELETE FROM actions")
+    conn.execute("PRAGMA user_version = 0")
+    conn.commit()
+    conn.close()
+
+    store = DocumentStore(path)
+    try:
+        assert [a["deadline"] for a in store.get_actions("inv-1")][:1] == ["2026-03-01"]
+    finally:
+        store.close()
+
+
+def test_replacement_log_keeps_one_row_per_existing_document(tmp_path):
+    path = str(tmp_path / "documents.sqlite")
+    store, other = DocumentStore(path), DocumentStore(path)
+    try:
+        store.put(invoice("inv-1", confidence=0.5))
+        assert other.get("inv-1")["classification"]["confidence"] == 0.5
+        for confidence in (0.6, 0.7, 0.8):
+            store.put(invoice("inv-1", confidence=confidence))
+            # Every re-analysis still reaches the other process's memory cache
+            assert other.get("inv-1")["classification"]["confidence"] == confidence
+        rows = store._conn.execute("SELECT id FROM replacements").fetchall()
+        assert rows == [("inv-1",)]
+    finally:
+        store.close()
+        other.close()
+
+    # Replacements of documents deleted from the file are dropped on open (all but the last,
+    # which keeps the sequence numbers from going back)
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO replacements (id) VALUES (?)", [("gone-1",), ("gone-2",)])
+    conn.commit()
+    conn.close()
+    store = DocumentStore(path)
+    try:
+        assert store._conn.execute("SELECT id FROM replacements ORDER BY seq").fetchall() == [("inv-1",), ("gone-2",)]
+    finally:
+        store.close()
+
+
+@pytest.mark.parametrize("value, deadline", [
+    ("2026-03-05", "2026-03-05"),
+    ("2026-03-05T12:00:00", "2026-03-05"),
+    ("March 5, 2026", "2026-03-05"),
+    ("5 March 2026", "2026-03-05"),
+    ("31/12/2026", "2026-12-31"),
+    # Day and month could be swapped
+    ("03/05/2026", None),
+    ("upon delivery", None),
+    (None, None),
+])
+def test_deadlines_written_with_month_names_are_kept(value, deadline):
+    actions = generate_actions("Invoice", {"vendor": "Acme", "amount": 10, "due_date": value})
+    assert actions[0]["deadline"] == deadline
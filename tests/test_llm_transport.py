@@ -0,0 +1,76 @@
+import asyncio
+
+import httpx
+import pytest
+
+from core.document_pipeline import DocumentPipelineManager
+from core.llm_transport import LLMTransport, _AsyncTransport, _Transport
+
+URL = "https://api.openai.test/v1/chat/completions"
+
+
+def transport_with(responses: list, max_attempts: int = 3) -> LLMTransport:
+    """A transport whose requests get `responses` in turn (a status code, or an exception to raise)."""
+    transport = LLMTransport(max_concurrency=2, max_attempts=max_attempts, backoff_base=0)
+    transport.sent = 0
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        response = responses[min(transport.sent, len(responses) - 1)]
+        transport.sent += 1
+        if isinstance(response, Exception):
+            raise response
+        # A body streamed like the network's (a `json=` body is read before the transport sees it)
+        return httpx.Response(response, headers={"retry-after": "0"} if response == 429 else {},
+                              stream=httpx.ByteStream(b"{}"))
+
+    mock = httpx.MockTransport(handler)
+    transport.http_client = httpx.Client(transport=_Transport(transport, mock))
+    transport.http_async_client = httpx.AsyncClient(transport=_AsyncTransport(transport, mock))
+    return transport
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_retryable_statuses_are_retried(status):
+    transport = transport_with([status, 200])
+    response = transport.http_client.post(URL, json={"messages": []})
+    assert response.status_code == 200
+    assert transport.sent == 2
+    assert transport.stats()["in_flight"] == 0
+
+
+def test_async_requests_are_retried_and_the_last_answer_returned():
+    transport = transport_with([503])
+
+    async def post():
+        return await transport.http_async_client.post(URL, json={"messages": []})
+
+    assert asyncio.run(post()).status_code == 503
+    assert transport.sent == 3
+    assert transport.stats()["in_flight"] == 0
+
+
+def test_client_errors_are_not_retried():
+    transport = transport_with([400, 200])
+    assert transport.http_client.post(URL, json={}).status_code == 400
+    assert transport.sent == 1
+
+
+@pytest.mark.parametrize("error", [httpx.ConnectError("refused"), RuntimeError("bug")])
+def test_slots_are_released_when_a_request_fails(error):
+    transport = transport_with([error])
+    with pytest.raises(type(error)):
+        transport.http_client.post(URL, json={})
+    assert transport.stats()["in_flight"] == 0
+
+
+def test_every_runnable_shares_the_pipeline_transport(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    pipeline = DocumentPipelineManager(cache=None)
+    transport = pipeline.transport
+    classifier, extractor = pipeline.classifier, pipeline.get_extractor("Invoice")
+    assert classifier.client._client is transport.http_client
+    assert classifier.async_client._client is transport.http_async_client
+    assert extractor.llm.root_client._client is transport.http_client
+    assert extractor.llm.root_async_client._client is transport.http_async_client
+    asyncio.run(pipeline.aclose())
+    assert transport.http_client.is_closed and transport.http_async_client.is_closed
@@ -0,0 +1,191 @@
+import httpx
+import pytest
+from langchain_core.messages import AIMessage
+from openai import BadRequestError
+
+from core.metadata_extraction import (RunnableMetadataExtractor, merge_contract_metadata, merge_invoice_metadata,
+                                      merge_report_metadata, repair_json)
+from core.metadata_schemas import ContractMetadata, InvoiceMetadata, KeyMetric, LineItem, ReportMetadata
+
+HINT = {"vendor": "ACME", "amount": 120.0}
+
+
+@pytest.fixture(autouse=True)
+def api_key(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+
+
+def test_structured_extraction_sends_the_hint_as_its_own_message():
+    extractor = RunnableMetadataExtractor("Invoice")
+    plain = extractor.messages_for_content("Invoice 42")
+    hinted = extractor.messages_for_content("Invoice 42", HINT)
+    assert extractor.uses_hint(HINT) and extractor.hint_savings(HINT) == 0
+    assert [m["role"] for m in hinted] == ["system", "user", "assistant", "user"]
+    assert '"vendor":"ACME"' in hinted[2]["content"]
+    assert hinted[0] == plain[0] and hinted[-1] == plain[-1]
+
+
+def test_free_form_extraction_replaces_the_schema_with_the_hint():
+    extractor = RunnableMetadataExtractor("Invoice", structured_output=False)
+    hinted = extractor.messages_for_content("Invoice 42", HINT)
+    assert extractor.uses_hint(HINT) and extractor.hint_savings(HINT) > 0
+    assert len(hinted) == 2
+    assert '"vendor":"ACME"' in hinted[-1]["content"]
+    assert "properties" not in hinted[-1]["content"]
+
+
+@pytest.mark.parametrize("content, expected", [
+    ('{"vendor": "ACME", "amount": 120.5, "line_items": [{"description": "Pens", "quantity": 2',
+     {"vendor": "ACME", "amount": 120.5, "line_items": [{"description": "Pens", "quantity": 2}]}),
+    ('{"vendor": "ACME", "line_items": [{"description": "Pens",},],}', {"vendor": "ACME", "line_items": [{"description": "Pens"}]}),
+    ('Here is the metadata:\n```json\n{"vendor": "ACME", "amount": 12}\n```\nDone.', {"vendor": "ACME", "amount": 12}),
+    ("{'vendor': 'ACME', 'due_date': None}", {"vendor": "ACME", "due_date": None}),
+    ("No invoice data found.", None),
+])
+def test_repair_json_reads_near_valid_answers(content, expected):
+    assert repair_json(content) == expected
+
+
+def test_repaired_answers_fill_in_missing_fields():
+    extractor = RunnableMetadataExtractor("Invoice")
+    metadata = extractor.parse_content('```json\n{"vendor": "ACME", "amount": 120.0, "line_items": [')
+    assert metadata.vendor == "ACME" and metadata.amount == 120.0
+    assert metadata.due_date is None and metadata.line_items == []
+
+
+class RejectingChat:
+    """Stands in for the schema-bound model: the API refuses the `response_format`."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def invoke(self, messages):
+        self.calls += 1
+        request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+        raise BadRequestError("Invalid parameter: 'response_format' of type 'json_schema' is not supported with this model.",
+                              response=httpx.Response(400, request=request),
+                              body={"param": "response_format"})
+
+
+class FreeFormChat:
+    def __init__(self):
+        self.messages = []
+
+    def invoke(self, messages):
+        self.messages.append(messages)
+        return AIMessage(content='{"vendor": "ACME", "amount": 120.0, "line_items": [],}')
+
+
+def test_rejected_schema_falls_back_to_free_form_prompts():
+    extractor = RunnableMetadataExtractor("Invoice")
+    rejecting, free_form = RejectingChat(), FreeFormChat()
+    extractor.chat = rejecting
+    extractor.llm = free_form
+    pages = [{"page": 1, "text": "Invoice 42 from ACME, total 120.00"}]
+    metadata = extractor.invoke(pages)
+    assert metadata.vendor == "ACME" and metadata.amount == 120.0
+    assert rejecting.calls == 1 and not extractor.structured_output
+    # The resent prompt carries the format instructions the schema had replaced
+    prompt = free_form.messages[0][-1]["content"]
+    assert "properties" in prompt and "Invoice 42 from ACME" in prompt
+    assert prompt == extractor.build_messages(pages)[-1]["content"]
+    # Later calls go straight to the free-form model
+    extractor.invoke([{"page": 1, "text": "Invoice 43"}])
+    assert rejecting.calls == 1 and len(free_form.messages) == 2
+
+
+def test_other_bad_requests_are_not_retried_free_form():
+    extractor = RunnableMetadataExtractor("Invoice")
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    error = BadRequestError("This model's maximum context length is 128000 tokens.",
+                            response=httpx.Response(400, request=request), body={"param": "messages"})
+
+    class Failing:
+        def invoke(self, messages):
+            raise error
+
+    extractor.chat = Failing()
+    with pytest.raises(BadRequestError):
+        extractor.invoke([{"page": 1, "text": "Invoice 42"}])
+    assert extractor.structured_output
+
+
+def invoice_part(vendor=None, amount=None, due_date=None, line_items=None):
+    return InvoiceMetadata(vendor=vendor, amount=amount, due_date=due_date, line_items=line_items)
+
+
+def test_merge_keeps_one_copy_of_line_items_repeated_across_chunks():
+    pens, paper = LineItem(description="Pens", quantity=2, amount=4.0), LineItem(description="Paper", quantity=1, amount=9.5)
+    merged = merge_invoice_metadata([
+        invoice_part(line_items=[pens, paper]),
+        # The overlap of the next chunk repeats the last item, with different spacing and case
+        invoice_part(line_items=[LineItem(description="  PAPER ", quantity=1, amount=9.5),
+                                 LineItem(description="Paper", quantity=3, amount=28.5)]),
+    ])
+    assert [(i.description, i.quantity) for i in merged.line_items] == [("Pens", 2), ("Paper", 1), ("Paper", 3)]
+
+
+def test_merge_takes_the_last_total_and_the_first_vendor_and_due_date():
+    merged = merge_invoice_metadata([
+        invoice_part(vendor="ACME", amount=40.0, due_date="2024-03-05"),  # a subtotal on page 1
+        invoice_part(vendor="Bank of Examples", amount=None),
+        invoice_part(amount=120.0, due_date="2024-04-01"),
+    ])
+    assert (merged.vendor, merged.amount, merged.due_date) == ("ACME", 120.0, "2024-03-05")
+
+
+def test_merge_fills_fields_missing_from_some_chunks():
+    merged = merge_invoice_metadata([invoice_part(vendor=""), invoice_part(due_date="2024-03-05", line_items=[]),
+                                     invoice_part(vendor="ACME")])
+    assert (merged.vendor, merged.amount, merged.due_date, merged.line_items) == ("ACME", None, "2024-03-05", None)
+
+
+def test_contract_merge_spans_the_earliest_and_latest_dates():
+    merged = merge_contract_metadata([
+        ContractMetadata(parties=["ACME", "Globex"], effective_date="2024-02-01", termination_date="not stated",
+                         key_terms=["Net 30"]),
+        ContractMetadata(parties=["globex", "Initech"], effective_date="2024-01-15", termination_date="2026-01-31",
+                         key_terms=None),
+    ])
+    assert merged.parties == ["ACME", "Globex", "Initech"]
+    assert (merged.effective_date, merged.termination_date) == ("2024-01-15", "2026-01-31")
+    assert merged.key_terms == ["Net 30"]
+
+
+def test_report_merge_keeps_the_first_value_of_each_metric():
+    merged = merge_report_metadata([
+        ReportMetadata(reporting_period=None, key_metrics=[KeyMetric(name="Revenue", value="$1.2B")],
+                       executive_summary="Strong quarter."),
+        ReportMetadata(reporting_period="Q1 2024", key_metrics=[KeyMetric(name="revenue", value="$1.1B"),
+                                                                KeyMetric(name="EPS", value="$0.42")],
+                       executive_summary="Outlook."),
+    ])
+    assert merged.reporting_period == "Q1 2024" and merged.executive_summary == "Strong quarter."
+    assert [(m.name, m.value) for m in merged.key_metrics] == [("Revenue", "$1.2B"), ("EPS", "$0.42")]
+
+
+class ChunkChat:
+    """Answers each chunk with the partial metadata keyed by a marker in its text."""
+
+    def __init__(self, answers):
+        self.answers = answers
+
+    def invoke(self, messages):
+        prompt = messages[-1]["content"]
+        return AIMessage(content=next(a for marker, a in self.answers.items() if marker in prompt))
+
+
+def test_chunked_extraction_merges_the_partial_answers_in_page_order():
+    extractor = RunnableMetadataExtractor("Invoice", chunk_tokens=40)
+    extractor.chat = ChunkChat({
+        "PAGE-ONE": '{"vendor": "ACME", "amount": null, "due_date": null, '
+                    '"line_items": [{"description": "Pens", "quantity": 2, "amount": 4.0}]}',
+        "PAGE-TWO": '{"vendor": null, "amount": 120.0, "due_date": "2024-03-05", '
+                    '"line_items": [{"description": "pens", "quantity": 2, "amount": 4.0}]}',
+    })
+    pages = [{"page": 1, "text": "PAGE-ONE " + "Pens 2 x 2.00 = 4.00. " * 6},
+             {"page": 2, "text": "PAGE-TWO " + "Total due 120.00 by 2024-03-05. " * 6}]
+    assert len(extractor.build_chunks(pages)) == 2
+    merged = extractor.invoke(pages)
+    assert (merged.vendor, merged.amount, merged.due_date) == ("ACME", 120.0, "2024-03-05")
+    assert [i.description for i in merged.line_items] == ["Pens"]
@@ -0,0 +1,25 @@
+from core.document_pipeline import DEFAULT_CLASSIFICATION_WINDOWS, DocumentPipelineManager
+from core.near_duplicates import NearDuplicateIndex
+
+
+def pages(count: int) -> list:
+    return [{"page": i + 1, "text": f"page {i} " + " ".join(f"word{i}x{j}" for j in range(40))} for i in range(count)]
+
+
+def test_signature_covers_the_first_classification_window_only(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "index.sqlite"))
+    pipeline = DocumentPipelineManager(cache=None, near_duplicates=index,
+                                       classification_windows=DEFAULT_CLASSIFICATION_WINDOWS)
+    document = pages(12)
+    assert pipeline.signature_pages() == 1
+    signature, match = pipeline._find_near_duplicate(document)
+    assert match is None
+    assert (signature == index.signature(document[:1])).all()
+    # The streaming path only has the classification window loaded: same signature
+    assert (pipeline._find_near_duplicate(document[:pipeline.max_pages_classification])[0] == signature).all()
+
+
+def test_signature_without_windows_is_capped_by_the_index(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "index.sqlite"))
+    pipeline = DocumentPipelineManager(cache=None, near_duplicates=index, max_pages_classification=10)
+    assert pipeline.signature_pages() == index.max_pages == 2
@@ -0,0 +1,52 @@
+import hashlib
+import io
+import tracemalloc
+from tempfile import SpooledTemporaryFile
+
+import pytest
+
+from core.uploads import UploadTooLargeError, read_upload
+
+MiB = 1024 * 1024
+
+
+def spooled(content: bytes, max_size: int) -> SpooledTemporaryFile:
+    """A file as Starlette hands it over: spooled in memory up to `max_size`, else on disk."""
+    file = SpooledTemporaryFile(max_size=max_size)
+    file.write(content)
+    file.seek(0)
+    return file
+
+
+def test_large_in_memory_upload_is_not_copied():
+    content = b"%PDF" + bytes(24 * MiB)
+    file = spooled(content, max_size=32 * MiB)
+    upload = read_upload(file, "big.pdf", spill_bytes=32 * MiB)
+    assert upload.path is None and upload.size == len(content)
+    # The upload holds the spooled file's own bytes object
+    assert upload.data is file._file.getvalue()
+    assert upload.sha256 == hashlib.sha256(content).hexdigest()
+
+
+def test_upload_over_the_spill_size_goes_to_disk_in_chunks(tmp_path):
+    content = b"%PDF" + bytes(12 * MiB)
+    file = spooled(content, max_size=MiB)
+    tracemalloc.start()
+    try:
+        upload = read_upload(file, "big.pdf", spill_bytes=4 * MiB, spill_dir=tmp_path)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # One chunk at a time, nothing buffered before spilling
+    assert peak < 3 * MiB
+    with upload:
+        assert upload.data is None and upload.path.read_bytes() == content
+        assert upload.sha256 == hashlib.sha256(content).hexdigest()
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize("source", [lambda c: io.BytesIO(c), lambda c: spooled(c, max_size=MiB)])
+def test_uploads_over_the_limit_are_rejected_without_files_left(tmp_path, source):
+    with pytest.raises(UploadTooLargeError):
+        read_upload(source(bytes(2 * MiB)), "big.pdf", max_bytes=MiB, spill_bytes=0, spill_dir=tmp_path)
+    assert list(tmp_path.iterdir()) == []